@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Copias de seguridad del fichero de datos del bot
+
+Las copias se hacen en un proceso hijo creado con fork(): el hijo ve una
+foto coherente de los datos en memoria (copy-on-write) y la comprime y
+escribe mientras el bucle de eventos del padre sigue atendiendo a los
+usuarios. Se guardan comprimidas con gzip y se conservan las más recientes.
+
+Restaurar valida la copia antes de sustituir el fichero de datos.
+
+Uso:
+    python backups.py list series_data.json
+    python backups.py restore series_data.json [copia.json.gz]
+"""
+
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 24
+BACKUP_SUFFIX = ".json.gz"
+
+
+def validate_data(data) -> Dict:
+    """Comprueba que los datos tienen la estructura del bot; devuelve los datos o lanza ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("los datos no son un objeto JSON")
+    for key, value in data.items():
+        if key.isdigit() and not (isinstance(value, dict) and isinstance(value.get("series"), dict)):
+            raise ValueError(f"usuario {key} con estructura no válida")
+        if key.startswith("-") and isinstance(value, dict) and value.get("group") and \
+                not (isinstance(value.get("series"), dict) and isinstance(value.get("members"), dict)):
+            raise ValueError(f"grupo {key} con estructura no válida")
+    return data
+
+
+def _prefix(data_file: str) -> str:
+    return os.path.splitext(os.path.basename(data_file))[0] + "-"
+
+
+def list_backups(data_file: str, backup_dir: str = BACKUP_DIR) -> List[str]:
+    """Copias del fichero de datos, de la más reciente a la más antigua"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _prefix(data_file)
+    names = [name for name in os.listdir(backup_dir) if name.startswith(prefix) and name.endswith(BACKUP_SUFFIX)]
+    # El nombre lleva la fecha en formato ordenable
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def write_backup(data: Dict, data_file: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> str:
+    """Escribe una copia comprimida de los datos y borra las que sobran"""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    path = os.path.join(backup_dir, f"{_prefix(data_file)}{stamp}{BACKUP_SUFFIX}")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    for old in list_backups(data_file, backup_dir)[keep:]:
+        os.remove(old)
+    return path
+
+
+def snapshot_in_background(data: Dict, data_file: str, backup_dir: str = BACKUP_DIR,
+                           keep: int = BACKUP_KEEP) -> int:
+    """Hace la copia en un proceso hijo y devuelve su pid (hay que esperarlo con os.waitpid)
+
+    El hijo no debe usar logging ni nada que dependa de otros hilos del padre:
+    solo serializa, escribe y termina con os._exit.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            write_backup(data, data_file, backup_dir, keep)
+            status = 0
+        finally:
+            os._exit(status)
+    return pid
+
+
+def read_backup(path: str) -> Dict:
+    """Lee y valida una copia; lanza ValueError/OSError si no sirve"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON no válido: {e}") from e
+    return validate_data(data)
+
+
+def load_latest_backup(data_file: str, backup_dir: str = BACKUP_DIR) -> Optional[Tuple[Dict, str]]:
+    """Datos de la copia válida más reciente y su ruta, o None si no hay ninguna"""
+    for path in list_backups(data_file, backup_dir):
+        try:
+            return read_backup(path), path
+        except (OSError, ValueError, EOFError):
+            continue
+    return None
+
+
+def restore(data_file: str, backup_path: Optional[str] = None, backup_dir: str = BACKUP_DIR) -> str:
+    """Sustituye el fichero de datos por una copia validada; devuelve la copia usada"""
+    if backup_path:
+        data = read_backup(backup_path)
+    else:
+        latest = load_latest_backup(data_file, backup_dir)
+        if latest is None:
+            raise ValueError(f"no hay copias válidas de {data_file} en {backup_dir}")
+        data, backup_path = latest
+
+    if os.path.exists(data_file):
+        os.replace(data_file, f"{data_file}.before-restore")
+    tmp_path = f"{data_file}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, data_file)
+    return backup_path
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) == 3 and argv[1] == "list":
+        for path in list_backups(argv[2]):
+            print(f"{os.path.getsize(path):>12}  {path}")
+        return 0
+    if len(argv) in (3, 4) and argv[1] == "restore":
+        started = time.perf_counter()
+        used = restore(argv[2], argv[3] if len(argv) == 4 else None)
+        print(f"{argv[2]} restaurado desde {used} en {time.perf_counter() - started:.2f}s")
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Logging sin bloqueos para el bot
+
+Los manejadores del bucle de eventos solo meten el registro en una cola
+acotada (QueueHandler); un hilo aparte (QueueListener) le da formato y lo
+escribe. El formato se hace en ese hilo, por eso los mensajes deben usar
+formato perezoso con % (logger.info("... %s", valor)) y no f-strings.
+
+Cada tipo de mensaje (logger + plantilla) se muestrea: como mucho
+LOG_SAMPLE_LIMIT registros por ventana de LOG_SAMPLE_WINDOW segundos; el
+resto se descarta y se cuenta en el campo "suppressed" del siguiente
+registro que pase. Así, una caída de TMDB que genera miles de errores
+iguales cuesta lo mismo que unos pocos.
+
+Variables de entorno:
+    LOG_LEVEL   nivel mínimo (INFO por defecto)
+    LOG_FORMAT  "json" (por defecto) o "text"
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_WINDOW = 10.0  # segundos
+LOG_SAMPLE_LIMIT = 20  # registros por tipo de mensaje y ventana
+
+# Campos opcionales que los manejadores añaden con extra={...}
+STRUCTURED_FIELDS = ('user_id', 'chat_id', 'callback', 'latency_ms', 'tmdb_status', 'endpoint',
+                     'suppressed', 'dropped')
+
+
+class SamplingFilter(logging.Filter):
+    """Limita cuántos registros de cada tipo de mensaje pasan por ventana"""
+
+    def __init__(self, limit: int = LOG_SAMPLE_LIMIT, window: float = LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (logger, plantilla) -> [inicio de la ventana, emitidos, suprimidos]
+        self._windows: Dict[Tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.CRITICAL:
+            return True
+        now = time.monotonic()
+        key = (record.name, str(record.msg))
+        state = self._windows.get(key)
+        if state is None:
+            self._windows[key] = [now, 1, 0]
+            return True
+        if now - state[0] >= self.window:
+            suppressed = state[2]
+            state[:] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if state[1] < self.limit:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: si la cola está llena descarta y cuenta"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Sin formatear aquí: el mensaje se compone en el hilo del QueueListener
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos estructurados que tenga"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato clásico legible, con los campos estructurados al final"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [f"{field}={getattr(record, field)}" for field in STRUCTURED_FIELDS
+                  if getattr(record, field, None) is not None]
+        return f"{text} [{' '.join(fields)}]" if fields else text
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> logging.handlers.QueueListener:
+    """Configura el logging raíz con cola + hilo escritor; se puede volver a llamar tras un fork"""
+    global _listener
+    if _listener is not None:
+        # Tras un fork el hilo del padre ya no existe en el hijo y stop() vuelve enseguida
+        _listener.stop()
+
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "json")).lower()
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # Las peticiones HTTP de PTB/httpx generan un INFO por llamada
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """Vacía la cola y detiene el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Mosaicos de pósters para la vista visual de las listas
+
+Las miniaturas de los pósters se descargan una sola vez y se guardan en
+disco. El mosaico de una página se compone en un proceso aparte (redimensionar
+y comprimir imágenes bloquearía el bucle de eventos) y se guarda en una caché
+direccionada por contenido: el nombre del fichero es un hash de las rutas de
+los pósters en orden, así que la misma página produce siempre el mismo
+fichero y nunca hay que invalidar nada.
+
+Pillow es opcional: sin él la vista visual simplemente no se ofrece.
+"""
+
+import hashlib
+import importlib.util
+import os
+from typing import Optional, Sequence
+
+COLLAGE_DIR = "collages"
+COLLAGE_CACHE_MAX_FILES = 500
+COLLAGE_COLUMNS = 4
+# Tamaño w154 de las imágenes de TMDB (proporción 2:3)
+THUMB_WIDTH = 154
+THUMB_HEIGHT = 231
+TILE_GAP = 6
+BACKGROUND_COLOR = (24, 24, 24)
+PLACEHOLDER_COLOR = (64, 64, 64)
+
+
+def pillow_available() -> bool:
+    """Indica si Pillow está instalado"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def collage_key(poster_paths: Sequence[Optional[str]]) -> str:
+    """Clave del mosaico: depende solo de los pósters y de su orden"""
+    return hashlib.sha256("\n".join(path or "" for path in poster_paths).encode("utf-8")).hexdigest()[:32]
+
+
+def collage_path(key: str, collage_dir: str = COLLAGE_DIR) -> str:
+    return os.path.join(collage_dir, f"{key}.jpg")
+
+
+def thumb_path(poster_path: str, thumb_dir: str) -> str:
+    """Fichero local de la miniatura de un póster de TMDB"""
+    return os.path.join(thumb_dir, hashlib.sha1(poster_path.encode("utf-8")).hexdigest() + ".jpg")
+
+
+def prune_collages(collage_dir: str = COLLAGE_DIR, keep: int = COLLAGE_CACHE_MAX_FILES) -> None:
+    """Borra los mosaicos menos usados recientemente si hay demasiados"""
+    try:
+        entries = [entry for entry in os.scandir(collage_dir) if entry.name.endswith(".jpg")]
+    except FileNotFoundError:
+        return
+    if len(entries) <= keep:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def render_collage(thumb_files: Sequence[Optional[str]], output_path: str,
+                   columns: int = COLLAGE_COLUMNS) -> str:
+    """Compone las miniaturas en una cuadrícula numerada y la guarda como JPEG
+
+    Se ejecuta en un proceso del pool: recibe y devuelve solo rutas.
+    Las miniaturas que faltan se dibujan como un hueco gris con su número.
+    """
+    from PIL import Image, ImageDraw, ImageOps
+
+    count = len(thumb_files)
+    cols = min(columns, count)
+    rows = -(-count // columns)
+    canvas = Image.new("RGB", (cols * THUMB_WIDTH + (cols + 1) * TILE_GAP,
+                               rows * THUMB_HEIGHT + (rows + 1) * TILE_GAP), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(canvas)
+
+    for i, path in enumerate(thumb_files):
+        x = TILE_GAP + (i % columns) * (THUMB_WIDTH + TILE_GAP)
+        y = TILE_GAP + (i // columns) * (THUMB_HEIGHT + TILE_GAP)
+        tile = None
+        if path:
+            try:
+                with Image.open(path) as image:
+                    tile = ImageOps.fit(image.convert("RGB"), (THUMB_WIDTH, THUMB_HEIGHT))
+            except OSError:
+                tile = None
+        if tile is not None:
+            canvas.paste(tile, (x, y))
+        else:
+            draw.rectangle((x, y, x + THUMB_WIDTH - 1, y + THUMB_HEIGHT - 1), fill=PLACEHOLDER_COLOR)
+        # Número de la serie en la leyenda del mensaje
+        draw.rectangle((x, y, x + 26, y + 20), fill=(0, 0, 0))
+        draw.text((x + 6, y + 4), str(i + 1), fill=(255, 255, 255))
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    canvas.save(tmp_path, "JPEG", quality=85, optimize=True)
+    os.replace(tmp_path, output_path)
+    prune_collages(os.path.dirname(output_path) or ".")
+    return output_path
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Recomendaciones de series a partir de las listas de todos los usuarios
+
+Se construye una matriz dispersa usuario × serie con las series que sigue
+cada usuario, se calcula la similitud coseno entre series (item-item) y se
+precalcula una tabla con las K mejores sugerencias de cada usuario. El
+cálculo está pensado para ejecutarse en un proceso aparte, leyendo
+directamente los ficheros de datos.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Series seguidas por menos usuarios no se tienen en cuenta (demasiado ruido)
+MIN_SUBSCRIBERS = 2
+
+
+def read_user_items(data_files: Iterable[str]) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    """Lee las series de cada usuario y el nombre de cada serie desde los ficheros de datos"""
+    user_items: Dict[str, List[str]] = {}
+    names: Dict[str, str] = {}
+    for path in data_files:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for user_key, user_data in data.items():
+            if not user_key.isdigit() or not isinstance(user_data, dict):
+                continue
+            series = user_data.get("series")
+            if not isinstance(series, dict) or not series:
+                continue
+            user_items[user_key] = list(series)
+            for series_key, series_data in series.items():
+                if isinstance(series_data, dict) and series_key not in names:
+                    names[series_key] = series_data.get('name', '')
+    return user_items, names
+
+
+def compute_recommendations(user_items: Dict[str, List[str]], top_k: int = 10) -> Dict[str, List[Tuple[str, float]]]:
+    """Calcula las K series más recomendables para cada usuario"""
+    import numpy as np
+    from scipy import sparse
+
+    counts: Dict[str, int] = {}
+    for items in user_items.values():
+        for item in items:
+            counts[item] = counts.get(item, 0) + 1
+    item_ids = [item for item, count in counts.items() if count >= MIN_SUBSCRIBERS]
+    if not item_ids:
+        return {}
+    item_index = {item: i for i, item in enumerate(item_ids)}
+    users = [user for user, items in user_items.items() if any(item in item_index for item in items)]
+
+    rows, cols = [], []
+    for row, user in enumerate(users):
+        for item in user_items[user]:
+            col = item_index.get(item)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(users), len(item_ids))
+    )
+
+    # Similitud coseno entre series: co-seguimientos / sqrt(seguidores_i * seguidores_j)
+    co_tracking = (matrix.T @ matrix).tocsr()
+    co_tracking.setdiag(0)
+    co_tracking.eliminate_zeros()
+    inv_norms = sparse.diags(1.0 / np.sqrt(np.asarray(matrix.sum(axis=0)).ravel()))
+    similarity = (inv_norms @ co_tracking @ inv_norms).tocsr()
+
+    # Puntuación de cada serie para cada usuario: suma de similitudes con las que ya sigue
+    scores = (matrix @ similarity).tocsr()
+    # Quitar lo que el usuario ya sigue
+    scores = scores - scores.multiply(matrix)
+    scores.eliminate_zeros()
+
+    result: Dict[str, List[Tuple[str, float]]] = {}
+    for row, user in enumerate(users):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        if start == end:
+            continue
+        values = scores.data[start:end]
+        columns = scores.indices[start:end]
+        best = np.argsort(-values)[:top_k] if len(values) <= top_k else \
+            np.argpartition(-values, top_k)[:top_k]
+        best = best[np.argsort(-values[best])]
+        result[user] = [(item_ids[columns[i]], round(float(values[i]), 4)) for i in best]
+    return result
+
+
+def build_recommendations_file(data_files: List[str], output_path: str, top_k: int = 10) -> int:
+    """Calcula la tabla de recomendaciones y la guarda; devuelve el nº de usuarios con sugerencias"""
+    user_items, names = read_user_items(data_files)
+    table = {
+        user: [[item, names.get(item, ''), score] for item, score in suggestions]
+        for user, suggestions in compute_recommendations(user_items, top_k).items()
+    }
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+    return len(table)
+
+
+def load_recommendations(path: str, user_keys: Optional[Set[str]] = None) -> Dict[str, List[List]]:
+    """Carga la tabla precalculada, opcionalmente solo para algunos usuarios"""
+    with open(path, 'r', encoding='utf-8') as f:
+        table = json.load(f)
+    if user_keys is None:
+        return table
+    return {user: suggestions for user, suggestions in table.items() if user in user_keys}
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Reproduce una grabación de actualizaciones contra una Bot API y un TMDB falsos
+
+La grabación se hace con el bot en marcha definiendo RECORD_UPDATES
+(ver UpdateRecorder en telegram_bot_main.py). Este script levanta en local
+un servidor que imita la Bot API de Telegram y la API de TMDB, arranca la
+aplicación completa del bot apuntando a ellos (en un directorio temporal,
+con una copia opcional de los datos) y le entrega las actualizaciones
+respetando los tiempos originales divididos por la velocidad indicada.
+
+Al final informa del rendimiento, de los percentiles de latencia (desde que
+la actualización debía llegar hasta que terminan sus manejadores), de las
+actualizaciones tardías o descartadas y de las llamadas salientes.
+
+Uso:
+    python replay.py grabacion.ndjson.gz --speed 10 [--data series_data.json]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+FAKE_BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "Replay", 'username': "replay_bot",
+                 'can_join_groups': True, 'can_read_all_group_messages': False,
+                 'supports_inline_queries': False}
+
+
+def read_recording(path: str) -> List[Tuple[float, Dict]]:
+    """Lee la grabación: lista de (segundos desde el inicio, actualización)"""
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                records.append((entry['t'], entry['u']))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class FakeServers:
+    """Bot API de Telegram y API de TMDB falsas, con contadores de llamadas"""
+
+    def __init__(self, bot_latency: float = 0.0, tmdb_latency: float = 0.0):
+        self.bot_latency = bot_latency
+        self.tmdb_latency = tmdb_latency
+        self.bot_calls: Counter = Counter()
+        self.tmdb_calls: Counter = Counter()
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.bot_api)
+        app.router.add_get("/3/search/tv", self.tmdb_search)
+        app.router.add_get("/3/tv/{series_id:\\d+}", self.tmdb_tv)
+        app.router.add_get("/3/tv/{series_id:\\d+}/season/{season:\\d+}", self.tmdb_season)
+        app.router.add_get("/3/tv/{series_id:\\d+}/{resource}", self.tmdb_resource)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    # --- Bot API ---
+
+    def _message(self, chat_id, **extra) -> Dict:
+        self._message_id += 1
+        chat_id = int(chat_id) if chat_id is not None else 1
+        return {'message_id': self._message_id, 'date': int(time.time()), 'from': FAKE_BOT_USER,
+                'chat': {'id': chat_id, 'type': "private" if chat_id > 0 else "group"}, **extra}
+
+    async def bot_api(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.bot_calls[method] += 1
+        data = await request.post() if request.can_read_body else {}
+        if self.bot_latency:
+            await asyncio.sleep(self.bot_latency)
+
+        chat_id = data.get('chat_id')
+        file_id = f"fake{self._message_id}"
+        if method == "getMe":
+            result = FAKE_BOT_USER
+        elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "editMessageCaption"):
+            result = self._message(chat_id, text=str(data.get('text', '')))
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{'file_id': file_id, 'file_unique_id': file_id,
+                                                    'width': 500, 'height': 750}])
+        elif method == "sendDocument":
+            result = self._message(chat_id, document={'file_id': file_id, 'file_unique_id': file_id})
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    # --- TMDB ---
+
+    @staticmethod
+    def _series(series_id: int) -> Dict:
+        seasons = series_id % 8 + 1
+        return {
+            'id': series_id, 'name': f"Serie {series_id}", 'original_name': f"Serie {series_id}",
+            'overview': "Serie de prueba para la reproducción de tráfico.",
+            'first_air_date': f"{2000 + series_id % 25}-01-01", 'last_air_date': "2026-01-01",
+            'number_of_seasons': seasons, 'status': "Returning Series" if series_id % 3 else "Ended",
+            'in_production': bool(series_id % 3), 'next_episode_to_air': None, 'poster_path': None,
+            'popularity': float(series_id % 1000),
+            'seasons': [{'season_number': n, 'episode_count': 10} for n in range(1, seasons + 1)]
+        }
+
+    @staticmethod
+    def _season(season_number: int) -> Dict:
+        return {'season_number': season_number,
+                'episodes': [{'episode_number': n, 'name': f"Episodio {n}"} for n in range(1, 11)]}
+
+    async def tmdb_search(self, request: web.Request) -> web.Response:
+        self.tmdb_calls["search/tv"] += 1
+        if self.tmdb_latency:
+            await asyncio.sleep(self.tmdb_latency)
+        seed = sum(map(ord, request.query.get('query', ''))) * 97
+        results = [self._series(seed + i) for i in range(10)]
+        return web.json_response({'page': 1, 'results': results, 'total_results': 10, 'total_pages': 1})
+
+    async def tmdb_tv(self, request: web.Request) -> web.Response:
+        self.tmdb_calls["tv"] += 1
+        if self.tmdb_latency:
+            await asyncio.sleep(self.tmdb_latency)
+        data = self._series(int(request.match_info['series_id']))
+        for resource in filter(None, request.query.get('append_to_response', '').split(',')):
+            if resource.startswith("season/"):
+                data[resource] = self._season(int(resource.split("/")[1]))
+            elif resource == "translations":
+                data[resource] = {'translations': []}
+            else:
+                data[resource] = {}
+        return web.json_response(data)
+
+    async def tmdb_season(self, request: web.Request) -> web.Response:
+        self.tmdb_calls["tv/season"] += 1
+        if self.tmdb_latency:
+            await asyncio.sleep(self.tmdb_latency)
+        return web.json_response(self._season(int(request.match_info['season'])))
+
+    async def tmdb_resource(self, request: web.Request) -> web.Response:
+        self.tmdb_calls[f"tv/{request.match_info['resource']}"] += 1
+        return web.json_response({})
+
+
+async def replay(records: List[Tuple[float, Dict]], speed: float, late_after: float,
+                 drain_timeout: float, servers: FakeServers) -> Dict:
+    """Entrega las actualizaciones a la aplicación y mide cuánto tarda cada una"""
+    import telegram_bot_main as bot_main
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    await servers.start()
+    base = f"http://127.0.0.1:{servers.port}"
+    bot_main.set_series_bot(bot_main.SeriesBot(
+        bot_main.DATA_FILE, bot_main.TMDBClient(bot_main.TMDB_API_KEY, base_url=f"{base}/3")))
+    application = bot_main.build_application(with_updater=False, base_url=f"{base}/bot")
+
+    due: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    async def finished(update: Update, context) -> None:
+        scheduled = due.pop(update.update_id, None)
+        if scheduled is not None:
+            latencies.append(time.monotonic() - scheduled)
+
+    # Último grupo: solo llega aquí lo que no ha cortado el filtro de peticiones
+    application.add_handler(TypeHandler(Update, finished), group=100)
+    guard = bot_main.request_guard
+    throttled_before = sum(guard.rejected.values()) + guard.debounced
+
+    def throttled() -> int:
+        return sum(guard.rejected.values()) + guard.debounced - throttled_before
+
+    feed_slip = 0.0
+    async with application:
+        await bot_main.post_init(application)
+        await application.start()
+        started = time.monotonic()
+        for offset, data in records:
+            scheduled = started + offset / speed
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            feed_slip = max(feed_slip, time.monotonic() - scheduled)
+            update = Update.de_json(data, application.bot)
+            due[update.update_id] = scheduled
+            await application.update_queue.put(update)
+
+        # Las que corta el filtro nunca llegan al último grupo y se quedan en due
+        deadline = time.monotonic() + drain_timeout
+        while time.monotonic() < deadline and len(due) > throttled():
+            await asyncio.sleep(0.05)
+        # Foto de los resultados antes de parar: stop() todavía atiende lo que quede en la cola
+        result = {
+            'updates': len(records),
+            'completed': len(latencies),
+            'throttled': throttled(),
+            'unfinished': max(0, len(due) - throttled()),
+            'late': sum(1 for latency in latencies if latency > late_after),
+            'elapsed': time.monotonic() - started,
+            'feed_slip': feed_slip,
+            'latencies': list(latencies),
+        }
+        await application.stop()
+        await bot_main.post_shutdown(application)
+    await servers.stop()
+    return result
+
+
+def print_report(result: Dict, servers: FakeServers, speed: float, late_after: float) -> None:
+    latencies = result['latencies']
+    print(f"Velocidad {speed:g}×: {result['updates']} actualizaciones en {result['elapsed']:.1f}s "
+          f"({result['completed'] / max(result['elapsed'], 1e-9):.1f}/s atendidas)")
+    print(f"  completadas {result['completed']} · frenadas {result['throttled']} · "
+          f"sin terminar {result['unfinished']} · tardías (> {late_after * 1000:.0f} ms) {result['late']}")
+    print("  latencia ms: " + "  ".join(
+        f"p{p}={percentile(latencies, p) * 1000:.0f}" for p in (50, 90, 99)) +
+        f"  máx={max(latencies, default=0) * 1000:.0f}")
+    print(f"  retraso máximo al entregar: {result['feed_slip'] * 1000:.0f} ms")
+    print(f"  Bot API: {sum(servers.bot_calls.values())} llamadas " +
+          ", ".join(f"{method}={count}" for method, count in servers.bot_calls.most_common()))
+    print(f"  TMDB: {sum(servers.tmdb_calls.values())} llamadas " +
+          ", ".join(f"{path}={count}" for path, count in servers.tmdb_calls.most_common()))
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado contra servicios falsos")
+    parser.add_argument("recording", help="fichero grabado con RECORD_UPDATES")
+    parser.add_argument("--speed", type=float, default=1.0, help="factor de velocidad (1–100)")
+    parser.add_argument("--data", help="fichero de datos del que partir (se copia)")
+    parser.add_argument("--late-ms", type=float, default=1000, help="latencia a partir de la que una respuesta es tardía")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="segundos de espera tras la última actualización")
+    parser.add_argument("--bot-latency-ms", type=float, default=0, help="latencia simulada de la Bot API")
+    parser.add_argument("--tmdb-latency-ms", type=float, default=0, help="latencia simulada de TMDB")
+    args = parser.parse_args(argv[1:])
+
+    records = read_recording(os.path.abspath(args.recording))
+    if not records:
+        print("La grabación está vacía")
+        return 1
+    data_file = os.path.abspath(args.data) if args.data else None
+
+    # Todo lo que el bot escribe (datos, estado, concesiones, copias) queda en un directorio temporal
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.chdir(workdir)
+    if data_file:
+        shutil.copy(data_file, "series_data.json")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.pop("RECORD_UPDATES", None)
+
+    from bot_logging import setup_logging, stop_logging
+    setup_logging(level="WARNING", fmt="text")
+    servers = FakeServers(args.bot_latency_ms / 1000, args.tmdb_latency_ms / 1000)
+    try:
+        result = asyncio.run(replay(records, args.speed, args.late_ms / 1000, args.drain_timeout, servers))
+    finally:
+        stop_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(result, servers, args.speed, args.late_ms / 1000)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
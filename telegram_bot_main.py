@@ -8,29 +8,63 @@ Fecha: 2025
 import logging
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from collections import OrderedDict
+import argparse
 import asyncio
+import base64
+import bisect
+import copy
+import cProfile
+import functools
+import pstats
+import signal
+import tracemalloc
 import aiohttp
 import csv
+import fcntl
+import gzip
+import hashlib
+import heapq
+import math
+import multiprocessing
 import io
+import secrets
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from email.utils import formatdate, parsedate_to_datetime
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from aiohttp import web
+
+from backups import BACKUP_DIR, load_latest_backup, snapshot_in_background, validate_data
+from bot_logging import setup_logging, stop_logging
+from collage import COLLAGE_DIR, collage_key, collage_path, pillow_available, render_collage, thumb_path
+from recommendations import build_recommendations_file, load_recommendations
+from tmdb_catalog import CatalogIndex
+from tmdb_models import SearchResult, SeasonEpisodes, TVDetails, project_search_response, project_search_result, project_tv_response
+
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application, 
+    BasePersistence,
+    BaseRateLimiter,
     CommandHandler, 
     CallbackQueryHandler, 
     MessageHandler, 
     filters, 
     ContextTypes,
-    ConversationHandler
+    ConversationHandler,
+    PersistenceInput,
+    TypeHandler,
+    ApplicationHandlerStop
 )
 
-# Configuración de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configuración de logging (cola + hilo escritor, ver bot_logging.py)
 logger = logging.getLogger(__name__)
 
 # Configuración
@@ -38,6 +72,7 @@ TELEGRAM_TOKEN = "8330446033:AAGS0lI8HwD094x51yY9EqOFyDrshc-gOu4"
 TMDB_API_KEY = "01cd640b434a6e8273b7d0a7e8d31fcd"
 TMDB_BASE_URL = "https://api.themoviedb.org/3"
 TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
+TMDB_THUMB_BASE_URL = "https://image.tmdb.org/t/p/w154"
 
 # Estados de conversación
 (
@@ -54,66 +89,1048 @@ TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
 
 # Archivo de datos
 DATA_FILE = "series_data.json"
+# Estado de las conversaciones en curso
+STATE_FILE = "bot_state.json"
+STATE_UPDATE_INTERVAL = 30  # segundos entre volcados de estado
+# Modo multiproceso: caché de TMDB compartida en disco y concesiones del planificador
+TMDB_CACHE_DIR = "tmdb_cache"
+LEASE_DIR = "leases"
+LEASE_TTL = 30  # segundos
+# Administradores del bot (ids de Telegram separados por comas)
+ADMIN_USER_IDS = {int(x) for x in os.environ.get("ADMIN_USER_IDS", "").split(",") if x.strip().isdigit()}
+
+# Contadores de estadísticas que se mantienen por usuario y globalmente
+STAT_FIELDS = (
+    'total_series', 'total_seasons', 'completed_series', 'ongoing_series',
+    'up_to_date_ongoing', 'behind_series', 'total_episodes'
+)
+
+# Copias de seguridad periódicas del fichero de datos (ver backups.py)
+BACKUP_INTERVAL = 60 * 60  # segundos
+BACKUP_KEEP = 24
+
+# Grabación opcional de las actualizaciones recibidas, para reproducirlas con replay.py
+RECORD_UPDATES_FILE = os.environ.get("RECORD_UPDATES")  # ruta .ndjson.gz; sin definir = desactivada
+RECORD_FLUSH_INTERVAL = 5  # segundos
+
+# Parada ordenada y relevo entre procesos
+DRAIN_DEADLINE = 20  # segundos para terminar el trabajo en curso al parar
+HANDOVER_POLL_INTERVAL = 0.2  # segundos
+HANDOVER_TIMEOUT = DRAIN_DEADLINE + 10  # segundos antes de avisar de que el relevo no llega
+
+# Servidor HTTP local (calendario de estrenos y API de lectura); 0 = desactivado
+HTTP_HOST = os.environ.get("HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.environ.get("HTTP_PORT", "0"))
+# URL pública con la que se llega al servidor; admite {port} y {shard}
+HTTP_PUBLIC_URL = os.environ.get("HTTP_PUBLIC_URL", "http://localhost:{port}")
+CALENDAR_CACHE_SECONDS = 300
+API_LIST_TYPES = ("all", "completed", "ongoing", "pending", "ended")
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+API_DEFAULT_DAYS = 30  # días de estrenos próximos
+API_MAX_DAYS = 365
+
+# Perfilado bajo demanda y monitor de latencia del bucle de eventos
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_DIR = "profiles"
+LOOP_LAG_CHECK_INTERVAL = 0.25  # segundos
+LOOP_LAG_THRESHOLD = 0.2  # segundos de retraso a partir de los que se avisa
+
+# Tabla precalculada de recomendaciones
+RECOMMENDATIONS_FILE = "recommendations.json"
+RECOMMENDATIONS_INTERVAL = 6 * 60 * 60  # segundos entre recálculos
+RECOMMENDATIONS_RELOAD_INTERVAL = 5 * 60  # segundos entre comprobaciones de la tabla
+RECOMMENDATIONS_TOP_K = 10
+# Índice local opcional del catálogo de TMDB (generado con tmdb_catalog.py)
+CATALOG_FILE = "tmdb_catalog.idx"
+
+# Paginación de teclados
+SEASONS_PER_PAGE = 24
+SEASON_BUTTONS_PER_ROW = 4
+EPISODES_PER_PAGE = 30
+EPISODE_BUTTONS_PER_ROW = 5
+GROUP_SERIES_PER_PAGE = 8
+# Nombres de miembros atrasados que se muestran en la lista del grupo
+GROUP_BEHIND_PREVIEW = 3
+
+# Resúmenes de estrenos. Solo se conoce el día de cada estreno, no la hora,
+# así que todos los modos se envían a la hora elegida por el usuario
+DIGEST_MODES = {
+    'each': "🔔 Uno por estreno",
+    'daily': "📅 Diario",
+    'weekly': "🗓️ Semanal",
+    'off': "🔕 Desactivado"
+}
+DIGEST_TIMES = ("08:00", "10:00", "14:00", "20:00")
+# Modos guardados con nombres anteriores
+LEGACY_DIGEST_MODES = {'instant': 'each'}
+# Los resúmenes se activan desde el menú: nadie recibe mensajes que no ha pedido
+DEFAULT_USER_SETTINGS = {
+    'digest_mode': 'off',
+    'digest_time': "10:00",
+    'utc_offset': 1,  # horas respecto a UTC
+    'last_digest': None
+}
+DIGEST_CHECK_INTERVAL = 60  # segundos
+
+# Límites de envío de la Bot API (mensajes por segundo)
+GLOBAL_SEND_RATE = 30
+PRIVATE_CHAT_SEND_RATE = 1
+GROUP_CHAT_SEND_RATE = 20 / 60
+CHAT_SEND_BURST = 3
+MAX_SEND_RETRIES = 3
+# Prioridades de los envíos: las respuestas a botones pasan antes que los avisos y las exportaciones
+PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION, PRIORITY_BULK = range(3)
+PRIORITY_NAMES = ('interactive', 'notification', 'bulk')
+# Peticiones en espera a partir de las que se avisa en el log
+SEND_BACKLOG_WARNING = 100
+
+# Caché de respuestas de TMDB
+TMDB_CACHE_TTL = 6 * 60 * 60  # segundos
+TMDB_SEARCH_CACHE_TTL = 30 * 60  # segundos
+TMDB_CACHE_MAX_ENTRIES = 5000
+# Peticiones simultáneas máximas a TMDB
+TMDB_MAX_CONCURRENCY = 4
+# TMDB admite como máximo 20 subrecursos por append_to_response
+TMDB_APPEND_LIMIT = 20
+# Subrecursos que se piden junto con los detalles de cada serie
+TMDB_DETAIL_APPENDS = ('external_ids', 'translations')
+# Estados de TMDB con los que se deduce si una serie terminó (ver derive_air_status)
+TMDB_ENDED_STATUSES = ("Ended", "Canceled")
+TMDB_AIRING_STATUSES = ("Returning Series", "In Production", "Planned", "Pilot")
+# Pósters descargados que se mantienen en memoria
+POSTER_CACHE_MAX_ENTRIES = 64
+# Miniaturas en disco para los mosaicos de la vista visual (ver collage.py)
+THUMB_DIR = "poster_thumbs"
+COLLAGE_PER_PAGE = 12
+COLLAGE_WORKERS = 2
+# La vista visual solo se ofrece si Pillow está instalado
+COLLAGES_ENABLED = pillow_available()
+
+# Precarga especulativa de resultados de búsqueda
+PREFETCH_TOP_N = 3
+PREFETCH_BUDGET = 15  # series precargadas por usuario y ventana
+PREFETCH_BUDGET_WINDOW = 10 * 60  # segundos
+
+# Presupuesto de peticiones por usuario y tipo de acción: (fichas por segundo, ráfaga)
+ACTION_LIMITS = {
+    'search': (1 / 3, 5),  # búsquedas y demás texto escrito
+    'detail': (1.0, 8),  # pantallas que consultan TMDB
+    'export': (1 / 60, 2),
+    'default': (3.0, 15)  # navegación por menús
+}
+ACTION_PREFIXES = {
+    'select_': 'detail', 'series_': 'detail', 'eps_': 'detail', 'epl_': 'detail',
+    'recommendations': 'detail', 'gallery_': 'detail', 'export_data': 'export'
+}
+CALLBACK_DEBOUNCE_WINDOW = 1.5  # segundos entre pulsaciones idénticas
+SLOW_DOWN_TEXT = "🐢 Vas muy rápido. Espera unos segundos e inténtalo de nuevo."
+SLOW_DOWN_NOTICE_INTERVAL = 30  # segundos entre avisos por mensaje al mismo usuario
+
+def write_json_atomic(path: str, data) -> None:
+    """Escribe un JSON en un fichero temporal y lo renombra sobre el destino"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def read_file_bytes(path: str) -> bytes:
+    """Lee un fichero entero (para usarlo con asyncio.to_thread)"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def shard_path(path: str, shard: int, total: int) -> str:
+    """Ruta del fichero de un shard (sin cambios si solo hay un proceso)"""
+    if total <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}of{total}{ext}"
+
+def namespaced(path: str, namespace: str) -> str:
+    """Ruta de un fichero propio de un bot (sin cambios si solo hay uno)"""
+    if not namespace:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{namespace}{ext}"
+
+def shard_for(key: int, total: int) -> int:
+    """Shard que atiende a un usuario o chat"""
+    return zlib.crc32(str(key).encode()) % total
+
+class LeaderLease:
+    """Concesión con caducidad guardada en un fichero
+    
+    Varios procesos pueden competir por la misma concesión; solo su titular
+    ejecuta el trabajo programado. Si el titular muere, otro la toma al caducar.
+    """
+    
+    def __init__(self, name: str, ttl: float = LEASE_TTL):
+        os.makedirs(LEASE_DIR, exist_ok=True)
+        self.path = os.path.join(LEASE_DIR, f"{name}.lease")
+        self.owner = f"{os.uname().nodename}:{os.getpid()}"
+        self.ttl = ttl
+        self.is_leader = False
+    
+    def try_acquire(self) -> bool:
+        """Toma o renueva la concesión si está libre, caducada o ya es nuestra"""
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    lease = json.loads(f.read() or "{}")
+                except json.JSONDecodeError:
+                    lease = {}
+                now = time.time()
+                if lease.get('owner') not in (None, self.owner) and lease.get('expires', 0) > now:
+                    self.is_leader = False
+                    return False
+                f.seek(0)
+                f.truncate()
+                json.dump({'owner': self.owner, 'expires': now + self.ttl}, f)
+                f.flush()
+                self.is_leader = True
+                return True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def release(self) -> None:
+        """Libera la concesión si es nuestra"""
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    lease = json.loads(f.read() or "{}")
+                except json.JSONDecodeError:
+                    lease = {}
+                if lease.get('owner') == self.owner:
+                    f.seek(0)
+                    f.truncate()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.is_leader = False
+    
+    async def keep_alive(self) -> None:
+        """Renueva (o intenta tomar) la concesión periódicamente"""
+        try:
+            while True:
+                was_leader = self.is_leader
+                try:
+                    self.try_acquire()
+                except OSError as e:
+                    logger.error("Error renovando la concesión %s: %s", self.path, e)
+                    self.is_leader = False
+                if self.is_leader != was_leader:
+                    logger.info("Concesión %s: %s", self.path, 'tomada' if self.is_leader else 'perdida')
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            self.release()
+
+def parse_premiere_date(value: Optional[str]) -> Optional[date]:
+    """Convierte una fecha de estreno DD/MM/AAAA en date (None si es desconocida o inválida)"""
+    if not value or value == 'Desconocida':
+        return None
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+def derive_air_status(details: Optional[TVDetails]) -> Tuple[Optional[bool], Optional[str]]:
+    """Deduce de los detalles de TMDB si la serie terminó y la fecha del próximo estreno
+    
+    Devuelve (has_ended, next_season_date en DD/MM/AAAA); None donde TMDB no lo sabe.
+    """
+    if not details:
+        return None, None
+    status = details.get('status', '')
+    if status in TMDB_ENDED_STATUSES:
+        return True, None
+    if status not in TMDB_AIRING_STATUSES and not details.get('in_production'):
+        return None, None
+    
+    # Solo el episodio 1 de la siguiente temporada es un estreno de temporada
+    next_episode = details.get('next_episode_to_air')
+    if next_episode and next_episode.get('episode_number') == 1 and next_episode.get('air_date'):
+        try:
+            premiere = datetime.strptime(next_episode['air_date'], "%Y-%m-%d").date()
+        except ValueError:
+            premiere = None
+        if premiere and premiere >= date.today():
+            return False, premiere.strftime("%d/%m/%Y")
+    return False, None
+
+def format_premiere(series_data: Dict, days_until: int, next_date: date) -> str:
+    """Formatea un próximo estreno para recordatorios y resúmenes"""
+    name = series_data.get('name', 'Sin nombre')
+    next_season = series_data.get('seasons_watched', 0) + 1
+    
+    if days_until == 0:
+        time_text = "🔥 ¡HOY!"
+    elif days_until == 1:
+        time_text = "📅 Mañana"
+    elif days_until <= 7:
+        time_text = f"📅 En {days_until} días"
+    else:
+        time_text = f"📅 En {days_until} días ({next_date.strftime('%d/%m')})"
+    
+    return f"📺 **{name}** - Temporada {next_season}\n{time_text}\n\n"
+
+def bitset_from_hex(value: Optional[str]) -> int:
+    """Convierte un bitset de episodios almacenado en hexadecimal a entero"""
+    if not value:
+        return 0
+    try:
+        return int(value, 16)
+    except (TypeError, ValueError):
+        return 0
+
+def bitset_to_hex(bits: int) -> str:
+    """Convierte un bitset de episodios a su representación hexadecimal compacta"""
+    return format(bits, 'x')
+
+def build_page_nav_row(prefix: str, page: int, total_pages: int) -> List[InlineKeyboardButton]:
+    """Crea la fila de navegación de un teclado paginado"""
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}{page - 1}"))
+    if total_pages > 1:
+        row.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="noop"))
+    if page < total_pages - 1:
+        row.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}{page + 1}"))
+    return row
+
+def build_season_picker(total_seasons: int, page: int) -> List[List[InlineKeyboardButton]]:
+    """Crea el selector paginado de temporadas del flujo de añadir serie"""
+    total_pages = max(1, -(-total_seasons // SEASONS_PER_PAGE))
+    page = min(max(page, 0), total_pages - 1)
+    first = page * SEASONS_PER_PAGE + 1
+    last = min(first + SEASONS_PER_PAGE - 1, total_seasons)
+    
+    keyboard = []
+    row = []
+    for i in range(first, last + 1):
+        row.append(InlineKeyboardButton(f"T{i}", callback_data=f"season_{i}"))
+        if len(row) == SEASON_BUTTONS_PER_ROW:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    
+    nav_row = build_page_nav_row("seasons_page_", page, total_pages)
+    if nav_row:
+        keyboard.append(nav_row)
+    return keyboard
+
+class TokenBucket:
+    """Cubo de fichas para limitar la frecuencia de una operación"""
+    
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now: Optional[float] = None) -> float:
+        """Segundos que faltan para que haya una ficha disponible"""
+        self._refill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def consume(self) -> None:
+        """Gasta una ficha (llamar solo cuando delay() es 0)"""
+        self.tokens -= 1
+    
+    def try_consume(self, now: Optional[float] = None) -> bool:
+        """Gasta una ficha si la hay"""
+        if self.delay(now) > 0:
+            return False
+        self.consume()
+        return True
+    
+    def is_full(self, now: float) -> bool:
+        """Indica si el cubo se ha rellenado del todo (lleva un rato sin usarse)"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Limitador de la Bot API con cubos global y por chat, prioridades y reintentos
+    
+    Todas las llamadas del bot (también los atajos como query.edit_message_text)
+    pasan por aquí. La prioridad se indica con rate_limit_args; sin ella la
+    petición se trata como interactiva.
+    """
+    
+    def __init__(self, global_rate: float = GLOBAL_SEND_RATE):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._blocked_until = 0.0
+        # Peticiones listas para su chat que compiten por el cubo global, por prioridad
+        self._contending = [0] * len(PRIORITY_NAMES)
+        self._waiting = [0] * len(PRIORITY_NAMES)
+        self.metrics = {
+            'sent': [0] * len(PRIORITY_NAMES),
+            'wait_total': [0.0] * len(PRIORITY_NAMES),
+            'wait_max': [0.0] * len(PRIORITY_NAMES),
+            'retry_after': 0,
+            'failed': 0
+        }
+        self._last_backlog_warning = 0.0
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    def _chat_bucket(self, chat_id) -> Optional[TokenBucket]:
+        """Cubo del chat destino (los grupos tienen un límite más bajo)"""
+        if not isinstance(chat_id, int):
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Olvidar los chats inactivos: sus cubos ya están llenos
+                now = time.monotonic()
+                self._chats = {k: v for k, v in self._chats.items() if not v.is_full(now)}
+            rate = GROUP_CHAT_SEND_RATE if chat_id < 0 else PRIVATE_CHAT_SEND_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, CHAT_SEND_BURST)
+        return bucket
+    
+    async def _acquire(self, priority: int, chat_id) -> None:
+        """Espera turno respetando los límites y las peticiones de mayor prioridad"""
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            
+            chat_delay = chat_bucket.delay(now) if chat_bucket else 0.0
+            if chat_delay > 0:
+                await asyncio.sleep(chat_delay)
+                continue
+            
+            global_delay = self._global.delay(now)
+            if global_delay <= 0 and not any(self._contending[:priority]):
+                self._global.consume()
+                if chat_bucket:
+                    chat_bucket.consume()
+                return
+            
+            self._contending[priority] += 1
+            try:
+                await asyncio.sleep(max(global_delay, 1 / self._global.rate))
+            finally:
+                self._contending[priority] -= 1
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args in range(len(PRIORITY_NAMES)) else PRIORITY_INTERACTIVE
+        chat_id = data.get('chat_id')
+        
+        for attempt in range(MAX_SEND_RETRIES + 1):
+            started = time.monotonic()
+            self._waiting[priority] += 1
+            try:
+                await self._acquire(priority, chat_id)
+            finally:
+                self._waiting[priority] -= 1
+            
+            waited = time.monotonic() - started
+            self.metrics['sent'][priority] += 1
+            self.metrics['wait_total'][priority] += waited
+            self.metrics['wait_max'][priority] = max(self.metrics['wait_max'][priority], waited)
+            self._check_backlog()
+            
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                retry_after = exc.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.metrics['retry_after'] += 1
+                logger.warning("Límite de Telegram alcanzado en %s, reintento en %ss", endpoint, retry_after,
+                               extra={'endpoint': endpoint})
+                # El control de flood de Telegram afecta a todo el bot: pausar todos los envíos
+                self._blocked_until = max(self._blocked_until, time.monotonic() + float(retry_after))
+                if attempt == MAX_SEND_RETRIES:
+                    self.metrics['failed'] += 1
+                    raise
+    
+    def _check_backlog(self) -> None:
+        """Avisa en el log si se acumulan peticiones en espera"""
+        backlog = sum(self._waiting)
+        now = time.monotonic()
+        if backlog >= SEND_BACKLOG_WARNING and now - self._last_backlog_warning > 60:
+            self._last_backlog_warning = now
+            logger.warning("Envíos en espera: %s", self.get_metrics()['waiting'])
+    
+    def get_metrics(self) -> Dict:
+        """Métricas de envío y presión de la cola por prioridad"""
+        return {
+            'waiting': dict(zip(PRIORITY_NAMES, self._waiting)),
+            'sent': dict(zip(PRIORITY_NAMES, self.metrics['sent'])),
+            'avg_wait': {
+                name: self.metrics['wait_total'][i] / self.metrics['sent'][i] if self.metrics['sent'][i] else 0.0
+                for i, name in enumerate(PRIORITY_NAMES)
+            },
+            'max_wait': dict(zip(PRIORITY_NAMES, self.metrics['wait_max'])),
+            'retry_after': self.metrics['retry_after'],
+            'failed': self.metrics['failed']
+        }
+
+class TMDBClient:
+    """Cliente de TMDB con sesión HTTP compartida y caché por recurso"""
+    
+    def __init__(self, api_key: str, base_url: str = TMDB_BASE_URL, language: str = 'es-ES',
+                 cache_dir: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.language = language
+        # Directorio opcional de caché en disco, compartido entre procesos
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.request_count = 0
+        # (idioma, recurso...) -> (caducidad, valor), ordenada por uso para expulsar las más antiguas
+        self.cache: "OrderedDict[Tuple, Tuple[float, object]]" = OrderedDict()
+        # Pósters precargados (ruta -> bytes)
+        self.posters: "OrderedDict[str, bytes]" = OrderedDict()
+        # Cliente dueño de la sesión y del contador (ver with_language)
+        self._root = self
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(TMDB_MAX_CONCURRENCY)
+        # Peticiones de detalles en curso, para no duplicarlas
+        self._inflight: Dict[int, asyncio.Task] = {}
+    
+    def with_language(self, language: str) -> "TMDBClient":
+        """Cliente para otro idioma que comparte sesión, límite de concurrencia y cachés"""
+        if language == self.language:
+            return self
+        client = copy.copy(self)
+        client.language = language
+        client._inflight = {}
+        return client
+    
+    async def close(self) -> None:
+        """Cierra la sesión HTTP (solo la del cliente original)"""
+        if self._root is not self:
+            return
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _cache_get(self, key: Tuple):
+        """Devuelve una entrada de la caché si no ha caducado"""
+        key = (self.language,) + key
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return entry[1]
+    
+    def _cache_set(self, key: Tuple, value, ttl: float = TMDB_CACHE_TTL) -> None:
+        """Guarda una entrada en la caché, expulsando las menos usadas si está llena"""
+        key = (self.language,) + key
+        self.cache[key] = (time.monotonic() + ttl, value)
+        self.cache.move_to_end(key)
+        while len(self.cache) > TMDB_CACHE_MAX_ENTRIES:
+            self.cache.popitem(last=False)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión HTTP, creándola si hace falta"""
+        root = self._root
+        if root._session is None or root._session.closed:
+            root._session = aiohttp.ClientSession()
+        return root._session
+    
+    def _disk_cache_path(self, path: str, params: Dict) -> str:
+        key = json.dumps([path, sorted(params.items())], ensure_ascii=False)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+    
+    def _disk_cache_get(self, cache_path: str, ttl: float) -> Optional[Dict]:
+        """Lee una respuesta de la caché en disco si no ha caducado"""
+        try:
+            if time.time() - os.path.getmtime(cache_path) > ttl:
+                return None
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+    
+    async def _request(self, path: str, project, ttl: float = TMDB_CACHE_TTL, **params) -> Optional[Dict]:
+        """Realiza una petición GET a TMDB limitando la concurrencia
+        
+        project reduce la respuesta a su modelo (ver tmdb_models.py) antes de
+        guardarla en disco; también se aplica a lo leído de disco, que puede venir
+        de versiones anteriores sin proyectar.
+        """
+        params = {'api_key': self.api_key, 'language': self.language, **params}
+        cache_path = self._disk_cache_path(path, params) if self.cache_dir else None
+        if cache_path:
+            cached = self._disk_cache_get(cache_path, ttl)
+            if cached is not None:
+                return project(cached)
+        
+        async with self._semaphore:
+            self._root.request_count += 1
+            async with self._get_session().get(f"{self.base_url}{path}", params=params) as response:
+                if response.status == 200:
+                    data = project(await response.json())
+                    if cache_path:
+                        await asyncio.to_thread(write_json_atomic, cache_path, data)
+                    return data
+                logger.warning("TMDB respondió %s para %s", response.status, path,
+                               extra={'tmdb_status': response.status, 'endpoint': path})
+        return None
+    
+    def _store_tv_response(self, series_id: int, data: Dict) -> TVDetails:
+        """Separa una respuesta ya proyectada con append_to_response en entradas de caché por recurso"""
+        for resource in TMDB_DETAIL_APPENDS:
+            if resource in data:
+                self._cache_set((resource, series_id), data.pop(resource))
+        for key in [k for k in data if k.startswith('season/')]:
+            self._cache_set(('season', series_id, int(key.split('/', 1)[1])), data.pop(key))
+        self._cache_set(('tv', series_id), data)
+        return data
+    
+    async def search_tv(self, query: str) -> List[SearchResult]:
+        """Busca series por nombre"""
+        cache_key = ('search', query.strip().lower())
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        data = await self._request("/search/tv", project_search_response, ttl=TMDB_SEARCH_CACHE_TTL, query=query)
+        if data is None:
+            return []
+        results = data.get('results', [])
+        self._cache_set(cache_key, results, TMDB_SEARCH_CACHE_TTL)
+        return results
+    
+    async def get_tv(self, series_id: int, seasons: Sequence[int] = ()) -> Optional[TVDetails]:
+        """Obtiene los detalles de una serie y sus subrecursos en una sola petición"""
+        details = self._cache_get(('tv', series_id))
+        missing = [n for n in seasons if self._cache_get(('season', series_id, n)) is None]
+        if details is not None and not missing:
+            return details
+        
+        if not seasons:
+            # Si ya hay una petición de los mismos detalles en curso (p. ej. una precarga), reutilizarla
+            task = self._inflight.get(series_id)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch_tv(series_id, [], details))
+                self._inflight[series_id] = task
+                task.add_done_callback(lambda _: self._inflight.pop(series_id, None))
+            return await asyncio.shield(task)
+        return await self._fetch_tv(series_id, missing, details)
+    
+    async def _fetch_tv(self, series_id: int, missing: List[int], details: Optional[TVDetails]) -> Optional[TVDetails]:
+        """Descarga los detalles de una serie junto con las temporadas que falten"""
+        appends = list(TMDB_DETAIL_APPENDS)
+        first_batch = missing[:TMDB_APPEND_LIMIT - len(appends)]
+        appends += [f"season/{n}" for n in first_batch]
+        data = await self._request(f"/tv/{series_id}", project_tv_response, append_to_response=",".join(appends))
+        if data is None:
+            return details
+        details = self._store_tv_response(series_id, data)
+        
+        # El resto de temporadas se piden en lotes concurrentes
+        if len(missing) > len(first_batch):
+            await self.get_seasons(series_id, missing[len(first_batch):])
+        return details
+    
+    async def get_tv_resource(self, series_id: int, resource: str) -> Optional[Dict]:
+        """Obtiene un subrecurso de una serie (external_ids, translations)"""
+        cached = self._cache_get((resource, series_id))
+        if cached is None:
+            # Forzar la recarga de los detalles, que traen todos los subrecursos
+            self.cache.pop((self.language, 'tv', series_id), None)
+            await self.get_tv(series_id)
+            cached = self._cache_get((resource, series_id))
+        return cached
+    
+    async def get_seasons(self, series_id: int, season_numbers: Sequence[int]) -> Dict[int, SeasonEpisodes]:
+        """Obtiene varias temporadas agrupándolas en pocas peticiones concurrentes"""
+        result = {}
+        missing = []
+        for n in season_numbers:
+            cached = self._cache_get(('season', series_id, n))
+            if cached is not None:
+                result[n] = cached
+            else:
+                missing.append(n)
+        
+        batches = [missing[i:i + TMDB_APPEND_LIMIT] for i in range(0, len(missing), TMDB_APPEND_LIMIT)]
+        
+        async def fetch_batch(batch: List[int]) -> None:
+            appends = ",".join(f"season/{n}" for n in batch)
+            data = await self._request(f"/tv/{series_id}", project_tv_response, append_to_response=appends)
+            if data is not None:
+                self._store_tv_response(series_id, data)
+        
+        responses = await asyncio.gather(*(fetch_batch(b) for b in batches), return_exceptions=True)
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.error("Error obteniendo temporadas: %s", response)
+        
+        for n in missing:
+            cached = self._cache_get(('season', series_id, n))
+            if cached is not None:
+                result[n] = cached
+        return result
+    
+    async def get_season(self, series_id: int, season_number: int) -> Optional[SeasonEpisodes]:
+        """Obtiene una temporada"""
+        return (await self.get_seasons(series_id, [season_number])).get(season_number)
+    
+    async def get_poster(self, poster_path: str) -> Optional[bytes]:
+        """Descarga un póster y lo guarda en la caché de pósters"""
+        if poster_path in self.posters:
+            self.posters.move_to_end(poster_path)
+            return self.posters[poster_path]
+        
+        async with self._semaphore:
+            async with self._get_session().get(f"{TMDB_IMAGE_BASE_URL}{poster_path}") as response:
+                if response.status != 200:
+                    return None
+                content = await response.read()
+        
+        self.posters[poster_path] = content
+        while len(self.posters) > POSTER_CACHE_MAX_ENTRIES:
+            self.posters.popitem(last=False)
+        return content
+    
+    async def get_thumbnail(self, poster_path: str, thumb_dir: str = THUMB_DIR) -> Optional[str]:
+        """Ruta local de la miniatura de un póster, descargándola la primera vez"""
+        path = thumb_path(poster_path, thumb_dir)
+        if os.path.exists(path):
+            return path
+        
+        async with self._semaphore:
+            async with self._get_session().get(f"{TMDB_THUMB_BASE_URL}{poster_path}") as response:
+                if response.status != 200:
+                    return None
+                content = await response.read()
+        
+        os.makedirs(thumb_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return path
 
 class SeriesBot:
-    def __init__(self):
+    def __init__(self, data_file: str = DATA_FILE, tmdb: Optional[TMDBClient] = None,
+                 catalog: Optional[CatalogIndex] = None, namespace: str = ""):
+        self.data_file = data_file
+        # Espacio de nombres de los ficheros de este bot cuando hay varios en el mismo proceso
+        self.namespace = namespace
+        self.recommendations_file = namespaced(RECOMMENDATIONS_FILE, namespace)
         self.data = self.load_data()
+        # Guardados desde el arranque: permite saltarse copias si no ha cambiado nada
+        self.save_count = 0
+        # Cliente de TMDB; su caché se comparte entre todos los usuarios
+        self.tmdb = tmdb or TMDBClient(TMDB_API_KEY)
+        self.catalog = catalog or CatalogIndex.open(CATALOG_FILE)
+        if self.catalog:
+            logger.info("Catálogo local cargado: %s series", self.catalog.n_titles)
+        # Índice inverso: tmdb_id -> usuarios que siguen la serie
+        self.subscribers: Dict[str, Set[str]] = {}
+        # Estrenos agrupados por día (ISO) -> {(usuario, serie)}
+        self.premieres: Dict[str, Set[Tuple[str, str]]] = {}
+        # Minuto del día en UTC -> usuarios que reciben su resumen a esa hora
+        self.digest_slots: Dict[int, Set[str]] = {}
+        # Contadores incrementales de estadísticas
+        self.user_stats: Dict[str, Dict[str, int]] = {}
+        self.global_stats: Dict[str, int] = dict.fromkeys(STAT_FIELDS + ('users',), 0)
+        # Por serie: usuarios que la han completado y usuarios que van atrasados
+        self.show_completed: Dict[str, int] = {}
+        self.show_behind: Dict[str, int] = {}
+        # Sugerencias precalculadas por usuario: [tmdb_id, nombre, puntuación]
+        self.recommendations: Dict[str, List[List]] = {}
+        self._recommendations_mtime = 0.0
+        # file_id de Telegram de los pósters ya enviados por este bot
+        self.poster_file_ids: Dict[str, str] = {}
+        # Igual para los mosaicos de pósters (clave del mosaico -> file_id)
+        self.collage_file_ids: Dict[str, str] = {}
+        # Versión de los datos de cada usuario (cambia con cada modificación de sus series)
+        # e instante del último cambio; boot_id distingue versiones de distintos arranques
+        self.versions: Dict[str, int] = {}
+        self.modified: Dict[str, float] = {}
+        self.boot_id = f"{int(time.time()):x}"
+        # Enlace secreto del calendario -> usuario, y calendarios ya generados
+        self.feed_tokens: Dict[str, str] = {}
+        self._calendars: Dict[str, Tuple[int, bytes, str]] = {}
+        # Token de la API de lectura -> usuario, y listas ya ordenadas para la API
+        self.api_tokens: Dict[str, str] = {}
+        self._api_lists: Dict[Tuple[str, str], Tuple[int, List[Tuple], List[Tuple[str, Dict]]]] = {}
+        # Listas de grupo: por chat, miembros atrasados en cada serie y series en
+        # las que todos están al día (se actualizan al cambiar el progreso de un miembro)
+        self.group_behind: Dict[str, Dict[str, Set[str]]] = {}
+        self.group_up_to_date: Dict[str, Set[str]] = {}
+        self._build_indexes()
     
     def load_data(self) -> Dict:
-        """Carga los datos desde el archivo JSON"""
-        if os.path.exists(DATA_FILE):
+        """Carga los datos desde el archivo JSON; si está dañado, desde la última copia válida"""
+        if os.path.exists(self.data_file):
             try:
-                with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # CORRECCIÓN: Validar estructura de datos
-                    if not isinstance(data, dict):
-                        return {"series": {}}
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    return validate_data(json.load(f))
+            except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+                logger.error("Error cargando datos: %s", e)
+                # Conservar el fichero dañado: el siguiente guardado lo sobrescribiría
+                os.replace(self.data_file, f"{self.data_file}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+                latest = load_latest_backup(self.data_file, BACKUP_DIR)
+                if latest:
+                    data, path = latest
+                    logger.warning("Datos recuperados de la copia %s", path)
                     return data
-            except (json.JSONDecodeError, FileNotFoundError, UnicodeDecodeError) as e:
-                logger.error(f"Error cargando datos: {e}")
-                return {"series": {}}
+                logger.error("No hay copias válidas de %s: se empieza sin datos", self.data_file)
         return {"series": {}}
     
+    def iter_users(self) -> Iterator[Tuple[str, Dict]]:
+        """Recorre los usuarios almacenados, ignorando claves que no son de usuario"""
+        for user_key, user_data in self.data.items():
+            if user_key.isdigit() and isinstance(user_data, dict) and isinstance(user_data.get("series"), dict):
+                yield user_key, user_data
+    
+    def iter_groups(self) -> Iterator[Tuple[str, Dict]]:
+        """Recorre las listas compartidas de los chats de grupo (claves de chat negativas)"""
+        for chat_key, group in self.data.items():
+            if chat_key.startswith("-") and isinstance(group, dict) and group.get("group"):
+                yield chat_key, group
+    
+    def _build_indexes(self) -> None:
+        """Construye los índices en memoria en una sola pasada sobre los datos"""
+        for user_key, user_data in self.iter_users():
+            self._index_digest_slot(user_key)
+            if user_data.get("feed_token"):
+                self.feed_tokens[user_data["feed_token"]] = user_key
+            if user_data.get("api_token"):
+                self.api_tokens[user_data["api_token"]] = user_key
+            for series_key, series in user_data["series"].items():
+                if isinstance(series, dict):
+                    self._index_series(user_key, series_key, series)
+        for chat_key, group in self.iter_groups():
+            for series_key in group["series"]:
+                self._index_group_series(chat_key, group, series_key)
+    
+    @staticmethod
+    def _series_contribution(series: Dict) -> Dict[str, int]:
+        """Aporte de una serie a los contadores de estadísticas"""
+        up_to_date = series.get('up_to_date', False)
+        has_ended = series.get('has_ended', False)
+        return {
+            'total_series': 1,
+            'total_seasons': series.get('seasons_watched', 0) or 0,
+            'completed_series': int(up_to_date and has_ended),
+            'ongoing_series': int(not has_ended),
+            'up_to_date_ongoing': int(up_to_date and not has_ended),
+            'behind_series': int(not up_to_date),
+            'total_episodes': sum(bin(bitset_from_hex(v)).count("1")
+                                  for v in series.get('episodes_watched', {}).values())
+        }
+    
+    def _apply_stats(self, user_key: str, series_key: str, series: Dict, sign: int) -> None:
+        """Suma (sign=1) o resta (sign=-1) el aporte de una serie a los contadores"""
+        contribution = self._series_contribution(series)
+        user_stats = self.user_stats.setdefault(user_key, dict.fromkeys(STAT_FIELDS, 0))
+        had_series = user_stats['total_series'] > 0
+        for field, value in contribution.items():
+            user_stats[field] += sign * value
+            self.global_stats[field] += sign * value
+        if had_series != (user_stats['total_series'] > 0):
+            self.global_stats['users'] += sign
+        
+        for counter, flag in ((self.show_completed, 'completed_series'), (self.show_behind, 'behind_series')):
+            if contribution[flag]:
+                counter[series_key] = counter.get(series_key, 0) + sign
+                if counter[series_key] <= 0:
+                    del counter[series_key]
+    
+    def _touch(self, user_key: str) -> None:
+        """Marca que los datos del usuario han cambiado"""
+        self.versions[user_key] = self.versions.get(user_key, 0) + 1
+        self.modified[user_key] = time.time()
+    
+    def _index_series(self, user_key: str, series_key: str, series: Dict) -> None:
+        """Añade una serie de un usuario a los índices"""
+        self._touch(user_key)
+        self.subscribers.setdefault(series_key, set()).add(user_key)
+        self._apply_stats(user_key, series_key, series, 1)
+        
+        if not series.get('has_ended', True):
+            premiere = parse_premiere_date(series.get('next_season_date'))
+            if premiere:
+                self.premieres.setdefault(premiere.isoformat(), set()).add((user_key, series_key))
+    
+    def _unindex_series(self, user_key: str, series_key: str, series: Dict) -> None:
+        """Quita una serie de un usuario de los índices"""
+        self._touch(user_key)
+        subscribers = self.subscribers.get(series_key)
+        if subscribers is not None:
+            subscribers.discard(user_key)
+            if not subscribers:
+                del self.subscribers[series_key]
+        self._apply_stats(user_key, series_key, series, -1)
+        
+        premiere = parse_premiere_date(series.get('next_season_date'))
+        bucket = self.premieres.get(premiere.isoformat()) if premiere else None
+        if bucket is not None:
+            bucket.discard((user_key, series_key))
+            if not bucket:
+                del self.premieres[premiere.isoformat()]
+    
+    @staticmethod
+    def _digest_slot(settings: Dict) -> int:
+        """Minuto del día (UTC) en el que toca enviar el resumen de un usuario"""
+        hours, minutes = map(int, settings['digest_time'].split(":"))
+        return (hours * 60 + minutes - settings['utc_offset'] * 60) % (24 * 60)
+    
+    def _index_digest_slot(self, user_key: str) -> None:
+        """Registra al usuario en la franja horaria de su resumen"""
+        settings = self.get_user_settings(user_key)
+        if settings['digest_mode'] != 'off':
+            self.digest_slots.setdefault(self._digest_slot(settings), set()).add(user_key)
+    
+    def _unindex_digest_slot(self, user_key: str) -> None:
+        """Quita al usuario de la franja horaria de su resumen"""
+        slot = self.digest_slots.get(self._digest_slot(self.get_user_settings(user_key)))
+        if slot is not None:
+            slot.discard(user_key)
+    
+    def get_user_settings(self, user_id) -> Dict:
+        """Obtiene las preferencias del usuario, completadas con los valores por defecto"""
+        user_data = self.data.get(str(user_id), {})
+        settings = user_data.get("settings", {}) if isinstance(user_data, dict) else {}
+        settings = {**DEFAULT_USER_SETTINGS, **settings}
+        settings['digest_mode'] = LEGACY_DIGEST_MODES.get(settings['digest_mode'], settings['digest_mode'])
+        return settings
+    
+    def update_user_settings(self, user_id, **changes) -> None:
+        """Actualiza las preferencias del usuario"""
+        user_key = str(user_id)
+        if user_key not in self.data:
+            self.data[user_key] = {"series": {}}
+        
+        self._unindex_digest_slot(user_key)
+        self.data[user_key].setdefault("settings", {}).update(changes)
+        self._index_digest_slot(user_key)
+        self.save_data()
+    
+    def collect_due_digests(self, now: datetime, minutes: Sequence[int]) -> Dict[str, List[Tuple[str, Dict, int, date]]]:
+        """Agrupa por usuario los estrenos que tocan enviar en las franjas indicadas
+        
+        Los estrenos se leen de los cubos diarios en una sola pasada y solo se
+        marcan como enviados los periodos de los usuarios incluidos.
+        """
+        # Qué días cubre el resumen de cada usuario en este momento
+        ranges: Dict[str, Tuple[date, date, str]] = {}
+        for minute in minutes:
+            for user_key in self.digest_slots.get(minute, ()):
+                settings = self.get_user_settings(user_key)
+                local_today = (now + timedelta(hours=settings['utc_offset'])).date()
+                if settings['digest_mode'] == 'weekly':
+                    if local_today.weekday() != 0:
+                        continue
+                    period = f"{local_today.isocalendar()[0]}-W{local_today.isocalendar()[1]}"
+                    last_day = local_today + timedelta(days=6)
+                else:
+                    period = local_today.isoformat()
+                    last_day = local_today
+                if settings['last_digest'] != period:
+                    ranges[user_key] = (local_today, last_day, period)
+        
+        due: Dict[str, List[Tuple[str, Dict, int, date]]] = {user_key: [] for user_key in ranges}
+        if not ranges:
+            return due
+        
+        first_day = min(r[0] for r in ranges.values())
+        last_day = max(r[1] for r in ranges.values())
+        day = first_day
+        while day <= last_day:
+            for user_key, series_key in self.premieres.get(day.isoformat(), ()):
+                user_range = ranges.get(user_key)
+                if user_range and user_range[0] <= day <= user_range[1]:
+                    series = self.get_user_series(user_key).get(series_key)
+                    if series:
+                        due[user_key].append((series_key, series, (day - user_range[0]).days, day))
+            day += timedelta(days=1)
+        
+        for user_key, (_, _, period) in ranges.items():
+            self.data[user_key].setdefault("settings", {})['last_digest'] = period
+            due[user_key].sort(key=lambda item: item[3])
+        if any(due.values()):
+            self.save_data()
+        return due
+    
+    def prune_premieres(self, before: date) -> None:
+        """Elimina del índice los días de estreno ya pasados"""
+        for day in [d for d in self.premieres if d < before.isoformat()]:
+            del self.premieres[day]
+    
+    def get_subscribers(self, tmdb_id) -> Set[str]:
+        """Devuelve los usuarios que siguen una serie"""
+        return self.subscribers.get(str(tmdb_id), set())
+    
+    def get_subscriber_count(self, tmdb_id) -> int:
+        """Devuelve cuántos usuarios siguen una serie"""
+        return len(self.subscribers.get(str(tmdb_id), ()))
+    
+    def get_most_tracked(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Devuelve las series más seguidas como (tmdb_id, nº de usuarios)"""
+        return heapq.nlargest(limit, ((key, len(users)) for key, users in self.subscribers.items()),
+                              key=lambda item: item[1])
+    
     def save_data(self) -> None:
-        """Guarda los datos en el archivo JSON"""
+        """Guarda los datos en el archivo JSON (escritura atómica)"""
+        self.save_count += 1
         try:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.data_file, self.data)
         except Exception as e:
-            logger.error(f"Error guardando datos: {e}")
+            logger.error("Error guardando datos: %s", e)
     
-    async def search_series_tmdb(self, query: str) -> List[Dict]:
-        """Busca series en TMDB"""
+    async def search_series_tmdb(self, query: str) -> List[SearchResult]:
+        """Busca series en el catálogo local y, si no hay resultados o no puede resolver la consulta, en TMDB"""
+        if self.catalog:
+            try:
+                results = self.catalog.search(query, 10)
+                if results:
+                    return [project_search_result(result) for result in results]
+            except Exception as e:
+                logger.error("Error buscando en el catálogo local: %s", e)
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{TMDB_BASE_URL}/search/tv"
-                params = {
-                    'api_key': TMDB_API_KEY,
-                    'query': query,
-                    'language': 'es-ES'
-                }
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('results', [])[:10]  # Limitar a 10 resultados
+            results = await self.tmdb.search_tv(query)
+            return results[:10]  # Limitar a 10 resultados
         except Exception as e:
-            logger.error(f"Error buscando series: {e}")
+            logger.error("Error buscando series: %s", e)
         return []
     
-    async def get_series_details(self, series_id: int) -> Optional[Dict]:
-        """Obtiene detalles completos de una serie"""
+    async def get_series_details(self, series_id: int, seasons: Sequence[int] = ()) -> Optional[TVDetails]:
+        """Obtiene detalles completos de una serie (y, opcionalmente, de sus temporadas)"""
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{TMDB_BASE_URL}/tv/{series_id}"
-                params = {
-                    'api_key': TMDB_API_KEY,
-                    'language': 'es-ES'
-                }
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        return await response.json()
+            return await self.tmdb.get_tv(series_id, seasons)
         except Exception as e:
-            logger.error(f"Error obteniendo detalles de serie: {e}")
+            logger.error("Error obteniendo detalles de serie: %s", e)
+        return None
+    
+    async def get_season_details(self, series_id: int, season_number: int) -> Optional[SeasonEpisodes]:
+        """Obtiene los episodios de una temporada, con caché compartida entre usuarios"""
+        try:
+            return await self.tmdb.get_season(series_id, season_number)
+        except Exception as e:
+            logger.error("Error obteniendo temporada: %s", e)
         return None
     
     def add_series(self, user_id: int, series_data: Dict) -> None:
@@ -121,9 +1138,14 @@ class SeriesBot:
         user_key = str(user_id)
         if user_key not in self.data:
             self.data[user_key] = {"series": {}}
+            self._index_digest_slot(user_key)
         
         series_key = str(series_data['tmdb_id'])
+        previous = self.data[user_key]["series"].get(series_key)
+        if previous is not None:
+            self._unindex_series(user_key, series_key, previous)
         self.data[user_key]["series"][series_key] = series_data
+        self._index_series(user_key, series_key, series_data)
         self.save_data()
     
     def get_user_series(self, user_id: int) -> Dict:
@@ -139,45 +1161,853 @@ class SeriesBot:
         """Elimina una serie de los datos del usuario"""
         user_key = str(user_id)
         if user_key in self.data and series_key in self.data[user_key]["series"]:
-            del self.data[user_key]["series"][series_key]
+            series = self.data[user_key]["series"].pop(series_key)
+            self._unindex_series(user_key, series_key, series)
             self.save_data()
             return True
         return False
     
     def update_series(self, user_id: int, series_key: str, field: str, value) -> bool:
         """Actualiza un campo específico de una serie"""
+        return self.update_series_fields(user_id, series_key, {field: value})
+    
+    def update_series_fields(self, user_id: int, series_key: str, fields: Dict) -> bool:
+        """Actualiza varios campos de una serie de una vez (una sola reindexación y un guardado)"""
         user_key = str(user_id)
         if user_key in self.data and series_key in self.data[user_key]["series"]:
-            self.data[user_key]["series"][series_key][field] = value
-            # Recalcular si está al día
             series = self.data[user_key]["series"][series_key]
+            self._unindex_series(user_key, series_key, series)
+            series.update(fields)
+            # Recalcular si está al día
             series['up_to_date'] = series['seasons_watched'] >= series['total_seasons']
+            self._index_series(user_key, series_key, series)
             self.save_data()
             return True
         return False
     
-    def get_series_stats(self, user_id: int) -> Dict:
-        """Calcula estadísticas de las series del usuario"""
-        series = self.get_user_series(user_id)
-        if not series:
-            return {}
-        
-        total_series = len(series)
-        total_seasons = sum(s.get('seasons_watched', 0) for s in series.values())
-        completed_series = sum(1 for s in series.values() if s.get('up_to_date', False) and s.get('has_ended', False))
-        ongoing_series = sum(1 for s in series.values() if not s.get('has_ended', False))
-        behind_series = sum(1 for s in series.values() if not s.get('up_to_date', False))
-        
-        return {
-            'total_series': total_series,
-            'total_seasons': total_seasons,
-            'completed_series': completed_series,
-            'ongoing_series': ongoing_series,
-            'behind_series': behind_series
-        }
+    def get_watched_episodes(self, user_id: int, series_key: str, season_number: int) -> int:
+        """Devuelve el bitset de episodios vistos de una temporada"""
+        series = self.get_user_series(user_id).get(series_key, {})
+        return bitset_from_hex(series.get('episodes_watched', {}).get(str(season_number)))
+    
+    def set_watched_episodes(self, user_id: int, series_key: str, season_number: int, bits: int) -> bool:
+        """Guarda el bitset de episodios vistos de una temporada"""
+        user_key = str(user_id)
+        if user_key in self.data and series_key in self.data[user_key]["series"]:
+            series = self.data[user_key]["series"][series_key]
+            self._unindex_series(user_key, series_key, series)
+            episodes_watched = series.setdefault('episodes_watched', {})
+            if bits:
+                episodes_watched[str(season_number)] = bitset_to_hex(bits)
+            else:
+                episodes_watched.pop(str(season_number), None)
+            self._index_series(user_key, series_key, series)
+            self.save_data()
+            return True
+        return False
+    
+    def toggle_episode(self, user_id: int, series_key: str, season_number: int, episode_number: int) -> bool:
+        """Marca o desmarca un episodio como visto y devuelve el nuevo estado"""
+        bits = self.get_watched_episodes(user_id, series_key, season_number)
+        bits ^= 1 << (episode_number - 1)
+        self.set_watched_episodes(user_id, series_key, season_number, bits)
+        return bool(bits >> (episode_number - 1) & 1)
+    
+    def reload_recommendations(self) -> None:
+        """Recarga la tabla de recomendaciones si ha cambiado (solo los usuarios de este proceso)"""
+        try:
+            mtime = os.path.getmtime(self.recommendations_file)
+        except OSError:
+            return
+        if mtime == self._recommendations_mtime:
+            return
+        try:
+            self.recommendations = load_recommendations(
+                self.recommendations_file, {user_key for user_key, _ in self.iter_users()})
+            self._recommendations_mtime = mtime
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error("Error cargando recomendaciones: %s", e)
+    
+    def get_recommendations(self, user_id: int, limit: int = RECOMMENDATIONS_TOP_K) -> List[List]:
+        """Sugerencias para el usuario, sin las series que ya sigue"""
+        tracked = self.get_user_series(user_id)
+        suggestions = self.recommendations.get(str(user_id), [])
+        return [s for s in suggestions if s[0] not in tracked][:limit]
+    
+    def get_series_stats(self, user_id: int) -> Dict:
+        """Devuelve las estadísticas del usuario (contadores mantenidos al modificar sus series)"""
+        stats = self.user_stats.get(str(user_id))
+        if not stats or not stats['total_series']:
+            return {}
+        return dict(stats)
+    
+    def _get_token(self, user_id, field: str, index: Dict[str, str], rotate: bool) -> str:
+        """Token secreto guardado en el campo indicado (se crea o renueva si hace falta)"""
+        user_key = str(user_id)
+        if user_key not in self.data:
+            self.data[user_key] = {"series": {}}
+        user_data = self.data[user_key]
+        token = user_data.get(field)
+        if token and not rotate:
+            return token
+        if token:
+            index.pop(token, None)
+        token = user_data[field] = secrets.token_urlsafe(16)
+        index[token] = user_key
+        self.save_data()
+        return token
+    
+    def get_feed_token(self, user_id, rotate: bool = False) -> str:
+        """Token secreto del calendario del usuario"""
+        return self._get_token(user_id, "feed_token", self.feed_tokens, rotate)
+    
+    def get_api_token(self, user_id, rotate: bool = False) -> str:
+        """Token de acceso del usuario a la API de lectura"""
+        return self._get_token(user_id, "api_token", self.api_tokens, rotate)
+    
+    @staticmethod
+    def api_sort_key(list_type: str, series_key: str, series: Dict) -> Tuple:
+        """Orden de la API: el de show_series_list, desempatado por id para poder paginar"""
+        name = series.get('name', '').lower()
+        if list_type == "ongoing":
+            premiere = parse_premiere_date(series.get('next_season_date'))
+            return (premiere.isoformat() if premiere else "9999-12-31", name, series_key)
+        return (name, series_key)
+    
+    def get_api_list(self, user_key: str, list_type: str) -> Tuple[List[Tuple], List[Tuple[str, Dict]]]:
+        """Series de una lista ya ordenadas y sus claves de orden
+        
+        Se reordena solo cuando cambia la versión de los datos del usuario.
+        """
+        version = self.versions.get(user_key, 0)
+        cached = self._api_lists.get((user_key, list_type))
+        if cached is None or cached[0] != version:
+            items = sorted(filter_series_list(self.get_user_series(user_key), list_type),
+                           key=lambda item: self.api_sort_key(list_type, *item))
+            keys = [self.api_sort_key(list_type, *item) for item in items]
+            cached = self._api_lists[(user_key, list_type)] = (version, keys, items)
+        return cached[1], cached[2]
+    
+    def get_calendar(self, user_key: str) -> Tuple[bytes, str, float]:
+        """Calendario ICS del usuario, su ETag y la fecha de última modificación
+        
+        Solo se vuelve a generar cuando cambia la versión de los datos del usuario.
+        """
+        version = self.versions.get(user_key, 0)
+        cached = self._calendars.get(user_key)
+        if cached is None or cached[0] != version:
+            etag = f'"{self.boot_id}-{version}"'
+            cached = self._calendars[user_key] = (version, self._build_calendar(user_key), etag)
+        return cached[1], cached[2], self.modified.get(user_key, 0.0)
+    
+    def _build_calendar(self, user_key: str) -> bytes:
+        """Genera el ICS con los estrenos de las series en emisión del usuario"""
+        def escape(text: str) -> str:
+            return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+        
+        def fold(line: str) -> str:
+            # RFC 5545: líneas de 75 octetos como máximo, continuadas con un espacio
+            encoded = line.encode("utf-8")
+            if len(encoded) <= 75:
+                return line
+            parts, current = [], ""
+            for char in line:
+                if len((current + char).encode("utf-8")) > (75 if not parts else 74):
+                    parts.append(current)
+                    current = ""
+                current += char
+            parts.append(current)
+            return "\r\n ".join(parts)
+        
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(self.modified.get(user_key, time.time())))
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//SeriesBot//Estrenos//ES",
+                 "CALSCALE:GREGORIAN", "METHOD:PUBLISH", "X-WR-CALNAME:Estrenos de mis series"]
+        for series_key, series in self.get_user_series(user_key).items():
+            if series.get('has_ended', True):
+                continue
+            premiere = parse_premiere_date(series.get('next_season_date'))
+            if not premiere:
+                continue
+            name = series.get('name', 'Sin nombre')
+            season = series.get('seasons_watched', 0) + 1
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{series_key}-{premiere.strftime('%Y%m%d')}@seriesbot",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{premiere.strftime('%Y%m%d')}",
+                f"DTEND;VALUE=DATE:{(premiere + timedelta(days=1)).strftime('%Y%m%d')}",
+                f"SUMMARY:{escape(f'Estreno: {name} - Temporada {season}')}",
+                "TRANSP:TRANSPARENT",
+                "END:VEVENT"
+            ]
+        lines.append("END:VCALENDAR")
+        return ("\r\n".join(fold(line) for line in lines) + "\r\n").encode("utf-8")
+    
+    # --- Listas compartidas en grupos ---
+    # Cada grupo se guarda completo bajo la clave de su chat (con el progreso de
+    # cada miembro dentro), así que un shard que recibe el chat tiene todo lo que necesita.
+    
+    def get_group(self, chat_id) -> Optional[Dict]:
+        """Lista compartida de un chat de grupo, o None si aún no tiene"""
+        group = self.data.get(str(chat_id))
+        return group if isinstance(group, dict) and group.get("group") else None
+    
+    def _get_or_create_group(self, chat_id, title: str) -> Dict:
+        chat_key = str(chat_id)
+        group = self.get_group(chat_key)
+        if group is None:
+            group = self.data[chat_key] = {"group": True, "title": title, "series": {}, "members": {}}
+        elif title:
+            group["title"] = title
+        return group
+    
+    @staticmethod
+    def _member_is_behind(group: Dict, member: Dict, series_key: str) -> bool:
+        return member["progress"].get(series_key, 0) < group["series"][series_key]["total_seasons"]
+    
+    def _set_member_behind(self, chat_key: str, series_key: str, member_key: str, behind: bool) -> None:
+        """Mueve a un miembro dentro o fuera del conjunto de atrasados de una serie"""
+        behind_set = self.group_behind.setdefault(chat_key, {}).setdefault(series_key, set())
+        if behind:
+            behind_set.add(member_key)
+        else:
+            behind_set.discard(member_key)
+        up_to_date = self.group_up_to_date.setdefault(chat_key, set())
+        if behind_set:
+            up_to_date.discard(series_key)
+        else:
+            up_to_date.add(series_key)
+    
+    def _index_group_series(self, chat_key: str, group: Dict, series_key: str) -> None:
+        """Calcula los atrasados de una serie del grupo (solo al añadirla o al cargar)"""
+        behind = {member_key for member_key, member in group["members"].items()
+                  if self._member_is_behind(group, member, series_key)}
+        self.group_behind.setdefault(chat_key, {})[series_key] = behind
+        up_to_date = self.group_up_to_date.setdefault(chat_key, set())
+        if behind:
+            up_to_date.discard(series_key)
+        else:
+            up_to_date.add(series_key)
+    
+    def group_join(self, chat_id, user_id, name: str, title: str = "") -> bool:
+        """Apunta a un usuario al seguimiento del grupo; devuelve True si es nuevo"""
+        chat_key, member_key = str(chat_id), str(user_id)
+        group = self._get_or_create_group(chat_key, title)
+        member = group["members"].get(member_key)
+        if member is not None:
+            if member["name"] != name:
+                member["name"] = name
+                self.save_data()
+            return False
+        member = group["members"][member_key] = {"name": name, "progress": {}}
+        for series_key in group["series"]:
+            self._set_member_behind(chat_key, series_key, member_key,
+                                    self._member_is_behind(group, member, series_key))
+        self.save_data()
+        return True
+    
+    def group_leave(self, chat_id, user_id) -> bool:
+        """Quita a un usuario del seguimiento del grupo"""
+        chat_key, member_key = str(chat_id), str(user_id)
+        group = self.get_group(chat_key)
+        if group is None or group["members"].pop(member_key, None) is None:
+            return False
+        for series_key in group["series"]:
+            self._set_member_behind(chat_key, series_key, member_key, False)
+        self.save_data()
+        return True
+    
+    def group_add_series(self, chat_id, series_key: str, name: str, total_seasons: int,
+                         user_id, title: str = "") -> bool:
+        """Añade una serie a la lista del grupo; devuelve False si ya estaba"""
+        chat_key = str(chat_id)
+        group = self._get_or_create_group(chat_key, title)
+        if series_key in group["series"]:
+            return False
+        group["series"][series_key] = {
+            "name": name,
+            "total_seasons": total_seasons,
+            "added_by": str(user_id),
+            "added_date": datetime.now().isoformat()
+        }
+        self._index_group_series(chat_key, group, series_key)
+        self.save_data()
+        return True
+    
+    def group_remove_series(self, chat_id, series_key: str) -> bool:
+        """Quita una serie de la lista del grupo y el progreso de los miembros en ella"""
+        chat_key = str(chat_id)
+        group = self.get_group(chat_key)
+        if group is None or group["series"].pop(series_key, None) is None:
+            return False
+        for member in group["members"].values():
+            member["progress"].pop(series_key, None)
+        self.group_behind.get(chat_key, {}).pop(series_key, None)
+        self.group_up_to_date.get(chat_key, set()).discard(series_key)
+        self.save_data()
+        return True
+    
+    def group_set_progress(self, chat_id, user_id, series_key: str, seasons: int) -> Optional[int]:
+        """Fija las temporadas vistas por un miembro; devuelve el valor guardado"""
+        chat_key, member_key = str(chat_id), str(user_id)
+        group = self.get_group(chat_key)
+        if group is None or series_key not in group["series"] or member_key not in group["members"]:
+            return None
+        member = group["members"][member_key]
+        seasons = min(max(seasons, 0), group["series"][series_key]["total_seasons"])
+        if seasons:
+            member["progress"][series_key] = seasons
+        else:
+            member["progress"].pop(series_key, None)
+        self._set_member_behind(chat_key, series_key, member_key,
+                                self._member_is_behind(group, member, series_key))
+        self.save_data()
+        return seasons
+    
+    def get_group_behind(self, chat_id, series_key: str) -> Set[str]:
+        """Miembros que van atrasados en una serie del grupo"""
+        return self.group_behind.get(str(chat_id), {}).get(series_key, set())
+    
+    def get_group_up_to_date(self, chat_id) -> Set[str]:
+        """Series del grupo en las que todos los miembros están al día"""
+        return self.group_up_to_date.get(str(chat_id), set())
+    
+    def get_series_name(self, series_key: str) -> str:
+        """Nombre de una serie seguida por algún usuario"""
+        for user_key in self.subscribers.get(series_key, ()):
+            return self.get_user_series(user_key).get(series_key, {}).get('name', series_key)
+        return series_key
+    
+    def get_global_stats(self, limit: int = 5) -> Dict:
+        """Estadísticas globales y rankings de series"""
+        return {
+            **self.global_stats,
+            'tracked_shows': len(self.subscribers),
+            'most_tracked': self.get_most_tracked(limit),
+            'most_completed': heapq.nlargest(limit, self.show_completed.items(), key=lambda item: item[1]),
+            'most_behind': heapq.nlargest(limit, self.show_behind.items(), key=lambda item: item[1])
+        }
+
+class SeriesBotPersistence(BasePersistence):
+    """Persistencia de conversaciones y user_data en un fichero de estado
+    
+    La aplicación entrega los cambios cada update_interval segundos; aquí se
+    marcan como pendientes y se escriben todos juntos en una sola escritura.
+    Las claves de user_data que empiezan por '_' son temporales y no se guardan.
+    """
+    
+    def __init__(self, filepath: str = STATE_FILE, update_interval: float = STATE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.filepath = filepath
+        self.user_data: Dict[int, Dict] = {}
+        self.conversations: Dict[str, Dict[Tuple, object]] = {}
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._load()
+    
+    def _load(self) -> None:
+        """Carga el estado guardado"""
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.user_data = {int(k): v for k, v in state.get('user_data', {}).items()}
+            self.conversations = {
+                name: {tuple(json.loads(key)): value for key, value in states.items()}
+                for name, states in state.get('conversations', {}).items()
+            }
+        except (json.JSONDecodeError, UnicodeDecodeError, ValueError, AttributeError) as e:
+            logger.error("Error cargando el estado de conversaciones: %s", e)
+    
+    def _serialize(self) -> Dict:
+        return {
+            'user_data': {str(k): v for k, v in self.user_data.items()},
+            'conversations': {
+                name: {json.dumps(list(key)): value for key, value in states.items()}
+                for name, states in self.conversations.items()
+            }
+        }
+    
+    def _mark_dirty(self) -> None:
+        """Marca el estado como modificado y programa una única escritura para este ciclo"""
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+    
+    async def _flush_soon(self) -> None:
+        # Ceder el control para que el resto de update_* del mismo ciclo se acumulen
+        await asyncio.sleep(0)
+        await self.flush()
+    
+    async def flush(self) -> None:
+        # Los cambios que llegan mientras se escribe no programan otra escritura
+        # (la tarea sigue viva): se vuelve a comprobar al terminar
+        async with self._flush_lock:
+            while self._dirty:
+                self._dirty = False
+                snapshot = self._serialize()
+                try:
+                    await asyncio.to_thread(write_json_atomic, self.filepath, snapshot)
+                except Exception as e:
+                    self._dirty = True
+                    logger.error("Error guardando el estado de conversaciones: %s", e)
+                    return
+    
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {user_id: dict(data) for user_id, data in self.user_data.items()}
+    
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        persistent = {k: v for k, v in data.items() if not k.startswith('_')}
+        if self.user_data.get(user_id, {}) == persistent:
+            return
+        if persistent:
+            self.user_data[user_id] = persistent
+        else:
+            self.user_data.pop(user_id, None)
+        self._mark_dirty()
+    
+    async def drop_user_data(self, user_id: int) -> None:
+        if self.user_data.pop(user_id, None) is not None:
+            self._mark_dirty()
+    
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+    
+    async def get_conversations(self, name: str) -> Dict:
+        return dict(self.conversations.get(name, {}))
+    
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        states = self.conversations.setdefault(name, {})
+        if states.get(key) == new_state:
+            return
+        if new_state is None:
+            states.pop(key, None)
+        else:
+            states[key] = new_state
+        self._mark_dirty()
+    
+    # Solo se persisten user_data y conversaciones
+    async def get_chat_data(self) -> Dict:
+        return {}
+    
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+    
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+    
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+    
+    async def get_bot_data(self) -> Dict:
+        return {}
+    
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+    
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+    
+    async def get_callback_data(self) -> None:
+        return None
+    
+    async def update_callback_data(self, data) -> None:
+        pass
+
+class LoopLagMonitor:
+    """Mide el retraso del bucle de eventos y la duración de los manejadores
+    
+    Cuando el bucle se retrasa más de LOOP_LAG_THRESHOLD, se registra en el log
+    el manejador más lento desde la comprobación anterior y los que siguen en curso.
+    """
+    
+    def __init__(self):
+        self.in_flight: Dict[int, Tuple[str, float]] = {}
+        self.slowest: Optional[Tuple[float, str]] = None
+        self.max_lag = 0.0
+        self._next_id = 0
+    
+    def handler_started(self, name: str) -> int:
+        self._next_id += 1
+        self.in_flight[self._next_id] = (name, time.monotonic())
+        return self._next_id
+    
+    def handler_finished(self, token: int) -> None:
+        name, started = self.in_flight.pop(token)
+        duration = time.monotonic() - started
+        if self.slowest is None or duration > self.slowest[0]:
+            self.slowest = (duration, name)
+    
+    async def run(self) -> None:
+        """Comprueba periódicamente cuánto tarda el bucle en despertar la tarea"""
+        while True:
+            expected = time.monotonic() + LOOP_LAG_CHECK_INTERVAL
+            await asyncio.sleep(LOOP_LAG_CHECK_INTERVAL)
+            lag = time.monotonic() - expected
+            self.max_lag = max(self.max_lag, lag)
+            if lag > LOOP_LAG_THRESHOLD:
+                now = time.monotonic()
+                running = ", ".join(f"{name} ({now - started:.2f}s)" for name, started in self.in_flight.values())
+                slowest = f"{self.slowest[1]} ({self.slowest[0]:.2f}s)" if self.slowest else "ninguno"
+                logger.warning("Bucle de eventos retrasado %.3fs; manejador más lento: %s; en curso: %s",
+                               lag, slowest, running or 'ninguno', extra={'latency_ms': round(lag * 1000)})
+            self.slowest = None
+
+def monitored(handler):
+    """Registra la duración de un manejador en el monitor de latencia"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        if update.callback_query:
+            detail = update.callback_query.data
+        elif update.message and update.message.text and update.message.text.startswith("/"):
+            detail = update.message.text.split()[0]
+        else:
+            detail = "texto"
+        token = loop_monitor.handler_started(f"{handler.__name__}[{detail}]")
+        started = time.monotonic()
+        try:
+            return await handler(update, context, *args, **kwargs)
+        finally:
+            loop_monitor.handler_finished(token)
+            logger.debug("Manejador %s completado", handler.__name__, extra={
+                'user_id': update.effective_user.id if update.effective_user else None,
+                'callback': detail,
+                'latency_ms': round((time.monotonic() - started) * 1000, 1)
+            })
+    return wrapper
+
+class Profiler:
+    """Capturas de cProfile y tracemalloc limitadas en el tiempo"""
+    
+    def __init__(self):
+        self.cpu: Optional[cProfile.Profile] = None
+        self.memory_snapshot: Optional[tracemalloc.Snapshot] = None
+    
+    def start_cpu(self) -> bool:
+        if self.cpu is not None:
+            return False
+        self.cpu = cProfile.Profile()
+        self.cpu.enable()
+        return True
+    
+    def stop_cpu(self) -> str:
+        """Detiene la captura de CPU y devuelve el informe"""
+        profile, self.cpu = self.cpu, None
+        if profile is None:
+            return ""
+        profile.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(30)
+        return output.getvalue()
+    
+    def start_memory(self) -> bool:
+        if self.memory_snapshot is not None:
+            return False
+        tracemalloc.start(10)
+        self.memory_snapshot = tracemalloc.take_snapshot()
+        return True
+    
+    def stop_memory(self) -> str:
+        """Detiene la captura de memoria y devuelve el informe"""
+        start_snapshot, self.memory_snapshot = self.memory_snapshot, None
+        if start_snapshot is None:
+            return ""
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        lines = [f"Memoria trazada: actual {current / 1024:.0f} KiB, pico {peak / 1024:.0f} KiB", "",
+                 "Mayores incrementos durante la captura:"]
+        lines += [str(stat) for stat in snapshot.compare_to(start_snapshot, 'lineno')[:30]]
+        lines += ["", "Mayores reservas vivas:"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:30]]
+        return "\n".join(lines)
+    
+    def toggle_to_file(self, kind: str) -> None:
+        """Inicia o detiene una captura desde una señal y guarda el informe en PROFILE_DIR"""
+        start, stop = (self.start_cpu, self.stop_cpu) if kind == "cpu" else (self.start_memory, self.stop_memory)
+        if start():
+            logger.info("Captura de %s iniciada por señal", kind)
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{kind}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(stop())
+        logger.info("Captura de %s guardada en %s", kind, path)
+
+class UpdateRecorder:
+    """Graba las actualizaciones recibidas, anonimizadas y con su instante de llegada
+    
+    Cada línea del fichero (NDJSON comprimido con gzip, en bloques) es
+    {"t": segundos desde el inicio, "u": actualización}. Solo se guardan los
+    campos que necesita el bot para atender la actualización: los ids de
+    usuarios y chats se sustituyen por seudónimos estables durante la
+    grabación y se descartan nombres, alias y títulos. El texto escrito se
+    conserva porque son las búsquedas que hay que reproducir.
+    """
+    
+    UPDATE_FIELDS = ('update_id', 'message', 'edited_message', 'callback_query')
+    MESSAGE_FIELDS = ('message_id', 'date', 'chat', 'from', 'text', 'entities')
+    CALLBACK_FIELDS = ('id', 'from', 'message', 'chat_instance', 'data')
+    # Del mensaje al que pertenece un botón basta con saber cuál es
+    CALLBACK_MESSAGE_FIELDS = ('message_id', 'date', 'chat')
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.monotonic()
+        self.buffer: List[str] = []
+        self._salt = os.urandom(16)
+    
+    def _pseudonym(self, value: int) -> int:
+        digest = hashlib.blake2b(str(value).encode(), key=self._salt, digest_size=4).digest()
+        pseudonym = int.from_bytes(digest, 'big') & 0x7FFFFFFF or 1
+        # Se conserva el signo: los grupos tienen ids negativos
+        return -pseudonym if value < 0 else pseudonym
+    
+    def _person(self, data: Dict) -> Dict:
+        person = {k: data[k] for k in ('type', 'is_bot', 'language_code') if k in data}
+        person['id'] = self._pseudonym(data['id'])
+        if 'is_bot' in data:
+            person['first_name'] = "Usuario"
+        return person
+    
+    def _message(self, data: Dict, fields: Sequence[str]) -> Dict:
+        message = {k: data[k] for k in fields if k in data}
+        for key in ('chat', 'from'):
+            if key in message:
+                message[key] = self._person(message[key])
+        return message
+    
+    def anonymize(self, update: Update) -> Optional[Dict]:
+        """Versión reducida y anonimizada de la actualización, o None si no se graba"""
+        data = update.to_dict()
+        record = {'update_id': data['update_id']}
+        for key in ('message', 'edited_message'):
+            if key in data:
+                record[key] = self._message(data[key], self.MESSAGE_FIELDS)
+        if 'callback_query' in data:
+            query = {k: data['callback_query'][k] for k in self.CALLBACK_FIELDS if k in data['callback_query']}
+            query['from'] = self._person(query['from'])
+            if 'message' in query:
+                query['message'] = self._message(query['message'], self.CALLBACK_MESSAGE_FIELDS)
+            record['callback_query'] = query
+        return record if len(record) > 1 else None
+    
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Manejador previo a todos los demás: añade la actualización al búfer"""
+        record = self.anonymize(update)
+        if record is not None:
+            self.buffer.append(json.dumps({'t': round(time.monotonic() - self.started, 3), 'u': record},
+                                          ensure_ascii=False, separators=(',', ':')))
+    
+    def flush(self) -> None:
+        """Añade el búfer al fichero (cada bloque es un miembro gzip independiente)"""
+        lines, self.buffer = self.buffer, []
+        if lines:
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+    
+    async def run(self) -> None:
+        """Vuelca el búfer periódicamente fuera del bucle de eventos"""
+        try:
+            while True:
+                await asyncio.sleep(RECORD_FLUSH_INTERVAL)
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.flush()
+
+class RequestGuard:
+    """Presupuesto de peticiones por usuario y antirrebote de botones
+    
+    Se consulta antes que cualquier manejador: cada acción gasta una ficha del
+    cubo del usuario para su tipo (ACTION_LIMITS) y las pulsaciones repetidas
+    del mismo botón dentro de CALLBACK_DEBOUNCE_WINDOW se ignoran.
+    """
+    
+    def __init__(self):
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._recent_callbacks: Dict[Tuple[int, int, int, str], float] = {}
+        self._noticed: Dict[int, float] = {}
+        self.rejected: Dict[str, int] = {action: 0 for action in ACTION_LIMITS}
+        self.debounced = 0
+    
+    @staticmethod
+    def classify(update: Update) -> str:
+        """Tipo de acción de una actualización"""
+        if update.callback_query:
+            data = update.callback_query.data or ""
+            for prefix, action in ACTION_PREFIXES.items():
+                if data.startswith(prefix):
+                    return action
+            return 'default'
+        if update.message and update.message.text and not update.message.text.startswith("/"):
+            return 'search'
+        return 'default'
+    
+    def is_duplicate(self, bot_id: int, user_id: int, message_id: int, data: str, now: float) -> bool:
+        """Indica si el mismo botón del mismo mensaje (de este bot) se pulsó hace muy poco"""
+        if len(self._recent_callbacks) > 10000:
+            self._recent_callbacks = {k: t for k, t in self._recent_callbacks.items()
+                                      if now - t < CALLBACK_DEBOUNCE_WINDOW}
+        key = (bot_id, user_id, message_id, data)
+        last = self._recent_callbacks.get(key)
+        self._recent_callbacks[key] = now
+        return last is not None and now - last < CALLBACK_DEBOUNCE_WINDOW
+    
+    def delay(self, user_id: int, action: str, now: float) -> float:
+        """Gasta una ficha del usuario; devuelve 0 o los segundos que debe esperar"""
+        bucket = self._buckets.get((user_id, action))
+        if bucket is None:
+            if len(self._buckets) > 50000:
+                # Olvidar a los usuarios inactivos: sus cubos ya están llenos
+                self._buckets = {k: v for k, v in self._buckets.items() if not v.is_full(now)}
+            bucket = self._buckets[(user_id, action)] = TokenBucket(*ACTION_LIMITS[action])
+        wait = bucket.delay(now)
+        if wait > 0:
+            self.rejected[action] += 1
+            return wait
+        bucket.consume()
+        return 0.0
+    
+    def should_notice(self, user_id: int, now: float) -> bool:
+        """Solo se avisa por mensaje una vez cada SLOW_DOWN_NOTICE_INTERVAL"""
+        if now - self._noticed.get(user_id, -SLOW_DOWN_NOTICE_INTERVAL) < SLOW_DOWN_NOTICE_INTERVAL:
+            return False
+        if len(self._noticed) > 10000:
+            self._noticed = {k: t for k, t in self._noticed.items() if now - t < SLOW_DOWN_NOTICE_INTERVAL}
+        self._noticed[user_id] = now
+        return True
+
+# SeriesBot de la aplicación que atiende la tarea actual. Con un solo bot se usa
+# siempre el de por defecto; con varios en el mismo proceso (serve_bots) cada
+# Application crea sus tareas con el suyo fijado en current_series_bot.
+current_series_bot: ContextVar[Optional[SeriesBot]] = ContextVar("current_series_bot", default=None)
+_default_series_bot = SeriesBot()
+
+def get_series_bot() -> SeriesBot:
+    """SeriesBot del contexto actual"""
+    return current_series_bot.get() or _default_series_bot
+
+def set_series_bot(bot: SeriesBot) -> None:
+    """Sustituye el SeriesBot por defecto del proceso"""
+    global _default_series_bot
+    _default_series_bot = bot
+
+class SeriesBotProxy:
+    """Da acceso al SeriesBot del contexto actual con la interfaz de SeriesBot"""
+    
+    __slots__ = ()
+    
+    def __getattr__(self, name):
+        return getattr(get_series_bot(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(get_series_bot(), name, value)
+
+# Instancia global del bot
+series_bot = SeriesBotProxy()
+request_guard = RequestGuard()
+update_recorder = UpdateRecorder(RECORD_UPDATES_FILE) if RECORD_UPDATES_FILE else None
+loop_monitor = LoopLagMonitor()
+profiler = Profiler()
+# Pool de procesos de los mosaicos de pósters (se crea al primer uso)
+collage_executor: Optional[ProcessPoolExecutor] = None
+
+def get_collage_executor() -> ProcessPoolExecutor:
+    """Pool compartido por todos los bots del proceso para componer mosaicos"""
+    global collage_executor
+    if collage_executor is None:
+        collage_executor = ProcessPoolExecutor(max_workers=COLLAGE_WORKERS,
+                                               mp_context=multiprocessing.get_context("fork"))
+    return collage_executor
+
+def cancel_prefetch(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+    """Cancela la precarga pendiente del usuario"""
+    task = context.bot_data.get('_prefetch_tasks', {}).pop(user_id, None)
+    if task and not task.done():
+        task.cancel()
+
+def schedule_prefetch(update: Update, context: ContextTypes.DEFAULT_TYPE, series_ids: List[int]) -> None:
+    """Precarga en segundo plano los detalles de los primeros resultados de búsqueda"""
+    user_id = update.effective_user.id
+    cancel_prefetch(context, user_id)
+    
+    # Presupuesto por usuario: ventana fija de PREFETCH_BUDGET_WINDOW segundos
+    now = time.monotonic()
+    window_start, used = context.user_data.get('_prefetch_budget', (now, 0))
+    if now - window_start > PREFETCH_BUDGET_WINDOW:
+        window_start, used = now, 0
+    
+    pending = [
+        series_id for series_id in series_ids[:PREFETCH_TOP_N]
+        if series_bot.tmdb._cache_get(('tv', series_id)) is None
+    ][:max(0, PREFETCH_BUDGET - used)]
+    context.user_data['_prefetch_budget'] = (window_start, used + len(pending))
+    
+    if pending:
+        # Precargas en curso de cada bot (en bot_data, que no se persiste; user_data sí)
+        prefetch_tasks = context.bot_data.setdefault('_prefetch_tasks', {})
+        task = context.application.create_task(prefetch_series(pending))
+        prefetch_tasks[user_id] = task
+        task.add_done_callback(lambda t: prefetch_tasks.pop(user_id) if prefetch_tasks.get(user_id) is t else None)
 
-# Instancia global del bot
-series_bot = SeriesBot()
+async def prefetch_series(series_ids: List[int]) -> None:
+    """Descarga los detalles y el póster de cada serie para que la selección salga de caché"""
+    for series_id in series_ids:
+        series_details = await series_bot.get_series_details(series_id)
+        poster_path = series_details.get('poster_path') if series_details else None
+        if poster_path and poster_path not in series_bot.poster_file_ids:
+            try:
+                await series_bot.tmdb.get_poster(poster_path)
+            except Exception as e:
+                logger.warning("No se pudo precargar el póster: %s", e)
+
+async def send_poster(context: ContextTypes.DEFAULT_TYPE, chat_id: int, poster_path: str, **kwargs) -> None:
+    """Envía un póster reutilizando su file_id o los bytes precargados si los hay"""
+    tmdb = series_bot.tmdb
+    # Los file_id son propios de cada bot de Telegram
+    photo = series_bot.poster_file_ids.get(poster_path)
+    if photo is None and poster_path in tmdb.posters:
+        photo = InputFile(io.BytesIO(tmdb.posters[poster_path]), filename="poster.jpg")
+    if photo is None:
+        photo = f"{TMDB_IMAGE_BASE_URL}{poster_path}"
+    
+    message = await context.bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    if message.photo:
+        series_bot.poster_file_ids[poster_path] = message.photo[-1].file_id
+        tmdb.posters.pop(poster_path, None)
+
+async def guard_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Filtro previo a todos los manejadores: antirrebote y presupuesto por usuario"""
+    user = update.effective_user
+    if user is None:
+        return
+    now = time.monotonic()
+    query = update.callback_query
+    
+    if query and query.message and request_guard.is_duplicate(context.bot.id, user.id, query.message.message_id,
+                                                              query.data, now):
+        request_guard.debounced += 1
+        await query.answer()
+        raise ApplicationHandlerStop
+    
+    wait = request_guard.delay(user.id, request_guard.classify(update), now)
+    if not wait:
+        return
+    if query:
+        # Telegram guarda la respuesta en el cliente durante cache_time: las pulsaciones
+        # siguientes ni siquiera llegan al bot
+        await query.answer(SLOW_DOWN_TEXT, cache_time=math.ceil(wait))
+    elif update.message and request_guard.should_notice(user.id, now):
+        await update.message.reply_text(SLOW_DOWN_TEXT)
+    raise ApplicationHandlerStop
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Comando /start"""
@@ -189,6 +2019,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         [InlineKeyboardButton("🗑️ Eliminar serie", callback_data="delete_series")],
         [InlineKeyboardButton("📊 Estadísticas", callback_data="stats")],
         [InlineKeyboardButton("⏰ Recordatorios", callback_data="reminders")],
+        [InlineKeyboardButton("✨ Recomendaciones", callback_data="recommendations")],
         [InlineKeyboardButton("💾 Exportar datos", callback_data="export_data")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -222,6 +2053,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     data = query.data
     
+    if data != "noop":
+        # La conversación ha avanzado: la precarga de resultados ya no sirve
+        cancel_prefetch(context, update.effective_user.id)
+    
     if data == "main_menu":
         await start(update, context)
         return ConversationHandler.END
@@ -272,10 +2107,48 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_reminders(update, context)
         return ConversationHandler.END
     
+    elif data == "digest_settings":
+        await show_digest_settings(update, context)
+        return ConversationHandler.END
+    
+    elif data.startswith("digest_"):
+        setting, _, value = data[len("digest_"):].partition("_")
+        user_id = update.effective_user.id
+        if setting == "mode" and value in DIGEST_MODES:
+            series_bot.update_user_settings(user_id, digest_mode=value)
+        elif setting == "time" and f"{value[:2]}:{value[2:]}" in DIGEST_TIMES:
+            series_bot.update_user_settings(user_id, digest_time=f"{value[:2]}:{value[2:]}")
+        elif setting == "tz" and re.fullmatch(r"[+-]?\d{1,2}", value):
+            # Los husos horarios van de UTC-12 a UTC+14
+            series_bot.update_user_settings(user_id, utc_offset=max(-12, min(14, int(value))))
+        await show_digest_settings(update, context)
+        return ConversationHandler.END
+    
+    elif data in ("calendar_feed", "calendar_rotate"):
+        await show_calendar_feed(update, context, rotate=data == "calendar_rotate")
+        return ConversationHandler.END
+    
+    elif data == "api_rotate":
+        await show_api_access(update, context, rotate=True)
+        return ConversationHandler.END
+    
+    elif data == "recommendations":
+        await show_recommendations(update, context)
+        return ConversationHandler.END
+    
     elif data == "export_data":
         await export_user_data(update, context)
         return ConversationHandler.END
     
+    elif data.startswith("grp_"):
+        await group_button_handler(update, context)
+        return ConversationHandler.END
+    
+    elif data.startswith("gallery_"):
+        _, list_type, page = data.split("_")
+        await show_series_gallery(update, context, list_type, int(page))
+        return ConversationHandler.END
+    
     elif data.startswith("list_"):
         list_type = data.split("_", 1)[1]
         await show_series_list(update, context, list_type)
@@ -291,29 +2164,65 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await handle_series_selection(update, context, series_id)
         return SELECTING_SEASON
     
+    elif data == "noop":
+        # Botón informativo (indicador de página): no cambia el estado
+        return None
+    
+    elif data.startswith("seasons_page_"):
+        page = int(data.rsplit("_", 1)[1])
+        series_id = context.user_data.get('selected_series_id')
+        series_details = await series_bot.get_series_details(series_id) if series_id else None
+        if not series_details:
+            await start(update, context)
+            return ConversationHandler.END
+        
+        keyboard = build_season_picker(series_details.get('number_of_seasons', 0), page)
+        keyboard.append([InlineKeyboardButton("🔙 Volver a resultados", callback_data="add_series")])
+        await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+        return SELECTING_SEASON
+    
+    elif data.startswith("eps_"):
+        series_key, page = data[len("eps_"):].rsplit("_", 1)
+        await show_episode_seasons(update, context, series_key, int(page))
+        return ConversationHandler.END
+    
+    elif data.startswith("epl_"):
+        series_key, season_num, page = data[len("epl_"):].rsplit("_", 2)
+        await show_season_episodes(update, context, series_key, int(season_num), int(page))
+        return ConversationHandler.END
+    
+    elif data.startswith("ept_"):
+        series_key, season_num, episode_num, page = data[len("ept_"):].rsplit("_", 3)
+        if series_bot.toggle_episode(update.effective_user.id, series_key, int(season_num), int(episode_num)):
+            await advance_season_progress(update.effective_user.id, series_key, int(season_num))
+        await show_season_episodes(update, context, series_key, int(season_num), int(page))
+        return ConversationHandler.END
+    
+    elif data.startswith("epa_"):
+        series_key, season_num, watched = data[len("epa_"):].rsplit("_", 2)
+        await mark_whole_season(update, context, series_key, int(season_num), watched == "1")
+        return ConversationHandler.END
+    
     elif data.startswith("season_"):
         season_num = int(data.split("_", 1)[1])
         context.user_data['selected_season'] = season_num
+        context.user_data.pop('has_ended', None)
+        context.user_data.pop('next_season_date', None)
         
-        keyboard = [
-            [InlineKeyboardButton("✅ Sí, ya terminó", callback_data="ended_yes")],
-            [InlineKeyboardButton("❌ No, aún se emite", callback_data="ended_no")],
-            [InlineKeyboardButton("🔙 Atrás", callback_data="back_to_seasons")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message_text = (
-            f"¿La serie ya terminó de emitirse completamente?\n\n"
-            f"(Has visto {season_num} temporada{'s' if season_num != 1 else ''})"
-        )
-        
-        # Try to edit the message, if it fails, send a new one
-        try:
-            await query.edit_message_text(message_text, reply_markup=reply_markup)
-        except Exception as e:
-            # If editing fails (message was deleted for photo), send new message
-            await query.message.reply_text(message_text, reply_markup=reply_markup)
+        # Los detalles ya están en caché desde la selección: si TMDB sabe si terminó
+        # y cuándo vuelve, se guarda sin preguntar
+        series_id = context.user_data.get('selected_series_id')
+        has_ended, next_season_date = derive_air_status(
+            await series_bot.get_series_details(series_id) if series_id else None)
+        if has_ended or next_season_date:
+            await save_series_data(update, context)
+            return ConversationHandler.END
+        if has_ended is False:
+            context.user_data['has_ended'] = False
+            await ask_next_season_date(update, context, back="back_to_seasons")
+            return NEXT_SEASON_DATE
         
+        await ask_series_ended(update, context)
         return SERIES_ENDED
     
     elif data in ["ended_yes", "ended_no"]:
@@ -324,26 +2233,43 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await save_series_data(update, context)
             return ConversationHandler.END
         else:
-            # CORRECCIÓN: Establecer el estado correctamente
-            context.user_data['state'] = NEXT_SEASON_DATE
-            
-            keyboard = [[InlineKeyboardButton("🔙 Atrás", callback_data="back_to_ended")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            message_text = (
-                "📅 ¿Cuándo se estrena la próxima temporada?\n\n"
-                "Escribe la fecha en formato DD/MM/AAAA\n"
-                "O escribe 'desconocida' si no se sabe aún:"
-            )
-            
-            # Try to edit the message, if it fails, send a new one
-            try:
-                await query.edit_message_text(message_text, reply_markup=reply_markup)
-            except Exception as e:
-                await query.message.reply_text(message_text, reply_markup=reply_markup)
-            
+            await ask_next_season_date(update, context, back="back_to_ended")
             return NEXT_SEASON_DATE
     
+    elif data == "back_to_seasons":
+        series_id = context.user_data.get('selected_series_id')
+        series_details = await series_bot.get_series_details(series_id) if series_id else None
+        if not series_details:
+            await start(update, context)
+            return ConversationHandler.END
+        
+        context.user_data['state'] = SELECTING_SEASON
+        page = (context.user_data.get('selected_season', 1) - 1) // SEASONS_PER_PAGE
+        keyboard = build_season_picker(series_details.get('number_of_seasons', 0), page)
+        keyboard.append([InlineKeyboardButton("🔙 Volver a resultados", callback_data="add_series")])
+        message_text = f"📺 {series_details.get('name', 'Sin título')}\n\n¿Cuál fue la última temporada que viste completa?"
+        try:
+            await query.edit_message_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        except Exception:
+            await query.message.reply_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        return SELECTING_SEASON
+    
+    elif data == "back_to_ended":
+        context.user_data.pop('has_ended', None)
+        await ask_series_ended(update, context)
+        return SERIES_ENDED
+    
+    elif data.startswith("edit_field_"):
+        field, series_key = data[len("edit_field_"):].split("_", 1)
+        return await handle_edit_field(update, context, field, series_key)
+    
+    elif data.startswith("edit_seasons_"):
+        series_key, seasons = data[len("edit_seasons_"):].rsplit("_", 1)
+        series = series_bot.get_user_series(update.effective_user.id).get(series_key)
+        if series and 0 <= int(seasons) <= series.get('total_seasons', 0):
+            series_bot.update_series(update.effective_user.id, series_key, 'seasons_watched', int(seasons))
+        return await handle_edit_field(update, context, "seasons", series_key)
+    
     elif data.startswith("edit_"):
         series_key = data.split("_", 1)[1]
         await show_edit_options(update, context, series_key)
@@ -380,6 +2306,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if state == SEARCHING_SERIES:
         # Establecer el estado correctamente para el flujo
         context.user_data['state'] = SEARCHING_SERIES
+        cancel_prefetch(context, update.effective_user.id)
         
         # Buscar series en TMDB
         series_results = await series_bot.search_series_tmdb(text)
@@ -417,6 +2344,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "📺 Selecciona la serie correcta:",
             reply_markup=reply_markup
         )
+        schedule_prefetch(update, context, [series['id'] for series in series_results])
         return SELECTING_SERIES
     
     elif state == NEXT_SEASON_DATE:
@@ -450,6 +2378,24 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 )
                 return NEXT_SEASON_DATE
         
+        editing_key = context.user_data.pop('editing_date', None)
+        if editing_key:
+            # Cambio de fecha desde el menú de edición
+            next_season_date = context.user_data.pop('next_season_date')
+            fields = {'next_season_date': next_season_date}
+            if next_season_date != 'Desconocida':
+                fields['has_ended'] = False
+            series_bot.update_series_fields(update.effective_user.id, editing_key, fields)
+            context.user_data.pop('state', None)
+            await update.message.reply_text(
+                f"✅ Fecha del próximo estreno actualizada: {next_season_date}",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("✏️ Seguir editando", callback_data=f"edit_{editing_key}"),
+                    InlineKeyboardButton("🏠 Menú principal", callback_data="main_menu")
+                ]])
+            )
+            return ConversationHandler.END
+        
         await save_series_data(update, context)
         return ConversationHandler.END
     
@@ -472,8 +2418,8 @@ async def handle_series_selection(update: Update, context: ContextTypes.DEFAULT_
         )
         return
     
-    # Guardar datos de la serie seleccionada
-    context.user_data['selected_series'] = series_details
+    # Guardar solo el id: los detalles quedan en la caché de TMDB
+    context.user_data['selected_series_id'] = series_details['id']
     
     # Crear mensaje con información de la serie
     title = series_details.get('name', 'Sin título')
@@ -492,32 +2438,26 @@ async def handle_series_selection(update: Update, context: ContextTypes.DEFAULT_
     info_text += f"📖 **Sinopsis:**\n{overview}\n\n"
     info_text += "¿Cuál fue la última temporada que viste completa?"
     
-    # Crear botones para selección de temporadas
-    keyboard = []
-    for i in range(1, min(total_seasons + 1, 21)):  # Máximo 20 temporadas por limitación de botones
-        keyboard.append([InlineKeyboardButton(f"Temporada {i}", callback_data=f"season_{i}")])
-    
-    if total_seasons > 20:
-        keyboard.append([InlineKeyboardButton("Más temporadas...", callback_data="more_seasons")])
-    
+    # Crear botones para selección de temporadas (paginado)
+    keyboard = build_season_picker(total_seasons, 0)
     keyboard.append([InlineKeyboardButton("🔙 Volver a resultados", callback_data="add_series")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Enviar imagen si está disponible
     if poster_path:
-        image_url = f"{TMDB_IMAGE_BASE_URL}{poster_path}"
         try:
             await update.callback_query.delete_message()
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=image_url,
+            await send_poster(
+                context,
+                update.effective_chat.id,
+                poster_path,
                 caption=info_text,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
             return
         except Exception as e:
-            logger.warning(f"No se pudo enviar la imagen: {e}")
+            logger.warning("No se pudo enviar la imagen: %s", e)
     
     # Si no hay imagen o falla el envío, enviar solo texto
     await update.callback_query.edit_message_text(
@@ -528,10 +2468,17 @@ async def handle_series_selection(update: Update, context: ContextTypes.DEFAULT_
 
 async def save_series_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Guarda los datos de la serie en la base de datos"""
-    series_details = context.user_data.get('selected_series')
+    series_id = context.user_data.get('selected_series_id')
+    series_details = await series_bot.get_series_details(series_id) if series_id else None
     seasons_watched = context.user_data.get('selected_season')
-    has_ended = context.user_data.get('has_ended')
-    next_season_date = context.user_data.get('next_season_date', 'Desconocida')
+    # Lo que no haya contestado el usuario se toma de los detalles de TMDB
+    derived_ended, derived_date = derive_air_status(series_details)
+    user_ended = context.user_data.get('has_ended')
+    user_date = context.user_data.get('next_season_date')
+    has_ended = user_ended if user_ended is not None else derived_ended
+    next_season_date = user_date or derived_date or 'Desconocida'
+    from_tmdb = (user_ended is None and derived_ended is not None) or \
+        (not has_ended and not user_date and derived_date is not None)
     
     if not series_details or seasons_watched is None:
         # CORRECCIÓN: Manejo de error cuando faltan datos
@@ -581,6 +2528,9 @@ async def save_series_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         message = f"✅ Serie '{series_data['name']}' añadida correctamente a tu lista."
+        if from_tmdb:
+            status = "🏁 Ya ha terminado" if has_ended else f"📅 Próximo estreno: {next_season_date}"
+            message += f"\n\n{status} (según TMDB). Si no es así, cámbialo en ✏️ Editar serie."
     
     # Limpiar datos temporales
     context.user_data.clear()
@@ -617,6 +2567,43 @@ async def show_series_lists_menu(update: Update, context: ContextTypes.DEFAULT_T
     else:
         await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
+def filter_series_list(user_series: Dict, list_type: str) -> List[Tuple[str, Dict]]:
+    """Series de una lista (all/completed/ongoing/pending/ended) en el orden en que se muestran"""
+    # Filtrar series según el tipo de lista
+    filtered_series = []
+    for series_key, series_data in user_series.items():
+        if list_type == "all":
+            filtered_series.append((series_key, series_data))
+        elif list_type == "completed":
+            if series_data.get('up_to_date', False) and series_data.get('has_ended', False):
+                filtered_series.append((series_key, series_data))
+        elif list_type == "ongoing":
+            if not series_data.get('has_ended', True):
+                filtered_series.append((series_key, series_data))
+        elif list_type == "pending":
+            if not series_data.get('up_to_date', True) and series_data.get('has_ended', False):
+                filtered_series.append((series_key, series_data))
+        elif list_type == "ended":
+            if series_data.get('has_ended', False):
+                filtered_series.append((series_key, series_data))
+    
+    # Ordenar series
+    if list_type == "ongoing":
+        # Ordenar por fecha de próximo estreno
+        def sort_key(item):
+            next_date = item[1].get('next_season_date', 'Desconocida')
+            if next_date == 'Desconocida':
+                return datetime.max
+            try:
+                return datetime.strptime(next_date, "%d/%m/%Y")
+            except:
+                return datetime.max
+        filtered_series.sort(key=sort_key)
+    else:
+        # Ordenar alfabéticamente
+        filtered_series.sort(key=lambda x: x[1].get('name', '').lower())
+    return filtered_series
+
 async def show_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE, list_type: str) -> None:
     """Muestra una lista específica de series"""
     user_id = update.effective_user.id
@@ -638,24 +2625,7 @@ async def show_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE, l
             )
         return
     
-    # Filtrar series según el tipo de lista
-    filtered_series = []
-    
-    for series_key, series_data in user_series.items():
-        if list_type == "all":
-            filtered_series.append((series_key, series_data))
-        elif list_type == "completed":
-            if series_data.get('up_to_date', False) and series_data.get('has_ended', False):
-                filtered_series.append((series_key, series_data))
-        elif list_type == "ongoing":
-            if not series_data.get('has_ended', True):
-                filtered_series.append((series_key, series_data))
-        elif list_type == "pending":
-            if not series_data.get('up_to_date', True) and series_data.get('has_ended', False):
-                filtered_series.append((series_key, series_data))
-        elif list_type == "ended":
-            if series_data.get('has_ended', False):
-                filtered_series.append((series_key, series_data))
+    filtered_series = filter_series_list(user_series, list_type)
     
     if not filtered_series:
         keyboard = [[InlineKeyboardButton("🔙 Volver a listas", callback_data="view_series")]]
@@ -677,22 +2647,6 @@ async def show_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE, l
             await update.callback_query.message.reply_text(message, reply_markup=reply_markup)
         return
     
-    # Ordenar series
-    if list_type == "ongoing":
-        # Ordenar por fecha de próximo estreno
-        def sort_key(item):
-            next_date = item[1].get('next_season_date', 'Desconocida')
-            if next_date == 'Desconocida':
-                return datetime.max
-            try:
-                return datetime.strptime(next_date, "%d/%m/%Y")
-            except:
-                return datetime.max
-        filtered_series.sort(key=sort_key)
-    else:
-        # Ordenar alfabéticamente
-        filtered_series.sort(key=lambda x: x[1].get('name', '').lower())
-    
     # Crear mensaje
     list_titles = {
         "all": "📋 Todas mis Series",
@@ -718,6 +2672,8 @@ async def show_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE, l
         button_text = f"{status_emoji} {name} ({seasons_info})"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"series_{series_key}")])
     
+    if COLLAGES_ENABLED:
+        keyboard.append([InlineKeyboardButton("🖼️ Vista con pósters", callback_data=f"gallery_{list_type}_0")])
     keyboard.append([InlineKeyboardButton("🔙 Volver a listas", callback_data="view_series")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -729,6 +2685,81 @@ async def show_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE, l
     except Exception:
         await update.callback_query.message.reply_text(message, reply_markup=reply_markup)
 
+async def build_collage(poster_paths: List[Optional[str]]) -> str:
+    """Fichero del mosaico de unos pósters; si no está en la caché se compone en el pool"""
+    path = collage_path(collage_key(poster_paths), COLLAGE_DIR)
+    if os.path.exists(path):
+        # Marca de uso para la limpieza de la caché
+        os.utime(path)
+        return path
+    
+    async def thumbnail(poster_path: Optional[str]) -> Optional[str]:
+        if not poster_path:
+            return None
+        try:
+            return await series_bot.tmdb.get_thumbnail(poster_path)
+        except Exception as e:
+            logger.warning("No se pudo descargar la miniatura: %s", e)
+            return None
+    
+    thumbs = await asyncio.gather(*(thumbnail(poster_path) for poster_path in poster_paths))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_collage_executor(), render_collage, list(thumbs), path)
+
+async def show_series_gallery(update: Update, context: ContextTypes.DEFAULT_TYPE, list_type: str, page: int) -> None:
+    """Muestra una página de la lista como un único mosaico con los pósters"""
+    query = update.callback_query
+    filtered_series = filter_series_list(series_bot.get_user_series(update.effective_user.id), list_type)
+    if not filtered_series or not COLLAGES_ENABLED:
+        await show_series_list(update, context, list_type)
+        return
+    
+    total_pages = max(1, -(-len(filtered_series) // COLLAGE_PER_PAGE))
+    page = min(max(page, 0), total_pages - 1)
+    items = filtered_series[page * COLLAGE_PER_PAGE:(page + 1) * COLLAGE_PER_PAGE]
+    
+    lines = [f"🖼️ Página {page + 1}/{total_pages}\n"]
+    keyboard = []
+    row = []
+    for i, (series_key, series_data) in enumerate(items, 1):
+        seasons_info = f"{series_data.get('seasons_watched', 0)}/{series_data.get('total_seasons', 0)}"
+        lines.append(f"{i}. {series_data.get('name', 'Sin nombre')[:30]} ({seasons_info})")
+        row.append(InlineKeyboardButton(str(i), callback_data=f"series_{series_key}"))
+        if len(row) == 4:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    nav_row = build_page_nav_row(f"gallery_{list_type}_", page, total_pages)
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([InlineKeyboardButton("📝 Vista de texto", callback_data=f"list_{list_type}")])
+    keyboard.append([InlineKeyboardButton("🔙 Volver a listas", callback_data="view_series")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    caption = "\n".join(lines)
+    
+    # La misma página (mismos pósters en el mismo orden) reutiliza el file_id de este bot
+    poster_paths = [series_data.get('poster_path') or None for _, series_data in items]
+    key = collage_key(poster_paths)
+    photo = series_bot.collage_file_ids.get(key)
+    if photo is None:
+        try:
+            data = await asyncio.to_thread(read_file_bytes, await build_collage(poster_paths))
+            photo = InputFile(data, filename="posters.jpg")
+        except Exception as e:
+            logger.warning("No se pudo componer el mosaico: %s", e)
+            await show_series_list(update, context, list_type)
+            return
+    
+    if query.message and query.message.photo:
+        message = await query.edit_message_media(InputMediaPhoto(photo, caption=caption), reply_markup=reply_markup)
+    else:
+        await query.delete_message()
+        message = await context.bot.send_photo(update.effective_chat.id, photo=photo, caption=caption,
+                                               reply_markup=reply_markup)
+    if getattr(message, 'photo', None):
+        series_bot.collage_file_ids[key] = message.photo[-1].file_id
+
 async def show_series_details(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str) -> None:
     """Muestra los detalles completos de una serie"""
     user_id = update.effective_user.id
@@ -781,6 +2812,7 @@ async def show_series_details(update: Update, context: ContextTypes.DEFAULT_TYPE
     message += f"📖 **Sinopsis:**\n{overview}"
     
     keyboard = [
+        [InlineKeyboardButton("📺 Episodios", callback_data=f"eps_{series_key}_0")],
         [InlineKeyboardButton("🔙 Volver a listas", callback_data="view_series")],
         [InlineKeyboardButton("🏠 Menú principal", callback_data="main_menu")]
     ]
@@ -789,19 +2821,19 @@ async def show_series_details(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Enviar imagen si está disponible
     poster_path = series.get('poster_path')
     if poster_path:
-        image_url = f"{TMDB_IMAGE_BASE_URL}{poster_path}"
         try:
             await update.callback_query.delete_message()
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=image_url,
+            await send_poster(
+                context,
+                update.effective_chat.id,
+                poster_path,
                 caption=message,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
             return
         except Exception as e:
-            logger.warning(f"No se pudo enviar la imagen: {e}")
+            logger.warning("No se pudo enviar la imagen: %s", e)
     
     # Si no hay imagen o falla el envío, enviar solo texto
     await update.callback_query.edit_message_text(
@@ -810,6 +2842,145 @@ async def show_series_details(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode='Markdown'
     )
 
+async def show_episode_seasons(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str, page: int) -> None:
+    """Muestra el selector paginado de temporadas para el seguimiento por episodios"""
+    user_id = update.effective_user.id
+    user_series = series_bot.get_user_series(user_id)
+    
+    if series_key not in user_series:
+        keyboard = [[InlineKeyboardButton("🔙 Volver a listas", callback_data="view_series")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        try:
+            await update.callback_query.edit_message_text("❌ Serie no encontrada.", reply_markup=reply_markup)
+        except Exception:
+            await update.callback_query.message.reply_text("❌ Serie no encontrada.", reply_markup=reply_markup)
+        return
+    
+    series = user_series[series_key]
+    total_seasons = series.get('total_seasons', 0)
+    episodes_watched = series.get('episodes_watched', {})
+    
+    total_pages = max(1, -(-total_seasons // SEASONS_PER_PAGE))
+    page = min(max(page, 0), total_pages - 1)
+    first = page * SEASONS_PER_PAGE + 1
+    last = min(first + SEASONS_PER_PAGE - 1, total_seasons)
+    
+    keyboard = []
+    row = []
+    for season_num in range(first, last + 1):
+        # El recuento sale del bitset, sin pedir nada a TMDB
+        watched = bin(bitset_from_hex(episodes_watched.get(str(season_num)))).count("1")
+        label = f"T{season_num} ({watched})" if watched else f"T{season_num}"
+        row.append(InlineKeyboardButton(label, callback_data=f"epl_{series_key}_{season_num}_0"))
+        if len(row) == SEASON_BUTTONS_PER_ROW:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    
+    nav_row = build_page_nav_row(f"eps_{series_key}_", page, total_pages)
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([InlineKeyboardButton("🔙 Volver a la serie", callback_data=f"series_{series_key}")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = f"📺 **{series.get('name', 'Sin nombre')}**\n\nSelecciona una temporada para marcar episodios:"
+    
+    try:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception:
+        await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def show_season_episodes(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str,
+                               season_num: int, page: int) -> None:
+    """Muestra los episodios de una temporada con su estado de visionado"""
+    user_id = update.effective_user.id
+    user_series = series_bot.get_user_series(user_id)
+    series = user_series.get(series_key)
+    season = await series_bot.get_season_details(int(series_key), season_num) if series else None
+    
+    if not season:
+        keyboard = [[InlineKeyboardButton("🔙 Volver a temporadas", callback_data=f"eps_{series_key}_0")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        try:
+            await update.callback_query.edit_message_text(
+                "❌ Error al obtener los episodios de la temporada.",
+                reply_markup=reply_markup
+            )
+        except Exception:
+            await update.callback_query.message.reply_text(
+                "❌ Error al obtener los episodios de la temporada.",
+                reply_markup=reply_markup
+            )
+        return
+    
+    episodes = season['episodes']
+    bits = series_bot.get_watched_episodes(user_id, series_key, season_num)
+    watched_count = sum(1 for ep in episodes if bits >> (ep - 1) & 1)
+    
+    total_pages = max(1, -(-len(episodes) // EPISODES_PER_PAGE))
+    page = min(max(page, 0), total_pages - 1)
+    page_episodes = episodes[page * EPISODES_PER_PAGE:(page + 1) * EPISODES_PER_PAGE]
+    
+    keyboard = []
+    row = []
+    for ep in page_episodes:
+        emoji = "✅" if bits >> (ep - 1) & 1 else "⬜"
+        row.append(InlineKeyboardButton(f"{emoji} {ep}", callback_data=f"ept_{series_key}_{season_num}_{ep}_{page}"))
+        if len(row) == EPISODE_BUTTONS_PER_ROW:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    
+    nav_row = build_page_nav_row(f"epl_{series_key}_{season_num}_", page, total_pages)
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([
+        InlineKeyboardButton("✅ Marcar todos", callback_data=f"epa_{series_key}_{season_num}_1"),
+        InlineKeyboardButton("⬜ Desmarcar todos", callback_data=f"epa_{series_key}_{season_num}_0")
+    ])
+    season_page = (season_num - 1) // SEASONS_PER_PAGE
+    keyboard.append([InlineKeyboardButton("🔙 Volver a temporadas", callback_data=f"eps_{series_key}_{season_page}")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = f"📺 **{series.get('name', 'Sin nombre')}** - Temporada {season_num}\n\n"
+    message += f"Episodios vistos: {watched_count}/{len(episodes)}\n\n"
+    message += "Toca un episodio para marcarlo o desmarcarlo:"
+    
+    try:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception:
+        await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def advance_season_progress(user_id: int, series_key: str, season_num: int) -> None:
+    """Avanza el progreso por temporadas si se acaba de completar la siguiente a las ya vistas"""
+    series = series_bot.get_user_series(user_id).get(series_key)
+    if not series or season_num != series.get('seasons_watched', 0) + 1:
+        return
+    season = await series_bot.get_season_details(int(series_key), season_num)
+    episodes = (season or {}).get('episodes', [])
+    bits = series_bot.get_watched_episodes(user_id, series_key, season_num)
+    if episodes and all(bits >> (ep - 1) & 1 for ep in episodes):
+        series_bot.update_series(user_id, series_key, 'seasons_watched', season_num)
+
+async def mark_whole_season(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str,
+                            season_num: int, watched: bool) -> None:
+    """Marca o desmarca todos los episodios de una temporada"""
+    user_id = update.effective_user.id
+    bits = 0
+    if watched:
+        season = await series_bot.get_season_details(int(series_key), season_num)
+        for ep in (season or {}).get('episodes', []):
+            bits |= 1 << (ep - 1)
+    
+    series_bot.set_watched_episodes(user_id, series_key, season_num, bits)
+    if watched:
+        await advance_season_progress(user_id, series_key, season_num)
+    await show_season_episodes(update, context, series_key, season_num, 0)
+
 async def show_edit_series_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Muestra la lista de series para editar"""
     user_id = update.effective_user.id
@@ -836,15 +3007,130 @@ async def show_edit_series_list(update: Update, context: ContextTypes.DEFAULT_TY
     keyboard.append([InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    message = "✏️ **Editar Series**\n\nSelecciona la serie que quieres editar:"
+    message = "✏️ **Editar Series**\n\nSelecciona la serie que quieres editar:"
+    
+    if update.callback_query:
+        try:
+            await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        except Exception:
+            await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def ask_series_ended(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pregunta si la serie ya terminó (cuando TMDB no lo sabe)"""
+    season_num = context.user_data.get('selected_season', 0)
+    keyboard = [
+        [InlineKeyboardButton("✅ Sí, ya terminó", callback_data="ended_yes")],
+        [InlineKeyboardButton("❌ No, aún se emite", callback_data="ended_no")],
+        [InlineKeyboardButton("🔙 Atrás", callback_data="back_to_seasons")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    context.user_data['state'] = SERIES_ENDED
+    
+    message_text = (
+        f"¿La serie ya terminó de emitirse completamente?\n\n"
+        f"(Has visto {season_num} temporada{'s' if season_num != 1 else ''})"
+    )
+    
+    # Try to edit the message, if it fails, send a new one
+    try:
+        await update.callback_query.edit_message_text(message_text, reply_markup=reply_markup)
+    except Exception:
+        # If editing fails (message was deleted for photo), send new message
+        await update.callback_query.message.reply_text(message_text, reply_markup=reply_markup)
+
+async def ask_next_season_date(update: Update, context: ContextTypes.DEFAULT_TYPE, back: str) -> None:
+    """Pide la fecha del próximo estreno (cuando TMDB no la sabe)"""
+    context.user_data['state'] = NEXT_SEASON_DATE
+    context.user_data.pop('editing_date', None)
+    
+    keyboard = [[InlineKeyboardButton("🔙 Atrás", callback_data=back)]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message_text = (
+        "📅 ¿Cuándo se estrena la próxima temporada?\n\n"
+        "Escribe la fecha en formato DD/MM/AAAA\n"
+        "O escribe 'desconocida' si no se sabe aún:"
+    )
     
-    if update.callback_query:
+    try:
+        await update.callback_query.edit_message_text(message_text, reply_markup=reply_markup)
+    except Exception:
+        await update.callback_query.message.reply_text(message_text, reply_markup=reply_markup)
+
+async def handle_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE, field: str, series_key: str) -> int:
+    """Botones del menú de edición de una serie (edit_field_<campo>_<serie>)"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    series = series_bot.get_user_series(user_id).get(series_key)
+    if series is None:
+        await show_edit_options(update, context, series_key)
+        return ConversationHandler.END
+    back_row = [InlineKeyboardButton("🔙 Volver", callback_data=f"edit_{series_key}")]
+    
+    if field == "seasons":
+        watched, total = series.get('seasons_watched', 0), series.get('total_seasons', 0)
+        keyboard = [
+            [
+                InlineKeyboardButton("➖", callback_data=f"edit_seasons_{series_key}_{max(watched - 1, 0)}"),
+                InlineKeyboardButton(f"{watched}/{total}", callback_data="noop"),
+                InlineKeyboardButton("➕", callback_data=f"edit_seasons_{series_key}_{min(watched + 1, total)}")
+            ],
+            [InlineKeyboardButton("✅ Estoy al día", callback_data=f"edit_seasons_{series_key}_{total}")],
+            back_row
+        ]
+        message = f"🎬 {series.get('name', 'Sin nombre')}\n\nTemporadas vistas: {watched} de {total}"
         try:
-            await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
         except Exception:
-            await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-    else:
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            # Mismo contenido (p. ej. ➖ con 0 temporadas): Telegram no deja editar
+            pass
+        return ConversationHandler.END
+    
+    if field == "ended":
+        has_ended = not series.get('has_ended', False)
+        series_bot.update_series_fields(user_id, series_key, {
+            'has_ended': has_ended,
+            'next_season_date': None if has_ended else 'Desconocida'
+        })
+        await show_edit_options(update, context, series_key)
+        return ConversationHandler.END
+    
+    if field == "date":
+        context.user_data['state'] = NEXT_SEASON_DATE
+        context.user_data['editing_date'] = series_key
+        await query.edit_message_text(
+            f"📅 {series.get('name', 'Sin nombre')}\n\n"
+            "Escribe la fecha del próximo estreno en formato DD/MM/AAAA\n"
+            "O escribe 'desconocida' si no se sabe aún:",
+            reply_markup=InlineKeyboardMarkup([back_row])
+        )
+        return NEXT_SEASON_DATE
+    
+    if field == "update":
+        series_details = await series_bot.get_series_details(int(series_key))
+        if not series_details:
+            await query.edit_message_text("❌ Error al obtener los detalles de la serie.",
+                                          reply_markup=InlineKeyboardMarkup([back_row]))
+            return ConversationHandler.END
+        fields = {
+            'name': series_details.get('name') or series.get('name', ''),
+            'overview': series_details.get('overview', ''),
+            'poster_path': series_details.get('poster_path') or '',
+            'total_seasons': series_details.get('number_of_seasons', 0) or series.get('total_seasons', 0)
+        }
+        # Solo se sobrescribe lo que TMDB sabe; el resto lo mantiene el usuario
+        has_ended, next_season_date = derive_air_status(series_details)
+        if has_ended is not None:
+            fields['has_ended'] = has_ended
+            fields['next_season_date'] = None if has_ended else (next_season_date or series.get('next_season_date') or 'Desconocida')
+        series_bot.update_series_fields(user_id, series_key, fields)
+        await show_edit_options(update, context, series_key)
+        return ConversationHandler.END
+    
+    await show_edit_options(update, context, series_key)
+    return ConversationHandler.END
 
 async def show_edit_options(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str) -> None:
     """Muestra las opciones de edición para una serie"""
@@ -949,12 +3235,16 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     message += f"📺 **Total de series:** {stats['total_series']}\n"
     message += f"🎬 **Temporadas vistas:** {stats['total_seasons']}\n"
     message += f"✅ **Series completadas:** {stats['completed_series']}\n"
-    message += f"📡 **Series en emisión:** {stats['ongoing_series']}\n"
-    message += f"⏳ **Series pendientes:** {stats['behind_series']}\n\n"
+    message += f"📡 **Series en emisión:** {stats['ongoing_series']}"
+    message += f" ({stats['up_to_date_ongoing']} al día)\n"
+    message += f"⏳ **Series pendientes:** {stats['behind_series']}\n"
+    message += f"🎞️ **Episodios marcados:** {stats['total_episodes']}\n\n"
     
     if stats['total_series'] > 0:
         completion_rate = (stats['completed_series'] / stats['total_series']) * 100
-        message += f"📈 **Tasa de finalización:** {completion_rate:.1f}%"
+        up_to_date_rate = ((stats['total_series'] - stats['behind_series']) / stats['total_series']) * 100
+        message += f"📈 **Tasa de finalización:** {completion_rate:.1f}%\n"
+        message += f"🎯 **Series al día:** {up_to_date_rate:.1f}%"
     
     keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -964,6 +3254,70 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     except Exception:
         await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
+def is_admin(update: Update) -> bool:
+    """Indica si el usuario es administrador del bot"""
+    return update.effective_user is not None and update.effective_user.id in ADMIN_USER_IDS
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comando /adminstats: estadísticas globales (solo administradores)"""
+    if not is_admin(update):
+        return
+    
+    stats = series_bot.get_global_stats()
+    
+    def ranking(items: List[Tuple[str, int]]) -> str:
+        if not items:
+            return "  —\n"
+        return "".join(f"  {i}. {series_bot.get_series_name(key)} ({count})\n"
+                       for i, (key, count) in enumerate(items, 1))
+    
+    message = "📊 Estadísticas globales\n\n"
+    message += f"👥 Usuarios con series: {stats['users']}\n"
+    message += f"📺 Series distintas: {stats['tracked_shows']}\n"
+    message += f"📋 Series en listas: {stats['total_series']}\n"
+    message += f"🎬 Temporadas vistas: {stats['total_seasons']}\n"
+    message += f"🎞️ Episodios marcados: {stats['total_episodes']}\n"
+    message += f"✅ Completadas: {stats['completed_series']} · ⏳ Pendientes: {stats['behind_series']}\n\n"
+    message += "🔥 Más seguidas:\n" + ranking(stats['most_tracked']) + "\n"
+    message += "🏁 Más completadas:\n" + ranking(stats['most_completed']) + "\n"
+    message += "⏳ Con más usuarios atrasados:\n" + ranking(stats['most_behind']) + "\n"
+    message += "🐢 Peticiones frenadas: " + ", ".join(
+        f"{action} {count}" for action, count in request_guard.rejected.items()
+    ) + f" · pulsaciones repetidas: {request_guard.debounced}"
+    
+    await update.message.reply_text(message)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comandos /profile y /memprofile [segundos]: captura limitada en el tiempo (solo administradores)"""
+    if not is_admin(update):
+        return
+    
+    kind = "memory" if update.message.text.startswith("/memprofile") else "cpu"
+    try:
+        seconds = max(1, min(int(context.args[0]), PROFILE_MAX_SECONDS)) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    
+    start, stop = (profiler.start_cpu, profiler.stop_cpu) if kind == "cpu" else (profiler.start_memory, profiler.stop_memory)
+    if not start():
+        await update.message.reply_text("⚠️ Ya hay una captura de ese tipo en curso.")
+        return
+    await update.message.reply_text(f"⏱️ Capturando perfil de {'CPU' if kind == 'cpu' else 'memoria'} durante {seconds}s...")
+    
+    async def finish() -> None:
+        await asyncio.sleep(seconds)
+        report = stop()
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=InputFile(io.BytesIO(report.encode('utf-8')),
+                               filename=f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"),
+            caption=f"Perfil de {'CPU' if kind == 'cpu' else 'memoria'} ({seconds}s) · "
+                    f"retraso máximo del bucle: {loop_monitor.max_lag:.3f}s",
+            rate_limit_args=PRIORITY_BULK
+        )
+    
+    context.application.create_task(finish())
+
 async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Muestra recordatorios de próximos estrenos"""
     user_id = update.effective_user.id
@@ -981,24 +3335,25 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Filtrar series con fechas de estreno próximas
     upcoming_series = []
-    now = datetime.now()
+    today = datetime.now().date()
     
     for series_key, series_data in user_series.items():
         if not series_data.get('has_ended', True):
-            next_date_str = series_data.get('next_season_date')
-            if next_date_str and next_date_str != 'Desconocida':
-                try:
-                    next_date = datetime.strptime(next_date_str, "%d/%m/%Y")
-                    days_until = (next_date - now).days
-                    
-                    if days_until <= 60 and days_until >= 0:  # Próximos 60 días
-                        upcoming_series.append((series_key, series_data, days_until, next_date))
-                except:
-                    pass
+            next_date = parse_premiere_date(series_data.get('next_season_date'))
+            if next_date:
+                days_until = (next_date - today).days
+                
+                if days_until <= 60 and days_until >= 0:  # Próximos 60 días
+                    upcoming_series.append((series_key, series_data, days_until, next_date))
+    
+    settings_keyboard = [
+        [InlineKeyboardButton("🔔 Configurar avisos", callback_data="digest_settings")],
+        [InlineKeyboardButton("📅 Añadir a mi calendario", callback_data="calendar_feed")],
+        [InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]
+    ]
     
     if not upcoming_series:
-        keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup(settings_keyboard)
         
         message = "⏰ **Recordatorios**\n\nNo tienes estrenos próximos en los siguientes 60 días."
         await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
@@ -1010,21 +3365,9 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     message = "⏰ **Próximos Estrenos**\n\n"
     
     for series_key, series_data, days_until, next_date in upcoming_series:
-        name = series_data.get('name', 'Sin nombre')
-        next_season = series_data.get('seasons_watched', 0) + 1
-        
-        if days_until == 0:
-            time_text = "🔥 ¡HOY!"
-        elif days_until == 1:
-            time_text = "📅 Mañana"
-        elif days_until <= 7:
-            time_text = f"📅 En {days_until} días"
-        else:
-            time_text = f"📅 En {days_until} días ({next_date.strftime('%d/%m')})"
-        
-        message += f"📺 **{name}** - Temporada {next_season}\n{time_text}\n\n"
+        message += format_premiere(series_data, days_until, next_date)
     
-    keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]]
+    keyboard = settings_keyboard
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if update.callback_query:
@@ -1035,6 +3378,399 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def show_calendar_feed(update: Update, context: ContextTypes.DEFAULT_TYPE, rotate: bool = False) -> None:
+    """Muestra el enlace secreto del calendario de estrenos del usuario"""
+    http_url = context.application.bot_data.get('http_url')
+    keyboard = [[InlineKeyboardButton("🔙 Volver a recordatorios", callback_data="reminders")]]
+    
+    if not http_url:
+        await update.callback_query.edit_message_text(
+            "📅 El calendario de estrenos no está disponible en este momento.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    token = series_bot.get_feed_token(update.effective_user.id, rotate=rotate)
+    keyboard.insert(0, [InlineKeyboardButton("🔄 Generar un enlace nuevo", callback_data="calendar_rotate")])
+    message = (
+        "📅 Calendario de estrenos\n\n"
+        "Suscríbete a este enlace desde tu aplicación de calendario "
+        "(Google Calendar, Apple Calendar, Outlook...) para ver los estrenos de tus series:\n\n"
+        f"{http_url}/calendar/{token}.ics\n\n"
+        "🔒 El enlace es personal: si lo compartes por error, genera uno nuevo y el anterior dejará de funcionar."
+    )
+    await update.callback_query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard),
+                                                  disable_web_page_preview=True)
+
+async def group_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comando /grupo: lista compartida del grupo; con texto, busca una serie para añadirla"""
+    chat = update.effective_chat
+    if chat.type == "private":
+        await update.message.reply_text(
+            "👥 Las listas compartidas funcionan en grupos: añádeme a un grupo y escribe /grupo allí."
+        )
+        return
+    
+    query_text = " ".join(context.args or []).strip()
+    if not query_text:
+        await show_group_list(update, context, 0)
+        return
+    
+    series_results = await series_bot.search_series_tmdb(query_text)
+    if not series_results:
+        await update.message.reply_text("❌ No se encontraron series con ese nombre.")
+        return
+    
+    keyboard = []
+    for series in series_results[:10]:
+        year = f" ({series['first_air_date'][:4]})" if series.get('first_air_date') else ""
+        keyboard.append([InlineKeyboardButton(f"{series.get('name', 'Sin título')}{year}",
+                                              callback_data=f"grp_a_{series['id']}")])
+    keyboard.append([InlineKeyboardButton("🔙 Ver lista del grupo", callback_data="grp_list_0")])
+    await update.message.reply_text("📺 ¿Qué serie añado a la lista del grupo?",
+                                    reply_markup=InlineKeyboardMarkup(keyboard))
+
+def member_names(group: Dict, member_keys, limit: Optional[int] = None) -> str:
+    """Nombres de varios miembros del grupo, separados por comas"""
+    names = sorted(group["members"][key]["name"] for key in member_keys if key in group["members"])
+    if limit is not None and len(names) > limit:
+        return ", ".join(names[:limit]) + f" y {len(names) - limit} más"
+    return ", ".join(names)
+
+async def show_group_list(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int) -> None:
+    """Muestra la lista del grupo con quién va atrasado en cada serie"""
+    chat_id = update.effective_chat.id
+    group = series_bot.get_group(chat_id)
+    
+    if not group or not group["series"]:
+        message = ("👥 Este grupo aún no tiene series en su lista.\n\n"
+                   "Añade una con /grupo seguido del nombre, por ejemplo: /grupo The Office")
+        keyboard = []
+    else:
+        up_to_date = series_bot.get_group_up_to_date(chat_id)
+        items = sorted(group["series"].items(), key=lambda item: item[1]['name'].lower())
+        total_pages = max(1, -(-len(items) // GROUP_SERIES_PER_PAGE))
+        page = min(max(page, 0), total_pages - 1)
+        
+        lines = [f"👥 Lista de {group.get('title') or 'este grupo'} "
+                 f"({len(items)} series, {len(group['members'])} miembros)\n"]
+        keyboard = []
+        for series_key, series in items[page * GROUP_SERIES_PER_PAGE:(page + 1) * GROUP_SERIES_PER_PAGE]:
+            if series_key in up_to_date:
+                status = "✅ Todos al día"
+            else:
+                behind = series_bot.get_group_behind(chat_id, series_key)
+                status = f"⏳ Atrasados: {member_names(group, behind, GROUP_BEHIND_PREVIEW)}"
+            lines.append(f"📺 {series['name']} ({series['total_seasons']} temp.)\n   {status}")
+            keyboard.append([InlineKeyboardButton(f"📺 {series['name']}", callback_data=f"grp_s_{series_key}")])
+        
+        nav_row = build_page_nav_row("grp_list_", page, total_pages)
+        if nav_row:
+            keyboard.append(nav_row)
+        keyboard.append([InlineKeyboardButton("🏁 ¿Quién va atrasado?", callback_data="grp_behind")])
+        message = "\n".join(lines)
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if update.callback_query:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(message, reply_markup=reply_markup)
+
+async def show_group_behind(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Resumen del grupo: series en las que todos están al día y quién va atrasado en el resto"""
+    chat_id = update.effective_chat.id
+    group = series_bot.get_group(chat_id) or {"series": {}, "members": {}}
+    up_to_date = series_bot.get_group_up_to_date(chat_id)
+    
+    done = sorted(group["series"][key]['name'] for key in up_to_date if key in group["series"])
+    lines = ["🏁 Todos al día en:", *(f"• {name}" for name in done)] if done else \
+        ["🏁 No hay ninguna serie en la que todos estén al día."]
+    pending = sorted((series['name'], key) for key, series in group["series"].items() if key not in up_to_date)
+    if pending:
+        lines.append("\n⏳ Van atrasados:")
+        for name, series_key in pending:
+            lines.append(f"• {name}: {member_names(group, series_bot.get_group_behind(chat_id, series_key))}")
+    
+    keyboard = [[InlineKeyboardButton("🔙 Ver lista del grupo", callback_data="grp_list_0")]]
+    await update.callback_query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def show_group_series(update: Update, context: ContextTypes.DEFAULT_TYPE, series_key: str) -> None:
+    """Detalle de una serie del grupo con el progreso de cada miembro y botones para el propio"""
+    chat_id = update.effective_chat.id
+    group = series_bot.get_group(chat_id)
+    series = group["series"].get(series_key) if group else None
+    if series is None:
+        await update.callback_query.edit_message_text(
+            "❌ La serie ya no está en la lista del grupo.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Ver lista del grupo", callback_data="grp_list_0")]])
+        )
+        return
+    
+    total = series['total_seasons']
+    behind = series_bot.get_group_behind(chat_id, series_key)
+    lines = [f"📺 {series['name']} ({total} temporadas)\n"]
+    for member_key in sorted(behind, key=lambda key: group["members"][key]["name"]):
+        member = group["members"][member_key]
+        lines.append(f"⏳ {member['name']}: {member['progress'].get(series_key, 0)}/{total}")
+    caught_up = len(group["members"]) - len(behind)
+    if caught_up:
+        lines.append(f"✅ Al día: {member_names(group, set(group['members']) - behind, GROUP_BEHIND_PREVIEW * 3)}")
+    
+    user_key = str(update.effective_user.id)
+    member = group["members"].get(user_key)
+    mine = member["progress"].get(series_key, 0) if member else 0
+    keyboard = [
+        [
+            InlineKeyboardButton("➖", callback_data=f"grp_p_{series_key}_{mine - 1}"),
+            InlineKeyboardButton(f"Yo: {mine}/{total}", callback_data="noop"),
+            InlineKeyboardButton("➕", callback_data=f"grp_p_{series_key}_{mine + 1}")
+        ],
+        [InlineKeyboardButton("✅ Estoy al día", callback_data=f"grp_p_{series_key}_{total}")],
+        [InlineKeyboardButton("🗑️ Quitar del grupo", callback_data=f"grp_d_{series_key}")],
+        [InlineKeyboardButton("🔙 Ver lista del grupo", callback_data="grp_list_0")]
+    ]
+    if member:
+        keyboard.insert(2, [InlineKeyboardButton("🚪 Dejar de seguir en este grupo", callback_data="grp_leave")])
+    await update.callback_query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def group_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja los botones de las listas compartidas (callback_data grp_*)"""
+    query = update.callback_query
+    data = query.data
+    chat = update.effective_chat
+    user = update.effective_user
+    
+    if data.startswith("grp_list_"):
+        await show_group_list(update, context, int(data.rsplit("_", 1)[1]))
+    
+    elif data == "grp_behind":
+        await show_group_behind(update, context)
+    
+    elif data.startswith("grp_s_"):
+        await show_group_series(update, context, data.split("_", 2)[2])
+    
+    elif data.startswith("grp_p_"):
+        series_key, seasons = data[len("grp_p_"):].rsplit("_", 1)
+        # Quien marca su progreso pasa a ser miembro del seguimiento del grupo
+        joined = series_bot.group_join(chat.id, user.id, user.first_name, chat.title or "")
+        group = series_bot.get_group(chat.id)
+        previous = group["members"][str(user.id)]["progress"].get(series_key, 0)
+        stored = series_bot.group_set_progress(chat.id, user.id, series_key, int(seasons))
+        if stored is None or joined or stored != previous:
+            # Si no cambia nada, Telegram rechaza editar el mensaje con el mismo contenido
+            await show_group_series(update, context, series_key)
+    
+    elif data == "grp_leave":
+        series_bot.group_leave(chat.id, user.id)
+        await show_group_list(update, context, 0)
+    
+    elif data.startswith("grp_d_"):
+        series_bot.group_remove_series(chat.id, data.split("_", 2)[2])
+        await show_group_list(update, context, 0)
+    
+    elif data.startswith("grp_a_"):
+        series_details = await series_bot.get_series_details(int(data.split("_", 2)[2]))
+        if not series_details:
+            await query.edit_message_text("❌ Error al obtener los detalles de la serie.")
+            return
+        series_key = str(series_details['id'])
+        series_bot.group_join(chat.id, user.id, user.first_name, chat.title or "")
+        series_bot.group_add_series(chat.id, series_key, series_details.get('name', 'Sin título'),
+                                    series_details.get('number_of_seasons', 0) or 0, user.id, chat.title or "")
+        await show_group_series(update, context, series_key)
+
+async def show_api_access(update: Update, context: ContextTypes.DEFAULT_TYPE, rotate: bool = False) -> None:
+    """Comando /api: token personal y direcciones de la API de lectura"""
+    if update.effective_chat.type != "private":
+        await update.message.reply_text("🔑 Por seguridad, pídeme el acceso a la API en un chat privado.")
+        return
+    
+    http_url = context.application.bot_data.get('http_url')
+    if not http_url:
+        message, keyboard = "🔑 La API no está disponible en este momento.", []
+    else:
+        token = series_bot.get_api_token(update.effective_user.id, rotate=rotate)
+        message = (
+            "🔑 Acceso a la API de lectura\n\n"
+            f"Token: {token}\n\n"
+            "Envíalo en la cabecera \"Authorization: Bearer <token>\" a:\n"
+            f"• {http_url}/api/series?status=all|pending|ongoing|ended|completed\n"
+            f"• {http_url}/api/stats\n"
+            f"• {http_url}/api/premieres?days=30\n\n"
+            "🔒 El token es personal: si lo compartes por error, genera uno nuevo y el anterior dejará de funcionar."
+        )
+        keyboard = [[InlineKeyboardButton("🔄 Generar un token nuevo", callback_data="api_rotate")]]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    if update.callback_query:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup, disable_web_page_preview=True)
+    else:
+        await update.message.reply_text(message, reply_markup=reply_markup, disable_web_page_preview=True)
+
+async def show_digest_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra las preferencias de avisos de estrenos"""
+    settings = series_bot.get_user_settings(update.effective_user.id)
+    
+    keyboard = [
+        [
+            InlineKeyboardButton(("• " if mode == settings['digest_mode'] else "") + label,
+                                 callback_data=f"digest_mode_{mode}")
+            for mode, label in list(DIGEST_MODES.items())[:2]
+        ],
+        [
+            InlineKeyboardButton(("• " if mode == settings['digest_mode'] else "") + label,
+                                 callback_data=f"digest_mode_{mode}")
+            for mode, label in list(DIGEST_MODES.items())[2:]
+        ],
+        [
+            InlineKeyboardButton(("• " if t == settings['digest_time'] else "") + t,
+                                 callback_data=f"digest_time_{t.replace(':', '')}")
+            for t in DIGEST_TIMES
+        ],
+        [
+            InlineKeyboardButton("➖", callback_data=f"digest_tz_{settings['utc_offset'] - 1}"),
+            InlineKeyboardButton(f"UTC{settings['utc_offset']:+d}", callback_data="noop"),
+            InlineKeyboardButton("➕", callback_data=f"digest_tz_{settings['utc_offset'] + 1}")
+        ],
+        [InlineKeyboardButton("🔙 Volver a recordatorios", callback_data="reminders")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    message = "🔔 **Avisos de estrenos**\n\n"
+    message += f"Modo: {DIGEST_MODES[settings['digest_mode']]}\n"
+    message += f"Hora de envío: {settings['digest_time']} (UTC{settings['utc_offset']:+d})\n\n"
+    message += "• Uno por estreno: un mensaje por cada estreno del día\n"
+    message += "• Diario: un único mensaje con los estrenos del día\n"
+    message += "• Semanal: los lunes, un mensaje con los estrenos de la semana"
+    
+    try:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except BadRequest as e:
+        # Pulsar la opción ya elegida no cambia nada: el menú sigue en pantalla
+        if "not modified" not in str(e):
+            await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception:
+        await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def send_digests(bot, now: datetime, minutes: Sequence[int]) -> None:
+    """Envía los resúmenes de estrenos que tocan en las franjas indicadas"""
+    due = series_bot.collect_due_digests(now, minutes)
+    
+    for user_key, premieres in due.items():
+        if not premieres:
+            continue
+        
+        mode = series_bot.get_user_settings(user_key)['digest_mode']
+        if mode == 'each':
+            messages = ["🔔 **Estreno**\n\n" + format_premiere(series, days, day)
+                        for _, series, days, day in premieres]
+        else:
+            title = "🗓️ **Estrenos de la semana**" if mode == 'weekly' else "📅 **Estrenos de hoy**"
+            messages = [title + "\n\n" + "".join(format_premiere(series, days, day)
+                                                  for _, series, days, day in premieres)]
+        
+        for text in messages:
+            try:
+                await bot.send_message(chat_id=int(user_key), text=text, parse_mode='Markdown',
+                                       rate_limit_args=PRIORITY_NOTIFICATION)
+            except Exception as e:
+                logger.warning("No se pudo enviar el resumen a %s: %s", user_key, e, extra={'user_id': user_key})
+                break
+
+async def digest_loop(bot, lease: LeaderLease) -> None:
+    """Revisa cada minuto qué resúmenes de estrenos hay que enviar"""
+    last_minute = None
+    while True:
+        if not lease.is_leader:
+            # Otro proceso atiende el planificador de este shard
+            last_minute = None
+            await asyncio.sleep(DIGEST_CHECK_INTERVAL)
+            continue
+        
+        now = datetime.utcnow()
+        minute = now.hour * 60 + now.minute
+        if last_minute is None:
+            minutes = [minute]
+        else:
+            # Incluir los minutos que se hayan saltado si el bucle se retrasó
+            minutes = [(last_minute + i) % (24 * 60) for i in range(1, (minute - last_minute) % (24 * 60) + 1)]
+        last_minute = minute
+        
+        if minutes:
+            try:
+                await send_digests(bot, now, minutes)
+                series_bot.prune_premieres(now.date() - timedelta(days=2))
+            except Exception as e:
+                logger.error("Error enviando resúmenes: %s", e)
+        await asyncio.sleep(DIGEST_CHECK_INTERVAL - now.second)
+
+async def show_recommendations(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra las series recomendadas para el usuario"""
+    suggestions = series_bot.get_recommendations(update.effective_user.id)
+    
+    keyboard = []
+    if suggestions:
+        message = "✨ **Recomendaciones**\n\nA quienes siguen tus series también les gustan:\n\n"
+        message += "Toca una serie para añadirla a tu lista:"
+        for tmdb_id, name, _ in suggestions:
+            keyboard.append([InlineKeyboardButton(f"➕ {(name or 'Sin título')[:35]}", callback_data=f"select_{tmdb_id}")])
+    else:
+        message = "✨ **Recomendaciones**\n\nAún no hay recomendaciones para ti. ¡Añade más series y vuelve más tarde!"
+    
+    keyboard.append([InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    try:
+        await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception:
+        await update.callback_query.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def recommendations_loop(data_files: List[str], lease: LeaderLease) -> None:
+    """Recalcula periódicamente las recomendaciones en un proceso aparte y recarga la tabla"""
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork"))
+    try:
+        while True:
+            try:
+                age = time.time() - os.path.getmtime(series_bot.recommendations_file)
+            except OSError:
+                age = float('inf')
+            
+            if lease.is_leader and age > RECOMMENDATIONS_INTERVAL:
+                try:
+                    users = await loop.run_in_executor(
+                        executor, build_recommendations_file, data_files, series_bot.recommendations_file,
+                        RECOMMENDATIONS_TOP_K)
+                    logger.info("Recomendaciones recalculadas para %s usuarios", users)
+                except Exception as e:
+                    logger.error("Error calculando recomendaciones: %s", e)
+            
+            series_bot.reload_recommendations()
+            await asyncio.sleep(RECOMMENDATIONS_RELOAD_INTERVAL)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def backup_loop() -> None:
+    """Hace copias periódicas de los datos en un proceso hijo (fork) sin parar el bucle"""
+    loop = asyncio.get_running_loop()
+    last_saved = None
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        if series_bot.save_count == last_saved:
+            continue
+        last_saved = series_bot.save_count
+        started = time.monotonic()
+        try:
+            pid = snapshot_in_background(series_bot.data, series_bot.data_file, BACKUP_DIR, BACKUP_KEEP)
+            _, status = await loop.run_in_executor(None, os.waitpid, pid, 0)
+        except OSError as e:
+            logger.error("Error haciendo la copia de seguridad: %s", e)
+            continue
+        if os.waitstatus_to_exitcode(status) == 0:
+            logger.info("Copia de seguridad de %s en %.1fs", series_bot.data_file, time.monotonic() - started)
+        else:
+            logger.error("La copia de seguridad de %s falló", series_bot.data_file)
+
 async def export_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Exporta los datos del usuario en formato CSV"""
     user_id = update.effective_user.id
@@ -1095,7 +3831,8 @@ async def export_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             chat_id=update.effective_chat.id,
             document=InputFile(io.BytesIO(csv_bytes), filename=filename),
             caption="💾 **Datos exportados**\n\nAquí tienes tu lista de series en formato CSV.",
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            rate_limit_args=PRIORITY_BULK
         )
         
         keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]]
@@ -1108,7 +3845,7 @@ async def export_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         
     except Exception as e:
-        logger.error(f"Error exportando datos: {e}")
+        logger.error("Error exportando datos: %s", e, extra={'user_id': user_id})
         keyboard = [[InlineKeyboardButton("🔙 Volver al menú", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -1193,55 +3930,598 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("❌ Operación cancelada.")
     return ConversationHandler.END
 
-def main():
-    """Función principal del bot"""
-    # Crear aplicación
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+def is_not_modified(request: web.Request, etag: str, modified: float) -> bool:
+    """Comprueba If-None-Match (o, si no viene, If-Modified-Since) de una petición condicional"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+    if request.headers.get('If-Modified-Since'):
+        try:
+            return int(modified) <= parsedate_to_datetime(request.headers['If-Modified-Since']).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return False
+
+async def serve_calendar(request: web.Request) -> web.Response:
+    """GET /calendar/{token}.ics: calendario del usuario con soporte de peticiones condicionales"""
+    bot: SeriesBot = request.app['series_bot']
+    user_key = bot.feed_tokens.get(request.match_info['token'])
+    if user_key is None:
+        raise web.HTTPNotFound()
+    
+    body, etag, modified = bot.get_calendar(user_key)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(modified, usegmt=True),
+        'Cache-Control': f"private, max-age={CALENDAR_CACHE_SECONDS}"
+    }
+    if is_not_modified(request, etag, modified):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=headers, content_type="text/calendar", charset="utf-8")
+
+# --- API de lectura (JSON) ---
+# Autenticación con "Authorization: Bearer <token>" (el token se obtiene con /api en el bot).
+# Todo se lee de la memoria del proceso; el ETag es la versión de los datos del usuario.
+
+def api_error(status: int, message: str) -> web.Response:
+    return web.json_response({'error': message}, status=status)
+
+def api_series_item(series_key: str, series: Dict) -> Dict:
+    """Representación pública de una serie en la API"""
+    premiere = parse_premiere_date(series.get('next_season_date'))
+    return {
+        'id': series_key,
+        'name': series.get('name', ''),
+        'seasons_watched': series.get('seasons_watched', 0),
+        'total_seasons': series.get('total_seasons', 0),
+        'up_to_date': series.get('up_to_date', False),
+        'has_ended': series.get('has_ended', False),
+        'next_season_date': premiere.isoformat() if premiere else None,
+        'poster_path': series.get('poster_path') or None,
+        'added_date': series.get('added_date')
+    }
+
+def encode_cursor(sort_key: Tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key), ensure_ascii=False).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Clave de orden del último elemento devuelto; ValueError si el cursor no es válido"""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("cursor no válido") from e
+    if not isinstance(value, list) or not all(isinstance(part, str) for part in value):
+        raise ValueError("cursor no válido")
+    return tuple(value)
+
+def api_endpoint(handler):
+    """Autentica la petición y responde 304 si el cliente ya tiene la versión actual
+    
+    El manejador recibe (request, bot, user_key) y devuelve el cuerpo JSON.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request: web.Request) -> web.Response:
+        bot: SeriesBot = request.app['series_bot']
+        auth = request.headers.get('Authorization', '')
+        user_key = bot.api_tokens.get(auth[7:].strip()) if auth.startswith("Bearer ") else None
+        if user_key is None:
+            return web.json_response({'error': "token no válido"}, status=401,
+                                     headers={'WWW-Authenticate': 'Bearer'})
+        
+        # Los estrenos dependen también del día; el resto solo de los datos del usuario
+        etag = f'"{bot.boot_id}-{bot.versions.get(user_key, 0)}-{date.today().isoformat()}"'
+        modified = bot.modified.get(user_key, 0.0)
+        headers = {'ETag': etag, 'Last-Modified': formatdate(modified, usegmt=True),
+                   'Cache-Control': "private, no-cache"}
+        if is_not_modified(request, etag, modified):
+            return web.Response(status=304, headers=headers)
+        try:
+            body = handler(request, bot, user_key)
+        except ValueError as e:
+            return api_error(400, str(e))
+        return web.json_response(body, headers=headers, dumps=functools.partial(json.dumps, ensure_ascii=False))
+    return wrapper
+
+def query_int(request: web.Request, name: str, default: int, maximum: int) -> int:
+    value = request.query.get(name)
+    if value is None:
+        return default
+    if not value.isdigit() or not 1 <= int(value) <= maximum:
+        raise ValueError(f"{name} debe ser un entero entre 1 y {maximum}")
+    return int(value)
+
+@api_endpoint
+def api_series(request: web.Request, bot: SeriesBot, user_key: str) -> Dict:
+    """GET /api/series?status=all|completed|ongoing|pending|ended&limit=N&cursor=X"""
+    list_type = request.query.get('status', "all")
+    if list_type not in API_LIST_TYPES:
+        raise ValueError(f"status debe ser uno de: {', '.join(API_LIST_TYPES)}")
+    limit = query_int(request, 'limit', API_PAGE_SIZE, API_MAX_PAGE_SIZE)
+    keys, items = bot.get_api_list(user_key, list_type)
+    
+    # Paginación por clave: el cursor es la clave de orden del último elemento,
+    # así que altas y bajas entre páginas no repiten ni saltan series
+    start = bisect.bisect_right(keys, decode_cursor(request.query['cursor'])) if 'cursor' in request.query else 0
+    page = items[start:start + limit]
+    has_more = start + limit < len(items)
+    return {
+        'status': list_type,
+        'total': len(items),
+        'items': [api_series_item(series_key, series) for series_key, series in page],
+        'next_cursor': encode_cursor(keys[start + limit - 1]) if has_more else None
+    }
+
+@api_endpoint
+def api_stats(request: web.Request, bot: SeriesBot, user_key: str) -> Dict:
+    """GET /api/stats: contadores del usuario"""
+    return {**dict.fromkeys(STAT_FIELDS, 0), **bot.get_series_stats(user_key)}
+
+@api_endpoint
+def api_premieres(request: web.Request, bot: SeriesBot, user_key: str) -> Dict:
+    """GET /api/premieres?days=N: estrenos del usuario en los próximos N días"""
+    days = query_int(request, 'days', API_DEFAULT_DAYS, API_MAX_DAYS)
+    today = date.today()
+    items = []
+    for series_key, series in bot.get_user_series(user_key).items():
+        premiere = parse_premiere_date(series.get('next_season_date'))
+        if series.get('has_ended', True) or not premiere or not 0 <= (premiere - today).days <= days:
+            continue
+        items.append({'date': premiere.isoformat(), 'days_until': (premiere - today).days,
+                      'season': series.get('seasons_watched', 0) + 1,
+                      'series': api_series_item(series_key, series)})
+    items.sort(key=lambda item: (item['date'], item['series']['name'].lower()))
+    return {'days': days, 'items': items}
+
+async def start_http_server(application: Application) -> Optional[web.AppRunner]:
+    """Arranca el servidor HTTP local si HTTP_PORT está configurado"""
+    if not HTTP_PORT:
+        return None
+    shard, _ = application.bot_data.get('shard', (0, 1))
+    port = HTTP_PORT + shard + application.bot_data.get('instance', 0)
+    app = web.Application()
+    app['series_bot'] = get_series_bot()
+    app.router.add_get("/calendar/{token}.ics", serve_calendar)
+    app.router.add_get("/api/series", api_series)
+    app.router.add_get("/api/stats", api_stats)
+    app.router.add_get("/api/premieres", api_premieres)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HTTP_HOST, port).start()
+    application.bot_data['http_url'] = HTTP_PUBLIC_URL.format(port=port, shard=shard).rstrip("/")
+    logger.info("Servidor HTTP escuchando en %s:%s", HTTP_HOST, port)
+    return runner
+
+async def post_init(application: Application) -> None:
+    """Arranca las tareas en segundo plano del bot"""
+    shard, total = application.bot_data.get('shard', (0, 1))
+    namespace = application.bot_data.get('namespace', "")
+    prefix = f"{namespace}-" if namespace else ""
+    # Trabajo por shard (resúmenes) y trabajo global, que lee los datos de todos los shards
+    lease = LeaderLease(f"{prefix}scheduler-{shard}of{total}")
+    global_lease = LeaderLease(f"{prefix}scheduler-global")
+    data_files = [namespaced(shard_path(DATA_FILE, i, total), namespace) for i in range(total)]
+    tasks = application.bot_data['_background_tasks'] = [
+        asyncio.create_task(lease.keep_alive()),
+        asyncio.create_task(global_lease.keep_alive()),
+        asyncio.create_task(digest_loop(application.bot, lease)),
+        asyncio.create_task(recommendations_loop(data_files, global_lease)),
+        asyncio.create_task(backup_loop())
+    ]
+    application.bot_data['_http_runner'] = await start_http_server(application)
+    
+    # Lo que es de todo el proceso solo lo arranca el primer bot
+    if application.bot_data.get('instance', 0):
+        return
+    tasks.append(asyncio.create_task(loop_monitor.run()))
+    if update_recorder:
+        tasks.append(asyncio.create_task(update_recorder.run()))
+    
+    # SIGUSR1 / SIGUSR2 inician o detienen capturas de CPU / memoria que se guardan en disco
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle_to_file, "cpu")
+    loop.add_signal_handler(signal.SIGUSR2, profiler.toggle_to_file, "memory")
+
+async def post_shutdown(application: Application) -> None:
+    """Detiene las tareas en segundo plano y el servidor HTTP de la aplicación"""
+    for task in application.bot_data.pop('_background_tasks', []):
+        task.cancel()
+    runner = application.bot_data.pop('_http_runner', None)
+    if runner:
+        await runner.cleanup()
+
+async def close_shared_resources(tmdb: TMDBClient) -> None:
+    """Libera lo que comparten todos los bots del proceso (solo cuando ya han parado todos)"""
+    await tmdb.close()
+    global collage_executor
+    if collage_executor is not None:
+        collage_executor.shutdown(wait=False, cancel_futures=True)
+        collage_executor = None
+
+def build_application(shard: int = 0, total: int = 1, with_updater: bool = True,
+                      base_url: Optional[str] = None, token: str = TELEGRAM_TOKEN,
+                      namespace: str = "", instance: int = 0) -> Application:
+    """Crea la aplicación de Telegram con todos sus manejadores
+    
+    base_url permite apuntar a otra Bot API (por ejemplo la falsa de replay.py);
+    namespace e instance identifican a cada bot cuando hay varios en el proceso.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        # Cada proceso recibe una parte proporcional del límite global de envíos
+        .rate_limiter(PriorityRateLimiter(global_rate=GLOBAL_SEND_RATE / total))
+        .persistence(SeriesBotPersistence(namespaced(shard_path(STATE_FILE, shard, total), namespace)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not with_updater:
+        builder = builder.updater(None)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    application.bot_data['shard'] = (shard, total)
+    application.bot_data['namespace'] = namespace
+    application.bot_data['instance'] = instance
     
     # Manejador de conversación para añadir series
     conv_handler = ConversationHandler(
+        name="series_conversation",
+        persistent=True,
         entry_points=[
-            CommandHandler("start", start),
-            CallbackQueryHandler(button_handler)
+            CommandHandler("start", monitored(start)),
+            CallbackQueryHandler(monitored(button_handler))
         ],
         states={
             SEARCHING_SERIES: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input),
-                CallbackQueryHandler(button_handler)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, monitored(handle_text_input)),
+                CallbackQueryHandler(monitored(button_handler))
             ],
             SELECTING_SERIES: [
-                CallbackQueryHandler(button_handler)
+                CallbackQueryHandler(monitored(button_handler))
             ],
             SELECTING_SEASON: [
-                CallbackQueryHandler(button_handler)
+                CallbackQueryHandler(monitored(button_handler))
             ],
             SERIES_ENDED: [
-                CallbackQueryHandler(button_handler)
+                CallbackQueryHandler(monitored(button_handler))
             ],
             NEXT_SEASON_DATE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input),
-                CallbackQueryHandler(button_handler)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, monitored(handle_text_input)),
+                CallbackQueryHandler(monitored(button_handler))
             ],
             SEARCHING_IN_LIST: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input),
-                CallbackQueryHandler(button_handler)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, monitored(handle_text_input)),
+                CallbackQueryHandler(monitored(button_handler))
             ]
         },
         fallbacks=[
-            CommandHandler("cancel", cancel),
-            CallbackQueryHandler(button_handler, pattern="^main_menu$")
+            CommandHandler("cancel", monitored(cancel)),
+            CallbackQueryHandler(monitored(button_handler), pattern="^main_menu$")
         ],
         allow_reentry=True
     )
     
-    # Añadir manejadores
+    # Añadir manejadores (el filtro de peticiones va en un grupo anterior)
+    if update_recorder:
+        application.add_handler(TypeHandler(Update, update_recorder.record), group=-2)
+    application.add_handler(TypeHandler(Update, guard_update), group=-1)
     application.add_handler(conv_handler)
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(CommandHandler("start", monitored(start)))
+    application.add_handler(CommandHandler("adminstats", monitored(admin_stats)))
+    application.add_handler(CommandHandler("grupo", monitored(group_command)))
+    application.add_handler(CommandHandler("api", monitored(show_api_access)))
+    application.add_handler(CommandHandler(["profile", "memprofile"], monitored(profile_command)))
+    application.add_handler(CallbackQueryHandler(monitored(button_handler)))
+    
+    return application
+
+def run_worker(shard: int, total: int, updates_queue) -> None:
+    """Proceso trabajador: atiende las actualizaciones de los usuarios de su shard"""
+    # El hilo escritor del logging no sobrevive al fork
+    setup_logging()
+    set_series_bot(SeriesBot(shard_path(DATA_FILE, shard, total), TMDBClient(TMDB_API_KEY, cache_dir=TMDB_CACHE_DIR)))
+    logger.info("Trabajador %s/%s iniciado con %s usuarios", shard, total, len(series_bot.data))
+    try:
+        asyncio.run(serve_worker(shard, total, updates_queue))
+    finally:
+        stop_logging()
+
+async def serve_worker(shard: int, total: int, updates_queue) -> None:
+    """Pasa a la aplicación las actualizaciones que le envía el proceso principal"""
+    application = build_application(shard, total, with_updater=False)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await post_init(application)
+        await application.start()
+        try:
+            while True:
+                payload = await loop.run_in_executor(None, updates_queue.get)
+                if payload is None:
+                    break
+                await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+        finally:
+            await application.stop()
+            await post_shutdown(application)
+            await close_shared_resources(series_bot.tmdb)
+
+def split_data_into_shards(total: int) -> None:
+    """Reparte el fichero de datos único entre los shards (solo la primera vez)"""
+    if any(os.path.exists(shard_path(DATA_FILE, i, total)) for i in range(total)):
+        return
+    shards = [{} for _ in range(total)]
+    for user_key, user_data in series_bot.iter_users():
+        shards[shard_for(int(user_key), total)][user_key] = user_data
+    # Los grupos van al shard de su chat, que es el que recibe sus actualizaciones
+    for chat_key, group in series_bot.iter_groups():
+        shards[shard_for(int(chat_key), total)][chat_key] = group
+    for i, shard_data in enumerate(shards):
+        write_json_atomic(shard_path(DATA_FILE, i, total), shard_data)
+    logger.info("Datos repartidos en %s shards", total)
+
+async def route_updates(queues: List) -> None:
+    """Proceso principal: recibe las actualizaciones y las reparte por usuario/chat"""
+    total = len(queues)
+    offset = None
+    async with Bot(TELEGRAM_TOKEN) as bot:
+        try:
+            while True:
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+                except Exception as e:
+                    logger.error("Error recibiendo actualizaciones: %s", e)
+                    await asyncio.sleep(5)
+                    continue
+                for update in updates:
+                    chat, user = update.effective_chat, update.effective_user
+                    key = chat.id if chat else (user.id if user else 0)
+                    queues[shard_for(key, total)].put(update.to_json())
+                    offset = update.update_id + 1
+        finally:
+            # Telegram solo olvida las actualizaciones al pedir las siguientes: sin esta
+            # confirmación, el próximo arranque volvería a repartir las últimas recibidas
+            if offset is not None:
+                try:
+                    await bot.get_updates(offset=offset, timeout=0)
+                except Exception as e:
+                    logger.warning("No se pudo confirmar la última actualización: %s", e)
+
+def run_sharded(total: int) -> None:
+    """Arranca un proceso trabajador por shard y reparte las actualizaciones entre ellos"""
+    split_data_into_shards(total)
+    context = multiprocessing.get_context("fork")
+    queues = [context.Queue() for _ in range(total)]
+    workers = [
+        context.Process(target=run_worker, args=(i, total, queues[i]), name=f"worker-{i}", daemon=True)
+        for i in range(total)
+    ]
+    # Los trabajadores cargan su propio shard: el proceso principal no necesita los datos
+    series_bot.data = {}
+    for worker in workers:
+        worker.start()
+    
+    logger.info("Bot iniciado con %s trabajadores...", total)
+    try:
+        asyncio.run(route_updates(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for q in queues:
+            q.put(None)
+        for worker in workers:
+            worker.join(timeout=30)
+
+def load_bot_configs(path: str) -> List[Dict]:
+    """Lee la lista de bots a alojar: [{"token", "language", "namespace"}, ...]"""
+    with open(path, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    if not isinstance(configs, list) or not configs:
+        raise ValueError(f"{path} debe contener una lista de bots")
+    namespaces = set()
+    for config in configs:
+        if not isinstance(config, dict) or not config.get('token'):
+            raise ValueError("cada bot necesita al menos un token")
+        config.setdefault('language', 'es-ES')
+        config.setdefault('namespace', "")
+        if config['namespace'] in namespaces or (len(configs) > 1 and not config['namespace']):
+            raise ValueError("con varios bots cada uno necesita un namespace distinto")
+        namespaces.add(config['namespace'])
+    return configs
+
+async def wait_for_lease(lease: LeaderLease, handover: bool = False) -> None:
+    """Espera a tomar una concesión que tiene otro proceso
+    
+    Con handover se le pide el relevo creando el fichero de relevo con nuestro
+    identificador (ver watch_handover).
+    """
+    handover_path = f"{lease.path}.handover"
+    deadline = time.monotonic() + HANDOVER_TIMEOUT
+    requested = False
+    while not lease.try_acquire():
+        if handover and not requested:
+            with open(handover_path, 'w', encoding='utf-8') as f:
+                f.write(lease.owner)
+            requested = True
+            logger.info("Pidiendo el relevo al proceso anterior...")
+        if time.monotonic() > deadline:
+            logger.warning("El proceso anterior no ha liberado %s; se espera a que caduque", lease.path)
+            deadline = float('inf')
+        await asyncio.sleep(HANDOVER_POLL_INTERVAL)
+    if handover:
+        # La petición ya está atendida (o el proceso anterior murió y la concesión caducó):
+        # si se quedara el fichero, el watch_handover de este proceso lo pararía
+        try:
+            os.remove(handover_path)
+        except FileNotFoundError:
+            pass
+    if requested:
+        logger.info("Concesión %s tomada tras el relevo", lease.path)
+
+async def watch_handover(lease: LeaderLease, stop: asyncio.Event) -> None:
+    """Para el proceso cuando otro pide el relevo (se ignoran peticiones propias)"""
+    handover_path = f"{lease.path}.handover"
+    while not stop.is_set():
+        try:
+            with open(handover_path, 'r', encoding='utf-8') as f:
+                requester = f.read().strip()
+        except FileNotFoundError:
+            requester = None
+        if requester is not None and requester != lease.owner:
+            logger.info("Relevo pedido por otro proceso (%s)", requester or "desconocido")
+            stop.set()
+            return
+        await asyncio.sleep(HANDOVER_POLL_INTERVAL)
+
+async def drain_applications(applications: List[Tuple[Application, SeriesBot]]) -> None:
+    """Parada ordenada: deja de recibir (si no se ha hecho ya), termina el trabajo en curso con plazo y guarda"""
+    deadline = time.monotonic() + DRAIN_DEADLINE
+    for application, _ in applications:
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+    
+    def pending() -> int:
+        queued = sum(application.update_queue.qsize() for application, _ in applications)
+        sending = sum(sum(application.bot.rate_limiter.get_metrics()['waiting'].values())
+                      for application, _ in applications if application.bot.rate_limiter)
+        return queued + len(loop_monitor.in_flight) + sending
+    
+    while pending() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if pending():
+        logger.warning("Plazo de parada agotado con %s tareas pendientes", pending())
+    
+    for application, bot in applications:
+        current_series_bot.set(bot)
+        try:
+            await asyncio.wait_for(application.stop(), timeout=max(deadline - time.monotonic(), 1.0))
+        except asyncio.TimeoutError:
+            logger.warning("La aplicación %s no terminó a tiempo", bot.namespace or "principal")
+        await post_shutdown(application)
+        bot.save_data()
+        try:
+            # Vuelca la persistencia de conversaciones
+            await application.shutdown()
+        except RuntimeError as e:
+            logger.error("Error cerrando la aplicación: %s", e)
+
+async def serve_bots(configs: List[Dict], handover: bool = False) -> None:
+    """Ejecuta uno o varios bots en el mismo bucle compartiendo el cliente de TMDB, su caché y el catálogo
+    
+    Hay dos concesiones: la de recepción (getUpdates) y la de datos. En un relevo
+    el proceso anterior suelta la recepción en cuanto deja de recibir y la de datos
+    cuando termina lo que tenía en curso y guarda. El nuevo empieza a recibir (las
+    actualizaciones se acumulan en la cola) al tomar la primera y carga los datos y
+    empieza a atenderlas al tomar la segunda, así que la recepción no se corta.
+    Lo caro (importar, abrir el catálogo, montar las aplicaciones) se hace antes.
+    """
+    namespaces = "-".join(ns for config in configs if (ns := config['namespace']))
+    polling_lease = LeaderLease("-".join(filter(None, ["polling", namespaces])))
+    data_lease = LeaderLease("-".join(filter(None, ["data", namespaces])))
+    applications = [
+        build_application(token=config['token'], namespace=config['namespace'], instance=instance)
+        for instance, config in enumerate(configs)
+    ]
+    if handover:
+        await wait_for_lease(polling_lease, handover=True)
+    elif not polling_lease.try_acquire() or not data_lease.try_acquire():
+        # Dos procesos con getUpdates a la vez se quitan las actualizaciones (409 Conflict)
+        polling_lease.release()
+        logger.error("Otro proceso está atendiendo este bot; usa --handover para relevarlo")
+        raise SystemExit(1)
+    polling_task = asyncio.create_task(polling_lease.keep_alive())
+    
+    for application in applications:
+        await application.updater.initialize()
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    
+    if handover:
+        await wait_for_lease(data_lease)
+    data_task = asyncio.create_task(data_lease.keep_alive())
+    
+    single = len(configs) == 1 and not configs[0]['namespace']
+    tmdb = get_series_bot().tmdb if single else TMDBClient(TMDB_API_KEY, cache_dir=TMDB_CACHE_DIR)
+    catalog = get_series_bot().catalog if single else CatalogIndex.open(CATALOG_FILE)
+    running: List[Tuple[Application, SeriesBot]] = []
+    for application, config in zip(applications, configs):
+        namespace = config['namespace']
+        if single and not handover:
+            bot = get_series_bot()
+        else:
+            bot = SeriesBot(namespaced(DATA_FILE, namespace), tmdb.with_language(config['language']),
+                            catalog=catalog, namespace=namespace)
+        if single:
+            set_series_bot(bot)
+        if handover:
+            # El estado de conversaciones se leyó al montar la aplicación, antes del relevo
+            application.persistence._load()
+        # Las tareas que crea la aplicación a partir de aquí heredan su SeriesBot
+        current_series_bot.set(bot)
+        await application.initialize()
+        await post_init(application)
+        await application.start()
+        running.append((application, bot))
+        logger.info("Bot %s (%s) iniciado con %s usuarios", namespace or "principal", config['language'],
+                    len(bot.data))
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    watcher = asyncio.create_task(watch_handover(polling_lease, stop))
+    await stop.wait()
+    watcher.cancel()
+    
+    # Primero se deja de recibir y se suelta la recepción para que el siguiente proceso
+    # empiece a recibir ya; después se termina el trabajo en curso y se guarda
+    for application, _ in running:
+        if application.updater.running:
+            await application.updater.stop()
+    polling_task.cancel()
+    try:
+        await polling_task
+    except asyncio.CancelledError:
+        pass
+    logger.info("Deteniendo: se termina el trabajo en curso...")
+    await drain_applications(running)
+    await close_shared_resources(tmdb)
+    # Solo ahora, con todo guardado, puede cargar los datos el proceso siguiente
+    data_task.cancel()
+    try:
+        await data_task
+    except asyncio.CancelledError:
+        pass
+    logger.info("Bot detenido")
+
+def main():
+    """Función principal del bot"""
+    parser = argparse.ArgumentParser(description="Bot de Telegram para seguimiento de series")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BOT_WORKERS", "1")),
+                        help="número de procesos trabajadores (usuarios repartidos por shard)")
+    parser.add_argument("--bots", default=os.environ.get("BOTS_CONFIG"),
+                        help="JSON con varios bots a alojar en este proceso (token, language, namespace)")
+    parser.add_argument("--handover", action="store_true",
+                        help="relevar sin cortes al proceso que está recibiendo actualizaciones")
+    args = parser.parse_args()
+    setup_logging()
     
-    # Iniciar bot
-    logger.info("Bot iniciado...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        if args.bots:
+            if args.workers > 1:
+                parser.error("--bots y --workers no se pueden combinar")
+            configs = load_bot_configs(args.bots)
+            # Cada bot carga sus propios datos: los del bot por defecto no hacen falta
+            series_bot.data = {}
+            logger.info("Iniciando %s bots...", len(configs))
+            asyncio.run(serve_bots(configs, args.handover))
+            return
+        if args.workers > 1:
+            run_sharded(args.workers)
+            return
+        
+        # Iniciar bot
+        logger.info("Bot iniciado...")
+        asyncio.run(serve_bots([{'token': TELEGRAM_TOKEN, 'language': 'es-ES', 'namespace': ""}], args.handover))
+    finally:
+        stop_logging()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
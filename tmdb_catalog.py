@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Índice local del catálogo de series de TMDB
+
+Se construye a partir de la exportación diaria de IDs de TMDB
+(tv_series_ids_MM_DD_YYYY.json.gz, NDJSON comprimido) y se guarda en un
+único fichero binario que se abre con mmap, de modo que buscar no
+requiere red ni cargar el catálogo en memoria.
+
+Uso:
+    python tmdb_catalog.py build tv_series_ids_10_19_2026.json.gz tmdb_catalog.idx
+    python tmdb_catalog.py search tmdb_catalog.idx "breaking bad"
+"""
+
+import gzip
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Formato del fichero (little-endian):
+#   cabecera | títulos | tokens | postings | cadenas
+# Los títulos se guardan ordenados por popularidad descendente, así que el
+# índice de un título es también su posición en el ranking y las listas de
+# postings (ordenadas de menor a mayor) ya salen ordenadas por popularidad.
+MAGIC = b"TSCAT01\n"
+HEADER = struct.Struct("<8sIIIIII")  # magic, n_titles, n_tokens, offsets de cada sección
+TITLE = struct.Struct("<IfIH2x")  # tmdb_id, popularidad, offset del nombre, longitud
+TOKEN = struct.Struct("<IH2xII")  # offset del token, longitud, primer posting, nº de postings
+POSTING = struct.Struct("<I")
+
+# Máximo de tokens distintos que se expanden con postings al buscar por prefijo
+# junto a otros términos; por encima se filtran los candidatos por su nombre
+MAX_PREFIX_EXPANSION = 64
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _normalize(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Normaliza un texto (minúsculas, sin tildes) y lo divide en tokens"""
+    return _TOKEN_RE.findall(_normalize(text))
+
+
+def fully_tokenized(text: str) -> bool:
+    """Indica si todas las letras y cifras del texto acaban en algún token
+
+    El índice solo conoce caracteres latinos: una consulta en otro alfabeto
+    perdería términos al tokenizarla y daría resultados que no corresponden.
+    """
+    return not any(c.isalnum() for c in _TOKEN_RE.sub("", _normalize(text)))
+
+
+def read_export(path: str) -> Iterable[Tuple[int, str, float]]:
+    """Lee la exportación diaria de TMDB y devuelve (id, nombre, popularidad)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                yield int(entry["id"]), str(entry.get("original_name") or ""), float(entry.get("popularity") or 0.0)
+            except (ValueError, KeyError, TypeError):
+                continue
+
+
+def build_index(entries: Iterable[Tuple[int, str, float]], output_path: str) -> int:
+    """Construye el fichero de índice y devuelve el número de títulos"""
+    titles = sorted((e for e in entries if e[1]), key=lambda e: -e[2])
+
+    strings = bytearray()
+    title_records = bytearray()
+    postings_by_token: Dict[str, List[int]] = {}
+
+    for index, (tmdb_id, name, popularity) in enumerate(titles):
+        encoded = name.encode("utf-8")[:0xFFFF]
+        title_records += TITLE.pack(tmdb_id, popularity, len(strings), len(encoded))
+        strings += encoded
+        for token in set(tokenize(name)):
+            postings_by_token.setdefault(token, []).append(index)
+
+    token_records = bytearray()
+    postings = bytearray()
+    posting_count = 0
+    for token in sorted(postings_by_token, key=lambda t: t.encode("utf-8")):
+        encoded = token.encode("utf-8")
+        token_postings = postings_by_token[token]
+        token_records += TOKEN.pack(len(strings), len(encoded), posting_count, len(token_postings))
+        strings += encoded
+        postings += struct.pack(f"<{len(token_postings)}I", *token_postings)
+        posting_count += len(token_postings)
+
+    titles_offset = HEADER.size
+    tokens_offset = titles_offset + len(title_records)
+    postings_offset = tokens_offset + len(token_records)
+    strings_offset = postings_offset + len(postings)
+    header = HEADER.pack(MAGIC, len(titles), len(postings_by_token),
+                         titles_offset, tokens_offset, postings_offset, strings_offset)
+
+    # Escritura atómica: el bot puede tener abierto el índice anterior
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for section in (header, title_records, token_records, postings, strings):
+            f.write(section)
+    os.replace(tmp_path, output_path)
+    return len(titles)
+
+
+class CatalogIndex:
+    """Índice de títulos en disco, abierto con mmap y consultado con búsqueda binaria"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_titles, self.n_tokens, self._titles_off,
+         self._tokens_off, self._postings_off, self._strings_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un índice de catálogo válido")
+
+    @classmethod
+    def open(cls, path: str) -> Optional["CatalogIndex"]:
+        """Abre el índice si existe y es válido"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def close(self) -> None:
+        """Libera el mmap y el fichero"""
+        self._mm.close()
+        self._file.close()
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings_off + offset
+        return self._mm[start:start + length]
+
+    def _token(self, index: int) -> Tuple[bytes, int, int]:
+        """Devuelve (token, primer posting, nº de postings) de la entrada index"""
+        token_off, token_len, post_start, post_count = TOKEN.unpack_from(
+            self._mm, self._tokens_off + index * TOKEN.size)
+        return self._string(token_off, token_len), post_start, post_count
+
+    def _title(self, index: int) -> Dict:
+        tmdb_id, popularity, name_off, name_len = TITLE.unpack_from(
+            self._mm, self._titles_off + index * TITLE.size)
+        return {
+            'id': tmdb_id,
+            'name': self._string(name_off, name_len).decode("utf-8", "replace"),
+            'popularity': popularity,
+            'first_air_date': ''
+        }
+
+    def _lower_bound(self, token: bytes) -> int:
+        """Primera entrada de tokens mayor o igual que token"""
+        lo, hi = 0, self.n_tokens
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._token(mid)[0] < token:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _token_span(self, token: str, prefix: bool) -> Tuple[int, int]:
+        """Entradas [primera, última) de los tokens iguales al dado o que empiezan por él"""
+        encoded = token.encode("utf-8")
+        first = self._lower_bound(encoded)
+        if prefix:
+            # Ningún token contiene 0xFF: todo lo que empieza por el prefijo queda antes
+            return first, self._lower_bound(encoded + b"\xff")
+        if first < self.n_tokens and self._token(first)[0] == encoded:
+            return first, first + 1
+        return first, first
+
+    def _posting_ranges(self, span: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Rangos (primer posting, nº) de las entradas de tokens del intervalo"""
+        return [self._token(index)[1:] for index in range(*span)]
+
+    def _iter_postings(self, post_start: int, post_count: int) -> Iterable[int]:
+        """Recorre una lista de postings sin copiarla entera"""
+        offset = self._postings_off + post_start * POSTING.size
+        for i in range(post_count):
+            yield POSTING.unpack_from(self._mm, offset + i * POSTING.size)[0]
+
+    def _postings(self, ranges: List[Tuple[int, int]]) -> Set[int]:
+        """Conjunto de títulos de varios rangos de postings"""
+        result: Set[int] = set()
+        for post_start, post_count in ranges:
+            start = self._postings_off + post_start * POSTING.size
+            result.update(struct.unpack_from(f"<{post_count}I", self._mm, start))
+        return result
+
+    def search(self, query: str, limit: int = 10) -> Optional[List[Dict]]:
+        """Busca títulos que contengan todos los términos; el último se trata como prefijo
+
+        Devuelve None si la consulta no se puede resolver con el índice (sin
+        términos o con caracteres que no indexa) y hay que preguntar a TMDB.
+        """
+        tokens = tokenize(query)
+        if not tokens or not fully_tokenized(query):
+            return None
+
+        spans = [self._token_span(token, prefix=i == len(tokens) - 1) for i, token in enumerate(tokens)]
+        if any(first == end for first, end in spans):
+            return []
+
+        if len(spans) == 1:
+            # Un solo término: las listas ya están ordenadas por popularidad, basta
+            # con mezclar las de todos los tokens del prefijo hasta llegar al límite
+            found: List[int] = []
+            for index in heapq.merge(*(self._iter_postings(*r) for r in self._posting_ranges(spans[0]))):
+                if not found or found[-1] != index:
+                    found.append(index)
+                    if len(found) == limit:
+                        break
+            return [self._title(i) for i in found]
+
+        # Un prefijo muy corto abarca demasiados tokens para leer sus postings:
+        # se resuelve después comprobando el nombre de los candidatos
+        prefix = tokens[-1]
+        prefix_span = spans[-1]
+        if prefix_span[1] - prefix_span[0] <= MAX_PREFIX_EXPANSION:
+            prefix = None
+        else:
+            spans.pop()
+
+        # Intersecar empezando por el término con menos postings
+        term_ranges = sorted((self._posting_ranges(span) for span in spans),
+                             key=lambda ranges: sum(count for _, count in ranges))
+        candidates = self._postings(term_ranges[0])
+        for ranges in term_ranges[1:]:
+            candidates &= self._postings(ranges)
+            if not candidates:
+                return []
+
+        # Menor índice = mayor popularidad
+        if prefix is None:
+            return [self._title(i) for i in heapq.nsmallest(limit, candidates)]
+        results = []
+        for index in sorted(candidates):
+            title = self._title(index)
+            if any(token.startswith(prefix) for token in tokenize(title['name'])):
+                results.append(title)
+                if len(results) == limit:
+                    break
+        return results
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) == 4 and argv[1] == "build":
+        started = time.perf_counter()
+        count = build_index(read_export(argv[2]), argv[3])
+        print(f"{count} series indexadas en {time.perf_counter() - started:.1f}s")
+        return 0
+    if len(argv) == 4 and argv[1] == "search":
+        index = CatalogIndex(argv[2])
+        started = time.perf_counter()
+        results = index.search(argv[3])
+        elapsed = (time.perf_counter() - started) * 1e6
+        if results is None:
+            print("La consulta no se puede resolver con el índice local")
+            return 1
+        for result in results:
+            print(f"{result['id']:>8}  {result['popularity']:>9.2f}  {result['name']}")
+        print(f"{len(results)} resultados en {elapsed:.0f}µs")
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
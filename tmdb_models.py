@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Modelos proyectados de las respuestas de TMDB
+
+Una respuesta de /tv/{id} trae temporadas, cadenas, productoras, creadores,
+géneros... y el bot solo usa unos pocos campos. Cada respuesta se reduce a su
+modelo nada más recibirla (o leerla de la caché en disco), así que lo que
+guardan las cachés y lo que reciben los manejadores es solo lo necesario.
+
+Los modelos son TypedDict: siguen siendo diccionarios (se guardan en JSON tal
+cual y el código puede seguir usando .get), pero con los campos declarados.
+Las proyecciones son idempotentes: proyectar un modelo devuelve el mismo modelo.
+"""
+
+from typing import Dict, List, Optional, TypedDict
+
+
+class NextEpisode(TypedDict):
+    air_date: Optional[str]
+    season_number: int
+    episode_number: int
+
+
+class TVDetails(TypedDict):
+    id: int
+    name: str
+    overview: str
+    first_air_date: str
+    last_air_date: Optional[str]
+    number_of_seasons: int
+    poster_path: Optional[str]
+    # "Returning Series", "In Production", "Planned", "Ended", "Canceled"...
+    status: str
+    in_production: bool
+    next_episode_to_air: Optional[NextEpisode]
+
+
+class SearchResult(TypedDict):
+    id: int
+    name: str
+    first_air_date: str
+
+
+class SeasonEpisodes(TypedDict):
+    season_number: int
+    # Números de episodio de la temporada
+    episodes: List[int]
+
+
+class ExternalIds(TypedDict):
+    imdb_id: Optional[str]
+    tvdb_id: Optional[int]
+
+
+class Translation(TypedDict):
+    language: str
+    name: str
+    overview: str
+
+
+def project_tv(data: Dict) -> TVDetails:
+    """Detalles de una serie con solo los campos que usa el bot"""
+    next_episode = data.get('next_episode_to_air')
+    return {
+        'id': data['id'],
+        'name': data.get('name') or '',
+        'overview': data.get('overview') or '',
+        'first_air_date': data.get('first_air_date') or '',
+        'last_air_date': data.get('last_air_date') or None,
+        'number_of_seasons': data.get('number_of_seasons') or 0,
+        'poster_path': data.get('poster_path') or None,
+        'status': data.get('status') or '',
+        'in_production': bool(data.get('in_production')),
+        'next_episode_to_air': {
+            'air_date': next_episode.get('air_date') or None,
+            'season_number': next_episode.get('season_number') or 0,
+            'episode_number': next_episode.get('episode_number') or 0
+        } if isinstance(next_episode, dict) else None
+    }
+
+
+def project_search_result(data: Dict) -> SearchResult:
+    return {
+        'id': data['id'],
+        'name': data.get('name') or '',
+        'first_air_date': data.get('first_air_date') or ''
+    }
+
+
+def project_season(season_number: int, data: Dict) -> SeasonEpisodes:
+    """Temporada reducida a lo que necesita el selector de episodios"""
+    numbers = []
+    for episode in data.get('episodes') or []:
+        number = episode.get('episode_number') if isinstance(episode, dict) else episode
+        if isinstance(number, int) and number > 0:
+            numbers.append(number)
+    return {'season_number': season_number, 'episodes': numbers}
+
+
+def project_external_ids(data: Dict) -> ExternalIds:
+    return {'imdb_id': data.get('imdb_id') or None, 'tvdb_id': data.get('tvdb_id') or None}
+
+
+def project_translations(data: Dict) -> Dict[str, List[Translation]]:
+    translations = []
+    for item in data.get('translations') or []:
+        if 'language' in item:
+            translations.append(item)
+            continue
+        fields = item.get('data') or {}
+        translations.append({
+            'language': f"{item.get('iso_639_1', '')}-{item.get('iso_3166_1', '')}",
+            'name': fields.get('name') or '',
+            'overview': fields.get('overview') or ''
+        })
+    return {'translations': translations}
+
+
+# Subrecursos de append_to_response y su proyección
+RESOURCE_PROJECTIONS = {
+    'external_ids': project_external_ids,
+    'translations': project_translations
+}
+
+
+def project_tv_response(data: Dict) -> Dict:
+    """Respuesta de /tv/{id} con append_to_response: detalles, subrecursos y temporadas proyectados"""
+    projected: Dict = dict(project_tv(data)) if 'id' in data else {}
+    for resource, project in RESOURCE_PROJECTIONS.items():
+        if isinstance(data.get(resource), dict):
+            projected[resource] = project(data[resource])
+    for key, value in data.items():
+        if key.startswith('season/') and isinstance(value, dict):
+            projected[key] = project_season(int(key.split('/', 1)[1]), value)
+    return projected
+
+
+def project_search_response(data: Dict) -> Dict[str, List[SearchResult]]:
+    return {'results': [project_search_result(item) for item in data.get('results') or [] if 'id' in item]}